@@ -4,6 +4,8 @@
 
 from Utils import get_config
 from os import listdir, makedirs
+import os
+import hashlib
 from os.path import isfile, join, exists
 from datetime import datetime
 import cv2
@@ -14,56 +16,203 @@ import cv2
 import logging
 import numpy as np
 import math
+import sys
 from Utils import get_config
 
 logger = logging.getLogger(__name__)
 
+## Counter of the items processed by the running process, see 'BeeProcess.itemProcessed'
+_processed = None
+
+## Events of the running process and its stop flag, see 'BeeProcess.processReady'
+_readyEvent = None
+_startEvent = None
+_stopFlag = None
+
+## Thread limit of the running process, see 'BeeProcess.getThreadLimit'
+_threads = None
+
 
 class BeeProcess(object):
+
+    ## Whether the process is ready as soon as it runs. Processes that need to
+    #  initialize first (e.g. load a model) call 'processReady' themselves.
+    READY_ON_START = True
+
+    ## The input and output ports of the process, mapping the port names used in the
+    #  pipeline config to the queue parameters of 'run', see 'Pipeline'
+    INPUTS = {}
+    OUTPUTS = {}
+
+    ## Maximum amount of workers of the process in a pipeline stage, None for no limit
+    MAX_WORKERS = 1
+
     def __init__(self):
         """! Initializes the defaults
         """
         self._stopped = multiprocessing.Value('i', 0)
         self._done = multiprocessing.Value('i', 0)
+        self._processed = multiprocessing.Value('L', 0, lock=False)
+        self._ready = multiprocessing.Event()
+        self._startEvent = None
+        self._cpus = None
+        self._threads = None
         self._process = None
         self._process_params = {}
         self._parentclass = self.__class__
         self._started = False
 
+        # Ports are unconnected by default
+        for param in list(self.INPUTS.values()) + list(self.OUTPUTS.values()):
+            self.set_process_param(param, None)
+
     def set_process_param(self, name, queue):
         self._process_params[name] = queue
 
+    def connect(self, port, queue, peers=()):
+        """! Connects a port of the process to a queue
+        @param port     The name of the port, see 'INPUTS' and 'OUTPUTS'
+        @param queue    The queue, or a 'QueueGroup' for outputs to several workers
+        @param peers    The processes at the other end, writing to the queue for input ports
+                        and reading from it for output ports
+        """
+        if port in self.INPUTS:
+            self.set_process_param(self.INPUTS[port], queue)
+        elif port in self.OUTPUTS:
+            self.set_process_param(self.OUTPUTS[port], queue)
+        else:
+            raise BaseException("%s has no port '%s'" % (self.__class__.__name__, port))
+
+    def getDefaultQueueSize(self, port):
+        """! Returns the size of the queues of an output port, if the pipeline config doesn't give one
+        @param port     The name of the output port
+        @return The maximum amount of queued items, 0 for no limit
+        """
+        return 0
+
+    def setCpus(self, cpus):
+        """! Restricts the process to the given CPUs
+        @param cpus     List of CPU ids, None to run on all CPUs
+        """
+        self._cpus = cpus
+
+    def setThreads(self, threads):
+        """! Limits the threads each library (OpenCV, BLAS, TensorFlow) uses within the process
+        @param threads  The maximum amount of threads, None to keep the defaults of the libraries
+        """
+        self._threads = threads
+
+    @staticmethod
+    def getThreadLimit():
+        """! Returns the thread limit of the running process, None if it is not limited
+        """
+        return _threads
+
+    @staticmethod
+    def _limitThreads(threads):
+        """! Limits the thread pools of the libraries, before the process uses them.
+             Libraries loaded later (e.g. TensorFlow) read the limit from the environment.
+        """
+        for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+            os.environ[name] = str(threads)
+        os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+        cv2.setNumThreads(threads)
+
+        # The BLAS library of numpy is already loaded, limit its threads if possible
+        try:
+            from threadpoolctl import threadpool_limits
+            threadpool_limits(threads)
+        except ImportError:
+            logger.debug("threadpoolctl is not installed, BLAS threads are not limited")
+
+    def setStartEvent(self, event):
+        """! Sets the event the process waits for after it got ready, see 'processReady'
+        @param event    A 'multiprocessing.Event', None to start working right away
+        """
+        self._startEvent = event
+
     def isDone(self):
         return self._done.value
 
     def isStarted(self):
         return self._started
 
-    def stop(self):
-        """! Forces the process to stop
+    def isReady(self):
+        """! Returns whether the process reported that it is ready
+        """
+        return self._ready.is_set()
+
+    def waitReady(self, timeout=None):
+        """! Waits until the process is ready
+        @param timeout  The maximum time to wait in seconds
+        @return True if the process is ready
+        """
+        return self._ready.wait(timeout)
+
+    def isRunning(self):
+        """! Returns whether the process is alive
         """
+        return self._process is not None and self._process.is_alive()
 
-        # Wait for process to stop
+    def isCrashed(self):
+        """! Returns whether the process ended without finishing its run, e.g. by an exception or a signal
+        """
+        return self._started and not self._process.is_alive() and self._done.value == 0
+
+    def getExitCode(self):
+        """! Returns the exit code of the process, None while it is running
+        """
+        return self._process.exitcode if self._process is not None else None
+
+    def getPid(self):
+        """! Returns the id of the running process or None if it is not started
+        """
+        return self._process.pid if self._process is not None else None
 
+    def getProcessedCount(self):
+        """! Returns the amount of items (e.g. frames) processed by the process so far
+        """
+        return self._processed.value
+
+    @staticmethod
+    def itemProcessed(count=1):
+        """! Increases the counter of processed items, called from within the running process
+        @param count    The amount of processed items
+        """
+        if _processed is not None:
+            _processed.value += count
+
+    @staticmethod
+    def processReady():
+        """! Reports that the running process is ready and waits for the start event,
+             called from within the running process once it is initialized
+        """
+        if _readyEvent is not None:
+            _readyEvent.set()
+        if _startEvent is not None:
+            while not _startEvent.wait(0.1) and _stopFlag.value == 0:
+                pass
+
+    def requestStop(self):
+        """! Asks the process to stop, without waiting for it
+        """
         self._stopped.value = 1
-        for i in range(100):
-            if self._done.value == 1:
-                break
-            time.sleep(0.01)
-        if self._done.value == 0:
+
+    def stop(self, timeout=1.0):
+        """! Stops the process, it gets terminated if it doesn't stop in time
+        @param timeout  The maximum time to wait for the process in seconds
+        """
+        self.requestStop()
+        if self._process is None:
+            return
+        self._process.join(timeout)
+        if self._process.is_alive():
             logger.warning("Terminating process after waiting for gracefully shutdown!")
             self._process.terminate()
-
-        for qn, q in self._process_params.items():
-            if q is not None:
-                try:
-                    while not q.empty():
-                        q.get()
-                except:
-                    pass
+            self._process.join(timeout)
 
     def join(self):
-        if self._stopped.value == 0 and self._done.value == 0 and self._started:
+        if self._started:
             self._process.join()
 
     @staticmethod
@@ -73,14 +222,36 @@ class BeeProcess(object):
 
     @staticmethod
     def _run(args):
+        global _processed, _readyEvent, _startEvent, _stopFlag, _threads
 
         parent = args["parent"]
         stopped = args["stopped"]
         done = args["done"]
+        _processed = args.pop("processed")
+        _readyEvent = args.pop("ready")
+        _startEvent = args.pop("start")
+        _stopFlag = stopped
+        cpus = args.pop("cpus")
+        if cpus is not None:
+            os.sched_setaffinity(0, cpus)
+        _threads = args.pop("threads")
+        if _threads is not None:
+            BeeProcess._limitThreads(_threads)
         try:
+            if parent.READY_ON_START:
+                BeeProcess.processReady()
             parent.run(**args)
         except KeyboardInterrupt as ki:
             logger.debug(">> Received KeyboardInterrupt")
+        except Exception:
+            logger.exception("%s crashed" % (parent.__name__,))
+            sys.exit(1)
+        finally:
+            # Don't wait for the queued items to be sent when exiting,
+            # nobody might read them anymore
+            for value in args.values():
+                if hasattr(value, "cancel_join_thread"):
+                    value.cancel_join_thread()
 
         stopped.value = 1
         done.value = 1
@@ -93,58 +264,43 @@ class BeeProcess(object):
         args["parent"] = self._parentclass
         args["stopped"] = self._stopped
         args["done"] = self._done
+        args["processed"] = self._processed
+        args["ready"] = self._ready
+        args["start"] = self._startEvent
+        args["cpus"] = self._cpus
+        args["threads"] = self._threads
 
         self._process = multiprocessing.Process(target=self._run, \
                                                 args=[args])
         self._process.start()
         self._started = True
 
-class BeeClassification(BeeProcess):
-    """! The 'BeeClassification' class provides access to the neural network
-          that runs as a separate process. It provides two queue-objects,
-          one to queue to incoming images that have to be processed by the
-          neural network and a second one, where the results are put.
-    """
-
-    def __init__(self):
-
-        """! Initializes the neural network and the queues
+    def restart(self):
+        """! Starts the process again after it ended, with the same parameters and counters.
+             Queues it left broken have to be replaced before, see 'Pipeline.repairQueues'.
         """
-        super().__init__()
-
-        # reports when the porcess with the neural network is ready
-        self._ready = multiprocessing.Value('i', 0)
-        self.set_process_param("ready", self._ready)
-
-        # The queue for the incoming images
-        self._q_in = multiprocessing.Queue(maxsize=20)
-        self.set_process_param("q_in", self._q_in)
+        self._process.join()
+        self._stopped.value = 0
+        self._done.value = 0
+        self._ready.clear()
+        self.start()
 
-        ## The queue where the results are reported
-        self._q_out = multiprocessing.Queue()
-        self.set_process_param("q_out", self._q_out)
 
-        # Start the process and wait for it to run
-        self.start()
-        while self._ready.value == 0:
-            time.sleep(5)
-            logger.info("Waiting for neural network, may take 1-2 minutes")
-        logger.debug("Classification terminated")
-
-    def getQueue(self):
-        """! Returns the queue-object for the incoming queue
-        @return  Returns the incoming queue object
-        """
-        return self._q_in
+class BeeClassification(BeeProcess):
+    """! The 'BeeClassification' class provides access to the neural network
+          that runs as a separate process. It reads the incoming images that have
+          to be processed by the neural network from the "images" port and puts
+          the results to the "results" port. Several classifiers may share the work.
+    """
 
-    def getResultQueue(self):
-        """! Returns the queue-object which holds the classification results
-        @return  Returns the result queue object
-        """
-        return self._q_out
+    ## The process is ready once the network is loaded and ran once
+    READY_ON_START = False
+    INPUTS = {"images": "q_in"}
+    OUTPUTS = {"results": "q_out"}
+    MAX_WORKERS = None
 
     @staticmethod
-    def run(q_in, q_out, ready, parent, stopped, done):
+    def run(q_in, q_out, parent, stopped, done):
         """! Static method, starts a new process that runs the neural network
         """
 
@@ -154,18 +310,27 @@ class BeeClassification(BeeProcess):
         _process_time = 0
         _process_cnt = 0
 
+        # Use the thread limit of the process, one operation at a time
+        threads = BeeProcess.getThreadLimit()
+        if threads is not None:
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+
         # Enable growth of GPU usage
         config = tf.compat.v1.ConfigProto()
+        if threads is not None:
+            config.intra_op_parallelism_threads = threads
+            config.inter_op_parallelism_threads = 1
         config.gpu_options.allow_growth = True
         config.gpu_options.per_process_gpu_memory_fraction = 0.75  # added to limit GPU memory usage
         session = tf.compat.v1.InteractiveSession(config=config)
 
-        # Load the model
+        # Load the model, from the cache if possible
+        _load_t = time.time()
         try:
-            _model = tf.keras.models.load_model(get_config("NN_MODEL_FOLDER"))
+            _model = load_model(get_config("NN_MODEL_FOLDER"), get_config("NN_MODEL_CACHE"))
             _model.trainable = False
         except Exception as e:
-            ready.value = True
             logger.error("Failed to load Model: %s" % (e,))
             return
 
@@ -177,24 +342,14 @@ class BeeClassification(BeeProcess):
             img_height = 150
             img_width = 75
 
-        # Initialize the network by using it
-        if True:
-
-            # Load all images from the "Images" folder and feed them to the neural network
-            # This ensures that the network is fully running when we start other processes
-            test_images = ["Images/"+f for f in listdir("Images") if isfile(join("Images", f))]
-            imgs = []
-            for item in test_images:
-                img = tf.io.read_file(item)
-                img = tf.image.decode_jpeg(img, channels=3)
-                img = tf.image.resize(img, [img_height, img_width])
-                imgs.append(img)
-
-            # Perform prediction
-            _model.predict_on_batch(tf.convert_to_tensor(imgs))
+        # Initialize the network by using it with the batch sizes used below (1-5),
+        # so it is fully running when the first images arrive
+        for n in range(5, 0, -1):
+            _model.predict_on_batch(tf.zeros((n, img_height, img_width, 3)))
+        logger.info("Neural network ready after %0.1fs" % (time.time() - _load_t,))
 
         # Mark process as ready
-        ready.value = True
+        BeeProcess.processReady()
 
         # Create folders to store images with positive results
         if get_config("SAVE_DETECTION_IMAGES"):
@@ -204,75 +359,134 @@ class BeeClassification(BeeProcess):
                     makedirs(join(s_path, lbl))
 
         classify_thres = get_config("CLASSIFICATION_THRESHOLDS")
+
+        # Maximum time to block on an empty queue before checking the stop flag again
+        _queue_timeout = get_config("QUEUE_READ_TIMEOUT")
+
         while stopped.value == 0:
 
-            # While the image classification queue is not empty
-            # feed the images to the network and push the result
-            # back in the outgoing queue
-            if not q_in.empty():
-                _start_t = time.time()
-                _process_cnt += 1
-
-                images = []
-                images_orig = []
-                tracks = []
-
-                # Load the images from the in-queue and prepare them for the use in the network
-                failed = False
-                while len(images) < 5 and stopped.value == 0:
-                    try:
-                        item = q_in.get(block=False)
-                    except queue.Empty:
-                        item = None
-                        break
-
-                    if not item is None:
-                        t, img, frame_id = item
-                        images_orig.append(img)
-                        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                        if img.shape != (img_height, img_width, 3):
-                            img = tf.image.resize(img, [img_height, img_width])
-                        images.append(img)
-                        tracks.append((t, frame_id))
-
-                # Quit process if requested
-                if stopped.value != 0:
-                    return
-
-                # Feed collected images to the network
-                if len(tracks):
-                    results = _model.predict_on_batch(tf.convert_to_tensor(images))
-
-                    # precess results
-                    for num, t_data in enumerate(tracks):
-
-                        track, frame_id = t_data
-
-                        # Create dict with results
-                        entry = set([])
-                        for lbl_id, lbl in enumerate(["varroa"]):
-                            if results[lbl_id][num][0] > classify_thres[lbl]:
-                                entry.add(lbl)
-
-                                # Save the corresponding image on disc
-                                if get_config("SAVE_DETECTION_IMAGES") and lbl in get_config("SAVE_DETECTION_TYPES"):
-
-                                    img = images_orig[num]
-                                    cv2.imwrite(get_config("SAVE_DETECTION_PATH") + "/%s/%i-%s-%i.jpeg" % (lbl, _process_cnt, \
-                                            datetime.now().strftime("%Y%m%d-%H%M%S"), frame_id), img)
-
-                        # Push results back
-                        q_out.put((tracks[num][0], entry))
-
-                _end_t = time.time() - _start_t
-                logger.debug("Process time: %0.3fms - Queued: %i, processed %i" % (_end_t * 1000.0, q_in.qsize(), len(images)))
-                _process_time += _end_t
-            else:
-                time.sleep(0.5)
+            # Wait for the first image, then feed all queued images to
+            # the network and push the result back in the outgoing queue
+            try:
+                item = q_in.get(timeout=_queue_timeout)
+            except queue.Empty:
+                continue
+
+            _start_t = time.time()
+            _process_cnt += 1
+
+            images = []
+            images_orig = []
+            tracks = []
+
+            # Load the images from the in-queue and prepare them for the use in the network
+            while not item is None and stopped.value == 0:
+                t, img, frame_id = item
+                images_orig.append(img)
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+                if img.shape != (img_height, img_width, 3):
+                    img = tf.image.resize(img, [img_height, img_width])
+                images.append(img)
+                tracks.append((t, frame_id))
+
+                # Collect up to 5 images, but do not wait for more
+                if len(images) >= 5:
+                    break
+                try:
+                    item = q_in.get(block=False)
+                except queue.Empty:
+                    item = None
+
+            # Quit process if requested
+            if stopped.value != 0:
+                return
+
+            # Feed collected images to the network
+            if len(tracks):
+                results = _model.predict_on_batch(tf.convert_to_tensor(images))
+
+                # precess results
+                for num, t_data in enumerate(tracks):
+
+                    track, frame_id = t_data
+
+                    # Create dict with results
+                    entry = set([])
+                    for lbl_id, lbl in enumerate(["varroa"]):
+                        if results[lbl_id][num][0] > classify_thres[lbl]:
+                            entry.add(lbl)
+
+                            # Save the corresponding image on disc
+                            if get_config("SAVE_DETECTION_IMAGES") and lbl in get_config("SAVE_DETECTION_TYPES"):
+
+                                img = images_orig[num]
+                                cv2.imwrite(get_config("SAVE_DETECTION_PATH") + "/%s/%i-%s-%i.jpeg" % (lbl, _process_cnt, \
+                                        datetime.now().strftime("%Y%m%d-%H%M%S"), frame_id), img)
+
+                    # Push results back
+                    q_out.put((tracks[num][0], entry))
+                BeeProcess.itemProcessed(len(tracks))
+
+            _end_t = time.time() - _start_t
+            logger.debug("Process time: %0.3fms - Queued: %i, processed %i" % (_end_t * 1000.0, q_in.qsize(), len(images)))
+            _process_time += _end_t
         logger.info("Classification stopped")
 
 
-def detect_bees(frame, scale):
+def load_model(folder, cache_folder=None):
+    """! Loads the Keras model of the neural network. Loading the SavedModel restores
+         all of its traced functions, which takes long. The loaded model is therefore
+         cached in the HDF5 format, which only stores the layers and weights. The cache
+         is used as long as the SavedModel and the TensorFlow version are the same.
+    @param folder       The folder of the SavedModel
+    @param cache_folder The folder to cache the model in, None to always load the SavedModel
+    @return The model
+    """
+    import tensorflow as tf
+
+    if cache_folder is None:
+        return tf.keras.models.load_model(folder)
+
+    # Identify the SavedModel by its files
+    key = hashlib.sha1(tf.__version__.encode())
+    for root, dirs, files in sorted(os.walk(folder)):
+        for name in sorted(files):
+            stat = os.stat(join(root, name))
+            key.update(("%s:%i:%i" % (join(root, name), stat.st_size, int(stat.st_mtime))).encode())
+    cache_file = join(cache_folder, "model-%s.h5" % (key.hexdigest()[0:16],))
+
+    if exists(cache_file):
+        try:
+            model = tf.keras.models.load_model(cache_file, compile=False)
+            logger.info("Model loaded from cache '%s'" % (cache_file,))
+            return model
+        except Exception as e:
+            logger.warning("Failed to load the cached model '%s': %s" % (cache_file, e))
+
+    model = tf.keras.models.load_model(folder)
+    try:
+        if not exists(cache_folder):
+            makedirs(cache_folder)
+
+        # Write to a temporary file first, so an interrupted write is never used
+        temp_file = cache_file[:-3] + ".tmp.h5"
+        model.save(temp_file, include_optimizer=False)
+        os.replace(temp_file, cache_file)
+        logger.info("Model cached in '%s'" % (cache_file,))
+    except Exception as e:
+        logger.warning("Failed to cache the model in '%s': %s" % (cache_file, e))
+    return model
+
+
+def detect_bees(frame, scale, mask=None, resolution=1.0):
+    """! Detects bees and groups of bees in the given frame
+    @param frame        The frame to detect the bees in
+    @param scale        The scale factor applied to the resulting ellipses
+    @param mask         Optional mask, only pixels that are non-zero in the mask are considered
+    @param resolution   The resolution of the frame relative to the 320x180 frame the detection
+                        settings are given for, e.g. 0.5 for a downscaled frame
+    @return tuple (bees, groups) with lists of ellipses
+    """
 
     # Helper method to calculate distance between ellipses
     def near(p1,p2):
@@ -289,13 +503,18 @@ def detect_bees(frame, scale):
     o = 255 - (g - v)
 
     # Blur Image and perform a binary thresholding
-    o = cv2.GaussianBlur(o, (9,9), 9)
+    blur = max(3, int(9 * resolution) | 1)
+    o = cv2.GaussianBlur(o, (blur,blur), 9 * resolution)
     _, o = cv2.threshold(o, get_config("BINARY_THRESHOLD_VALUE"), \
             get_config("BINARY_THRESHOLD_MAX"), cv2.THRESH_BINARY)
 
     # Invert result
     o = 255 -o
 
+    # Ignore everything outside of the region of interest
+    if mask is not None:
+        o = cv2.bitwise_and(o, mask)
+
     # Detect contours
     contours, hierarchy = cv2.findContours(o, cv2.RETR_LIST, cv2.CHAIN_APPROX_TC89_KCOS)
     ellipses = []
@@ -306,10 +525,10 @@ def detect_bees(frame, scale):
             # Fit ellipse
             e = cv2.fitEllipse(contours[i])
             # Skip too small detections
-            if e[1][0] < 8 or e[1][1] < 8:
+            if e[1][0] < 8 * resolution or e[1][1] < 8 * resolution:
                 continue
             # Only use ellipses with minium size
-            ellipseArea = area(e)
+            ellipseArea = area(e) / (resolution * resolution)
             if ellipseArea > get_config("DETECT_ELLIPSE_AREA_MIN_SIZE") \
                     and ellipseArea < get_config("DETECT_ELLIPSE_AREA_MAX_SIZE"):
 
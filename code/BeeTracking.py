@@ -6,7 +6,7 @@
 #        The 'BeeTracker' combine all bee-tracks and provides access
 #        to them including updates of tracks and drawing the current tracks
 
-from filterpy.common import kinematic_kf
+from filterpy.common import kinematic_kf, Q_discrete_white_noise
 from collections import deque
 import numpy as np
 import math
@@ -19,6 +19,41 @@ from Utils import loadNames, variance_of_laplacian, pointInEllipse, get_config
 
 logger = logging.getLogger(__name__)
 
+## Functions called with (track, tag) each time a track gets a new tag, see 'add_tag_listener'
+_tagListeners = []
+
+
+def add_tag_listener(listener):
+    """! Registers a function that is called each time a track gets a tag for the first time,
+         e.g. to record a clip when a bee with varroa mites is detected
+    @param  listener    Function taking the arguments (track, tag)
+    """
+    _tagListeners.append(listener)
+
+
+def kinematic_transition(dt):
+    """! Returns the state transition matrix of the kalman filter for the given time step.
+    The state is ordered by dimension [x, vx, ax, y, vy, ay] (constant acceleration model)
+    @param  dt  The time step, in frames of the nominal tracking frame rate
+    @return The 6x6 transition matrix F
+    """
+    f = np.array([[1, dt, 0.5 * dt**2],
+                  [0, 1,  dt],
+                  [0, 0,  1]])
+    F = np.zeros((6, 6))
+    F[0:3, 0:3] = f
+    F[3:6, 3:6] = f
+    return F
+
+
+def kinematic_process_noise(dt):
+    """! Returns the process noise matrix of the kalman filter for the given time step
+    (piecewise white noise model, state ordered by dimension [x, vx, ax, y, vy, ay])
+    @param  dt  The time step, in frames of the nominal tracking frame rate
+    @return The 6x6 process noise matrix Q
+    """
+    return Q_discrete_white_noise(dim=3, dt=dt, var=1, block_size=2, order_by_dim=True)
+
 
 class BeeTrack():
 
@@ -40,14 +75,7 @@ class BeeTrack():
         self.dt = 1
         self.KF = kinematic_kf(dim=2, order=2, dt=self.dt, dim_z=1, order_by_dim=True)
         self.KF.R *= 2
-        self.KF.Q = np.array(
-                         [[self.dt**4/4,     self.dt**3/2,   self.dt**4/2,    0,0,0 ],
-                          [self.dt**3/2,     self.dt**2,     self.dt**4,      0,0,0 ],
-                          [self.dt**3/1,     self.dt**1,     self.dt**1/2,    0,0,0 ],
-                          [0,0,0, self.dt**4/4,     self.dt**3/2,   self.dt**4/2 ],
-                          [0,0,0, self.dt**3/2,     self.dt**2,     self.dt**4   ],
-                          [0,0,0, self.dt**3/1,     self.dt**1,     self.dt**1/2 ]
-                     ])
+        self.KF.Q = kinematic_process_noise(self.dt)
 
         # Keep track of the
         self.trace = deque(maxlen=get_config("MAX_BEE_TRACE_LENGTH"))
@@ -84,10 +112,12 @@ class BeeTrack():
             self.__tagCnts[tag] = 0
         self.__tagCnts[tag] += 1
 
-        # Report to statistics
+        # Report to statistics and listeners
         if tag not in self.reported_tags:
             _dh = getStatistics()
             _dh.addClassificationResultByTag(self.trackId, tag)
+            for listener in _tagListeners:
+                listener(self, tag)
 
         # Add the tag
         self.tags |= set((tag,))
@@ -114,13 +144,6 @@ class BeeTrack():
             self.first_position = position
         self.trace.append(position)
 
-    def predict(self):
-        """! Perform the kalman prediction
-        """
-        self.KF.predict()
-        self.last_predict = self.KF.x
-        return self.KF.x
-
     def correct(self, position):
         """! Perform the kalman correction
         @param  position    The actual position of the bee, to correct to
@@ -133,8 +156,10 @@ class BeeTracker(object):
     """! The 'BeeTracker' manages all 'BeeTrack' instances.
     """
 
-    def __init__(self, dist_threshold, max_frame_skipped, frame_size=(960, 540)):
+    def __init__(self, dist_threshold, max_frame_skipped, frame_size=(960, 540), statistics=None):
         """! Initializes the 'BeeTracker'
+        @param statistics   The 'Statistics' counting the bees in and out, the shared one of
+                            'getStatistics' if None. A tracker sent through a queue has to use it.
         """
         super(BeeTracker, self).__init__()
         self.dist_threshold = dist_threshold
@@ -142,9 +167,14 @@ class BeeTracker(object):
         self.trackId = 0
         self.tracks = []
         self.names = loadNames()
+        self._statistics = statistics
         self._frame_height = frame_size[1]
         self._frame_width = frame_size[0]
 
+        # Timestamp of the last update, used to calculate the time step of the predictions
+        self._lastTimestamp = None
+        self._frameRate = get_config("TRACKING_FRAME_RATE")
+
 
         # Create random track colors
         self.track_colors = []
@@ -161,87 +191,6 @@ class BeeTracker(object):
                 return item
         return None
 
-    def drawTracks(self, frame):
-        """! Draw the current tracker status on the given frame.
-        Draw tracks, names, ids, groups etc, depending on the configuration
-        @param  frame   The frame to draw on
-        @return The resulting frame
-        """
-
-        # Draw tracks and detections
-        for j in range(len(self.tracks)):
-
-            # Only Draw tracks that have more than 1 waypoints
-            if len(self.tracks[j].trace) > 1:
-
-                # Select a track color
-                t_c = self.track_colors[self.tracks[j].trackId % len(self.track_colors)]
-
-                # Draw marker that shows tracks underneath groups
-                if get_config("DRAW_GROUP_MARKER") and self.tracks[j].in_group:
-                    x = int(self.tracks[j].trace[-1][0])
-                    y = int(self.tracks[j].trace[-1][1])
-                    tl = (x-30,y-30)
-                    br = (x+30,y+30)
-                    cv2.rectangle(frame,tl,br,(0,0,0),10)
-
-                # Draw rectangle over last position
-                if get_config("DRAW_RECTANGLE_OVER_LAST_POSTION"):
-                    x = int(self.tracks[j].trace[-1][0])
-                    y = int(self.tracks[j].trace[-1][1])
-                    tl = (x-10,y-10)
-                    br = (x+10,y+10)
-                    cv2.rectangle(frame,tl,br,t_c,1)
-
-                # Draw trace
-                if get_config("DRAW_TRACK_TRACE"):
-                    for k in range(len(self.tracks[j].trace)):
-                        x = int(self.tracks[j].trace[k][0])
-                        y = int(self.tracks[j].trace[k][1])
-
-                        if k > 0:
-                            x2 = int(self.tracks[j].trace[k-1][0])
-                            y2 = int(self.tracks[j].trace[k-1][1])
-                            cv2.line(frame,(x,y), (x2,y2), t_c, 4)
-                            cv2.line(frame,(x,y), (x2,y2), (0,0,0), 1)
-
-                # Draw prediction
-                if get_config("DRAW_TRACK_PREDICTION"):
-                    x = int(self.tracks[j].last_predict[0])
-                    y = int(self.tracks[j].last_predict[3])
-                    cv2.circle(frame,(x,y), self.dist_threshold, (0,0,255), 1)
-
-                # Draw velocity, acceleration
-                if get_config("DRAW_ACCELERATION") or get_config("DRAW_VELOCITY"):
-                    l_p = self.tracks[j].last_predict
-
-                    l_px = int(l_p[0])
-                    v_px = int(l_p[1])*10 + l_px
-                    a_px = int(l_p[2])*10 + l_px
-                    l_py = int(l_p[3])
-                    v_py = int(l_p[4])*10 + l_py
-                    a_py = int(l_p[5])*10 + l_py
-
-                x = int(self.tracks[j].trace[-1][0])
-                y = int(self.tracks[j].trace[-1][1])
-                if "varroa" in self.tracks[j].tags:
-                    cv2.circle(frame, (x-10, y-50), 9, (0, 0, 255), -1)
-                    cv2.circle(frame, (x-10, y-50), 10, (0, 0, 0), 2)
-
-                # Add Track Id
-                if get_config("DRAW_TRACK_ID"):
-                    cv2.putText(frame, str(self.tracks[j].trackId) + " " + \
-                            self.tracks[j]._name, (x,y-30),
-                            cv2.FONT_HERSHEY_DUPLEX, 1, (255,255,255))
-        # Draw count of bees
-        if get_config("DRAW_IN_OUT_STATS"):
-            _dh = getStatistics()
-            bees_in, bees_out = _dh.getBeeCountOverall()
-            cv2.putText(frame,"In: %i, Out: %i" % (bees_in, bees_out), (50,50),
-                cv2.FONT_HERSHEY_SIMPLEX, 2, (0,0,0), 5)
-
-        return frame
-
     def getLastBeePositions(self, frame_step):
         """! Returns a list of all tracks last positions
         @param frame_step   Only return those positions for every 'frame_step' frames processed
@@ -270,7 +219,7 @@ class BeeTracker(object):
         """
         track = self.tracks[trackId]
         if count:
-            _dh = getStatistics()
+            _dh = self._statistics or getStatistics()
 
             # Y-Position of first detection
             f_y = track.first_position[1]
@@ -291,8 +240,52 @@ class BeeTracker(object):
 
         del self.tracks[trackId]
 
-    def update(self, detections: list, groups: list):
+    def _timeStep(self, timestamp):
+        """! Returns the time step since the last update in frames of the nominal tracking frame rate
+        @param  timestamp   The timestamp of the current frame in seconds, or None
+        @return The time step, 1 if no usable timestamp is available
+        """
+        dt = 1
+        if timestamp is not None:
+            if self._lastTimestamp is not None and timestamp > self._lastTimestamp:
+                dt = (timestamp - self._lastTimestamp) * self._frameRate
+            self._lastTimestamp = timestamp
+        return dt
+
+    def _predictAll(self, dt):
+        """! Performs the kalman prediction for all tracks at once
+        @param  dt  The time step in frames of the nominal tracking frame rate
+        """
+        if not len(self.tracks):
+            return
+
+        F = kinematic_transition(dt)
+        Q = kinematic_process_noise(dt)
+
+        # Predict the state and covariance of all tracks in one go
+        X = np.stack([t.KF.x for t in self.tracks])
+        P = np.stack([t.KF.P for t in self.tracks])
+        X = np.matmul(F, X)
+        P = np.matmul(np.matmul(F, P), F.T) + Q
+
+        for num, track in enumerate(self.tracks):
+            kf = track.KF
+            kf.F = F
+            kf.Q = Q
+            kf.x = X[num]
+            kf.P = P[num]
+            kf.x_prior = kf.x.copy()
+            kf.P_prior = kf.P.copy()
+            track.dt = dt
+            track.last_predict = kf.x
+
+    def update(self, detections: list, groups: list, timestamp=None):
         """! Update all the tracks with the given list of detections.
+        @param  detections  The detected bees
+        @param  groups      The detected groups of bees
+        @param  timestamp   The timestamp of the frame in seconds, used to predict the tracks
+                            over the actual time passed since the last update. If None,
+                            one nominal frame is assumed.
         """
         # Convert ellipses to numpy array
         tmp  = np.zeros((len(detections), 5))
@@ -311,9 +304,8 @@ class BeeTracker(object):
             self.tracks[t].skipped_frames = 0
             self.tracks[t].processed_frames += 1
 
-        # Calculate the distance on each track to the detections
-        dist_list = []
-        for num_t, item_t in enumerate(self.tracks):
+        # Prepare the tracks
+        for item_t in self.tracks:
 
             # Check whether this track is under a group of bees
             item_t.in_group = False
@@ -333,7 +325,13 @@ class BeeTracker(object):
                 item_t.KF.x[5] = item_t.KF.x[5] * 0.5
                 item_t.skipped_frames -= 1
 
-            pred = item_t.predict()
+        # Predict all tracks over the time passed since the last update
+        self._predictAll(self._timeStep(timestamp))
+
+        # Calculate the distance on each track to the detections
+        dist_list = []
+        for num_t, item_t in enumerate(self.tracks):
+            pred = item_t.last_predict
             for num_d, item_d in enumerate(detections):
 
                 #  match with tracks last position
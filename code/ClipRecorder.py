@@ -0,0 +1,285 @@
+##
+# @file ClipRecorder.py
+#
+# @brief Records clips around events (e.g. varroa detections) from an in-memory pre-roll buffer.
+
+from threading import Thread, Condition
+from collections import deque
+from datetime import datetime
+import os
+import time
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ClipRecorder(Thread):
+    """! The 'ClipRecorder' keeps the frames of the last seconds JPEG encoded in a ring buffer.
+         When an event is triggered, the buffered frames (pre-roll) and the frames of
+         the following seconds (post-roll) are written to a clip file. Events during a
+         running clip extend it, up to a maximum length.
+
+         Frames are handed over without blocking, the encoding runs in this thread and
+         the clips are written by a separate writer thread. The buffer is bounded by
+         its duration, frames waiting for encoding are dropped when the encoder falls
+         behind. The memory of the buffer, the running clip and the clips waiting for
+         the writer is bounded in bytes: the buffer drops its oldest frames, a running
+         clip ends early and no clip starts while the writer holds too much.
+
+         The frames are passed by reference, they must not be modified afterwards.
+    """
+
+    def __init__(self, folder, pre_roll, post_roll, max_length=60, quality=80, max_bytes=64*1024*1024, codec="MJPG"):
+        """! Initializes the recorder thread
+        @param folder       The folder to write the clips to
+        @param pre_roll     Seconds recorded before the event
+        @param post_roll    Seconds recorded after the event
+        @param max_length   Maximum length of a clip in seconds
+        @param quality      The JPEG quality of the buffered frames (0-100)
+        @param max_bytes    Maximum size of the buffered frames and clips in bytes
+        @param codec        The fourcc code of the codec used for the clips
+        """
+        Thread.__init__(self, daemon=True)
+        self.stopped = False
+        self._folder = folder
+        self._preRoll = pre_roll
+        self._postRoll = post_roll
+        self._maxLength = max_length
+        self._quality = quality
+        self._maxBytes = max_bytes
+        self._condition = Condition()
+
+        # Frames waiting to be encoded, only the newest few are kept
+        self._pending = deque(maxlen=4)
+        self._dropped = 0
+
+        # The ring buffer of encoded frames (frame_t, jpeg) and its size in bytes
+        self._buffer = deque()
+        self._bufferBytes = 0
+
+        # The running clip: its name, frames, their size and the timestamp it ends.
+        # The clip starts with the buffered frames and gets each frame the buffer gets,
+        # so the frames of the buffer are always part of it.
+        self._events = []
+        self._clip = None
+        self._clipBytes = 0
+        self._clipName = None
+        self._clipStart = None
+        self._clipEnd = None
+
+        self._writer = ClipWriter(codec)
+
+    def addFrame(self, frame, frame_t):
+        """! Hands a frame over for buffering, never blocks
+        @param frame    The frame
+        @param frame_t  The timestamp of the frame in seconds
+        """
+        with self._condition:
+            if len(self._pending) == self._pending.maxlen:
+                self._dropped += 1
+            self._pending.append((frame, frame_t))
+            self._condition.notify()
+
+    def trigger(self, name):
+        """! Starts a clip, or extends the running one, with the next frame
+        @param name     Describes the event, it becomes part of the file name
+        """
+        with self._condition:
+            self._events.append(name)
+
+    def run(self):
+        """! Encodes the frames and collects the clips until the recorder gets stopped
+        """
+        self._writer.start()
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._pending) or self.stopped)
+                if not len(self._pending):
+                    break
+                frame, frame_t = self._pending.popleft()
+                events = self._events
+                self._events = []
+
+            ret, jpeg = cv2.imencode(".jpeg", frame, [cv2.IMWRITE_JPEG_QUALITY, self._quality])
+            if not ret:
+                continue
+            self._addToBuffer(frame_t, jpeg)
+
+            # Start a clip with the pre-roll or extend the running one
+            name = "%s-%s" % (datetime.now().strftime("%Y%m%d-%H%M%S"), events[0]) if len(events) else None
+            if name is not None and self._clip is None and self._getUsedBytes() > self._maxBytes:
+                logger.warning("Skipping clip '%s', the writer falls behind" % (name,))
+            elif name is not None:
+                if self._clip is None:
+                    self._clip = list(self._buffer)
+                    self._clipBytes = self._bufferBytes
+                    self._clipStart = self._clip[0][0]
+                    self._clipName = name
+                else:
+                    self._addToClip(frame_t, jpeg)
+                self._clipEnd = min(frame_t + self._postRoll, self._clipStart + self._maxLength)
+            elif self._clip is not None:
+                self._addToClip(frame_t, jpeg)
+
+            # Hand the clip over to the writer once the post-roll is complete,
+            # or before the frames exceed the memory limit
+            if self._clip is not None and frame_t < self._clipEnd and self._getUsedBytes() > self._maxBytes:
+                logger.warning("Ending clip '%s' early, its frames exceed the memory limit" % (self._clipName,))
+                self._finishClip()
+            elif self._clip is not None and frame_t >= self._clipEnd:
+                self._finishClip()
+
+        if self._clip is not None:
+            self._finishClip()
+        self._writer.stop()
+        logger.debug("Clip recorder stopped")
+
+    def _addToBuffer(self, frame_t, jpeg):
+        """! Adds an encoded frame to the ring buffer and removes the frames exceeding the pre-roll or size
+        """
+        self._buffer.append((frame_t, jpeg))
+        self._bufferBytes += len(jpeg)
+        while len(self._buffer) > 1 and (frame_t - self._buffer[0][0] > self._preRoll or \
+                self._bufferBytes + self._writer.getQueuedBytes() > self._maxBytes):
+            self._bufferBytes -= len(self._buffer.popleft()[1])
+
+    def _addToClip(self, frame_t, jpeg):
+        """! Adds an encoded frame to the running clip
+        """
+        self._clip.append((frame_t, jpeg))
+        self._clipBytes += len(jpeg)
+
+    def _getUsedBytes(self):
+        """! Returns the size of the frames in memory, the frames of the buffer are part of a running clip
+        """
+        return (self._clipBytes if self._clip is not None else self._bufferBytes) + self._writer.getQueuedBytes()
+
+    def _finishClip(self):
+        """! Passes the running clip to the writer
+        """
+        self._writer.write(os.path.join(self._folder, "%s.avi" % (self._clipName,)), self._clip, self._clipBytes)
+        self._clip = None
+        self._clipBytes = 0
+
+    def report(self):
+        """! Returns statistics of the recorder
+        @return tuple (buffered seconds, buffered bytes, dropped frames, written clips)
+        """
+        with self._condition:
+            seconds = self._buffer[-1][0] - self._buffer[0][0] if len(self._buffer) else 0
+            return (seconds, self._bufferBytes, self._dropped, self._writer.getWrittenCount())
+
+    def stop(self):
+        """! Stops the recorder, writes the running clip and joins it
+        """
+        with self._condition:
+            self.stopped = True
+            self._condition.notify()
+        self.join()
+
+
+class ClipWriter(Thread):
+    """! Writes the clips collected by the 'ClipRecorder' to video files. The size of
+         the clips waiting or being written is reported, the recorder keeps it within
+         its memory limit. Frames that can't be decoded and clips that can't be
+         written are skipped.
+    """
+
+    def __init__(self, codec="MJPG"):
+        """! Initializes the writer thread
+        @param codec    The fourcc code of the codec used for the clips
+        """
+        Thread.__init__(self, daemon=True)
+        self.stopped = False
+        self._codec = codec
+        self._clips = deque()
+        self._condition = Condition()
+        self._written = 0
+        self._queuedBytes = 0
+
+    def write(self, path, frames, size):
+        """! Queues a clip to be written
+        @param path     The video file to write
+        @param frames   List of tuples (frame_t, jpeg)
+        @param size     The size of the frames in bytes
+        """
+        with self._condition:
+            self._clips.append((path, frames, size))
+            self._queuedBytes += size
+            self._condition.notify()
+
+    def getQueuedBytes(self):
+        """! Returns the size of the frames of the clips waiting or being written in bytes
+        """
+        return self._queuedBytes
+
+    def run(self):
+        """! Writes the queued clips until the writer gets stopped
+        """
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._clips) or self.stopped)
+                if not len(self._clips):
+                    break
+                path, frames, size = self._clips.popleft()
+
+            # Use the frame rate the frames were buffered with
+            duration = frames[-1][0] - frames[0][0]
+            fps = (len(frames) - 1) / duration if duration > 0 else 10
+            written, error = self._writeClip(path, frames, fps)
+
+            # Release the frames of the clip
+            with self._condition:
+                self._queuedBytes -= size
+                if error is None:
+                    self._written += 1
+            if error is not None:
+                logger.error("Skipping clip '%s', %s" % (path, error))
+                continue
+            if written < len(frames):
+                logger.warning("Skipped %i frames of clip '%s' that failed to decode" % (len(frames) - written, path))
+            logger.info("Clip written to '%s' (%i frames, %0.1fs)" % (path, written, duration))
+
+    def _writeClip(self, path, frames, fps):
+        """! Writes the frames of a clip to a video file
+        @return tuple (amount of written frames, None or the error if the clip wasn't written)
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError as e:
+                return (0, "failed to create its folder: %s" % (e,))
+
+        writer = None
+        written = 0
+        for _, jpeg in frames:
+            img = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                continue
+            if writer is None:
+                writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self._codec), fps, (img.shape[1], img.shape[0]))
+                if not writer.isOpened():
+                    return (0, "failed to open the video file")
+            writer.write(img)
+            written += 1
+
+        if writer is None:
+            return (0, "failed to decode its frames")
+        writer.release()
+        return (written, None)
+
+    def getWrittenCount(self):
+        """! Returns the amount of written clips
+        """
+        return self._written
+
+    def stop(self):
+        """! Stops the writer after writing the queued clips and joins it
+        """
+        with self._condition:
+            self.stopped = True
+            self._condition.notify()
+        self.join()
@@ -1,88 +1,106 @@
 # @file DetectThread.py
 #
-# @brief This module provides access to the WiFi network on NVIDIA Jetson.
-import struct
+# @brief This module sends the monitoring results over the WiFi network on NVIDIA Jetson.
+import asyncio
 from threading import Thread
 import time
 import logging
 from Statistic import getStatistics
+from Uplink import Spool, Uplink, create_target
 from Utils import get_config
-import subprocess
 
 logger = logging.getLogger(__name__)
 
 class DetectThread(Thread):
-    """! The WiFi object utilizes the nvnet utility for WiFi connectivity on NVIDIA Jetson.
-         When initiated, this object runs in a separate thread.
+    """! The 'DetectThread' collects the monitoring results of each interval and sends
+         them to the endpoint given by UPLINK_URL. When initiated, this object runs in
+         a separate thread with an asyncio event loop. Create it after the processes
+         of the pipeline were forked, they would inherit the spool otherwise.
+
+         The results are stored in a local spool first and sent in batches over one
+         persistent connection, so results of intervals without connectivity are sent
+         once it returns. The nvnet utility reconnects the WiFi after repeated failures.
     """
 
     def __init__(self):
         """Initializes the class"""
+        Thread.__init__(self)
         self.stopped = False
         self._done = False
-        self.wifi_enabled = get_config("WIFI_ENABLED")  # Check if WiFi is enabled in config
-        Thread.__init__(self)
-
-    def initialize_wifi(self):
-        """Initializes the WiFi connection."""
+        self._stopEvent = None
+        self._loop = None
+        self._spool = Spool(get_config("UPLINK_SPOOL_PATH"), get_config("UPLINK_SPOOL_MAX_MB") * 1024 * 1024)
+        self._uplink = Uplink(self._spool,
+                create_target(get_config("UPLINK_URL"), get_config("UPLINK_TIMEOUT"), get_config("UPLINK_DEVICE_ID")),
+                get_config("UPLINK_BATCH_SIZE"), get_config("UPLINK_RETRY_DELAY_MIN"),
+                get_config("UPLINK_RETRY_DELAY_MAX"), self.reconnect_wifi)
+
+    async def reconnect_wifi(self, failures):
+        """Reconnects the WiFi network, after every WIFI_RECONNECT_AFTER failures in a row."""
+        every = get_config("WIFI_RECONNECT_AFTER")
+        if not every or failures % every != 0:
+            return
         try:
-            # Connect to WiFi network
-            ssid = get_config("WIFI_SSID")
-            password = get_config("WIFI_PASSWORD")
-            subprocess.run(["sudo", "nvnet", "-s", ssid, "-p", password], check=True)
-            logger.info("WiFi Connected.")
-        except subprocess.CalledProcessError as e:
+            process = await asyncio.create_subprocess_exec("sudo", "nvnet", "-s", get_config("WIFI_SSID"),
+                    "-p", get_config("WIFI_PASSWORD"))
+            if await process.wait() == 0:
+                logger.info("WiFi Connected.")
+            else:
+                logger.error("WiFi Connection failed: exit code %i" % (process.returncode,))
+        except OSError as e:
             logger.error("WiFi Connection failed: " + str(e))
-            return False
-        return True
 
-    def send_data_over_wifi(self, data):
-        """Sends data over the WiFi network."""
-        if not self.initialize_wifi():
-            return False
-
-        try:
-            # Placeholder for sending data over WiFi
-            logger.info("Data sent over WiFi: %s" % data)
-            return True
-        except Exception as e:
-            logger.error("Failed to send data over WiFi: %s" % str(e))
-            return False
+    def record_statistics(self, start_t, end_t):
+        """Stores the monitoring results of the interval in the spool."""
+        (_varroaCount, _beesIn, _beesOut, _frames) = getStatistics().takeStatistics()
+        record = {"device": get_config("UPLINK_DEVICE_ID"), "start": round(start_t, 3), "end": round(end_t, 3),
+                  "varroa": _varroaCount, "bees_in": _beesIn, "bees_out": _beesOut, "frames": _frames}
+        logger.debug("Monitoring results: %s" % (record,))
+        self._spool.append(record)
+        self._uplink.notify()
 
     def run(self):
         """Starts the WiFi thread."""
-        if not self.wifi_enabled:
-            logger.info("WiFi is disabled. Exiting WiFiSender.")
-            return
 
-        fail_cnt = 0
+        # The loop is created by the thread, so its file descriptors only exist while it runs
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+            # Thread stopped
+            self._done = True
+            logger.info("WiFi thread stopped.")
+
+    async def _main(self):
+        """Records the results of each interval while the uplink sends them."""
+        self._stopEvent = asyncio.Event()
+        sender = asyncio.ensure_future(self._uplink.run())
+        interval = get_config("UPLINK_INTERVAL")
+        start_t = time.time()
         while not self.stopped:
-            # Get current statistics
-            _dh = getStatistics()
-            (_varroaCount, _beesIn, _beesOut, _frames) = _dh.readStatistics()
-
-            # Reset statistics
-            _dh.resetStatistics()
-
-            # Prepare data
-            data = (_varroaCount, _beesIn, _beesOut)
-            data_bin = struct.pack("hhh", *data)
-
-            # Convert monitoring results into a string
-            data_bin_str = "".join("{:02X}".format(item) for item in data_bin)
-            logger.debug("Binary data: %s" % str(data_bin))
-            logger.debug("String data: %s" % data_bin_str)
-
-            # Send data over WiFi
-            if not self.send_data_over_wifi(data_bin_str):
-                fail_cnt += 1
-
-            # Wait for one minute before sending the next data
-            time.sleep(60)
+            try:
+                await asyncio.wait_for(self._stopEvent.wait(), max(start_t + interval - time.time(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+            # Store the results of the interval, also the last incomplete one
+            end_t = time.time()
+            self.record_statistics(start_t, end_t)
+            start_t = end_t
+
+        # Unsent results stay in the spool for the next start
+        self._uplink.stop()
+        sender.cancel()
+        try:
+            await sender
+        except asyncio.CancelledError:
+            pass
 
-        # Thread stopped
-        self._done = True
-        logger.info("WiFi thread stopped.")
+    def _requestStop(self):
+        if self._stopEvent is not None:
+            self._stopEvent.set()
 
     def isDone(self):
         """Returns whether the Thread has stopped or is still running."""
@@ -91,4 +109,9 @@ class DetectThread(Thread):
     def stop(self):
         """Stops the WiFi Thread and joins it."""
         self.stopped = True
-        self.join()
\ No newline at end of file
+        try:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._requestStop)
+        except RuntimeError:
+            pass  # The loop already ended
+        self.join()
@@ -0,0 +1,160 @@
+##
+# @file DetectionRecord.py
+#
+# @brief Records the results of the bee detection and replays them, e.g. to tune the tracking.
+
+import os
+import json
+import numpy as np
+
+
+class DetectionRecorder(object):
+    """! The 'DetectionRecorder' stores the output of 'detect_bees' for each frame
+         in a folder of NumPy arrays, one array per column:
+
+         - frame_t.npy          position of each frame in seconds (N)
+         - bee_offsets.npy      index of the first bee of each frame in bees.npy (N+1)
+         - bees.npy             ellipses of the bees, rows (x, y, width, height, angle)
+         - group_offsets.npy    index of the first group of each frame in groups.npy (N+1)
+         - groups.npy           ellipses of the groups of bees, rows as above
+         - motion.npy           whether the motion gate detected motion on each frame (N),
+                                missing in older records
+         - meta.json            information about the source, e.g. the frame size
+
+         The arrays can be memory mapped, so long recordings are not loaded at once.
+    """
+
+    def __init__(self, folder, meta=None):
+        """! Initializes the recorder
+        @param folder   The folder to write the record to, created if needed
+        @param meta     A dict with information about the source, stored as meta.json
+        """
+        super(DetectionRecorder, self).__init__()
+        self._folder = folder
+        self._meta = dict(meta or {})
+        self._frame_t = []
+        self._bees = []
+        self._groups = []
+        self._motion = []
+
+    def add(self, frame_t, bees, groups, motion=True):
+        """! Adds the detections of one frame
+        @param frame_t  The position of the frame in seconds
+        @param bees     The bees as returned by 'detect_bees'
+        @param groups   The groups of bees as returned by 'detect_bees'
+        @param motion   Whether the motion gate detected motion on the frame, see 'MotionGate'
+        """
+        self._frame_t.append(frame_t)
+        self._motion.append(motion)
+        self._bees.append([(e[0][0], e[0][1], e[1][0], e[1][1], e[2]) for e in bees])
+        self._groups.append([(e[0][0], e[0][1], e[1][0], e[1][1], e[2]) for e in groups])
+
+    def addAll(self, detections):
+        """! Adds a list of detections
+        @param detections   A list of tuples (frame_t, bees, groups) or (frame_t, bees, groups, motion)
+        """
+        for item in detections:
+            self.add(*item)
+
+    def close(self):
+        """! Writes the record
+        """
+        if not os.path.exists(self._folder):
+            os.makedirs(self._folder)
+
+        def columns(items):
+            offsets = np.zeros(len(items) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(i) for i in items])
+            rows = [r for i in items for r in i]
+            return offsets, np.array(rows, dtype=np.float64).reshape(-1, 5)
+
+        bee_offsets, bees = columns(self._bees)
+        group_offsets, groups = columns(self._groups)
+        np.save(os.path.join(self._folder, "frame_t.npy"), np.array(self._frame_t, dtype=np.float64))
+        np.save(os.path.join(self._folder, "bee_offsets.npy"), bee_offsets)
+        np.save(os.path.join(self._folder, "bees.npy"), bees)
+        np.save(os.path.join(self._folder, "group_offsets.npy"), group_offsets)
+        np.save(os.path.join(self._folder, "groups.npy"), groups)
+        np.save(os.path.join(self._folder, "motion.npy"), np.array(self._motion, dtype=np.bool_))
+
+        self._meta["frames"] = len(self._frame_t)
+        with open(os.path.join(self._folder, "meta.json"), "w") as f:
+            json.dump(self._meta, f, indent=4)
+
+
+class DetectionRecord(object):
+    """! Read access to a record written by the 'DetectionRecorder'. Iterating over
+         the record returns a tuple (frame_t, bees, groups) per frame, the bees and
+         groups use the same format as 'detect_bees' and can be passed straight
+         to 'BeeTracker.update'.
+    """
+
+    def __init__(self, folder, mmap=True):
+        """! Opens the record
+        @param folder   The folder of the record
+        @param mmap     Whether to memory map the arrays instead of loading them
+        """
+        super(DetectionRecord, self).__init__()
+        if not os.path.isfile(os.path.join(folder, "meta.json")):
+            raise BaseException("The folder '%s' doesn't contain a detection record!" % (folder,))
+
+        mode = "r" if mmap else None
+        self._frame_t = np.load(os.path.join(folder, "frame_t.npy"), mmap_mode=mode)
+        self._beeOffsets = np.load(os.path.join(folder, "bee_offsets.npy"), mmap_mode=mode)
+        self._bees = np.load(os.path.join(folder, "bees.npy"), mmap_mode=mode)
+        self._groupOffsets = np.load(os.path.join(folder, "group_offsets.npy"), mmap_mode=mode)
+        self._groups = np.load(os.path.join(folder, "groups.npy"), mmap_mode=mode)
+        self._motion = None
+        if os.path.isfile(os.path.join(folder, "motion.npy")):
+            self._motion = np.load(os.path.join(folder, "motion.npy"), mmap_mode=mode)
+        with open(os.path.join(folder, "meta.json")) as f:
+            self.meta = json.load(f)
+
+    def __len__(self):
+        return len(self._frame_t)
+
+    @staticmethod
+    def _ellipses(rows):
+        """! Converts rows (x, y, width, height, angle) into the ellipse format of OpenCV
+        """
+        return [((r[0], r[1]), (r[2], r[3]), r[4]) for r in rows.tolist()]
+
+    def getFrame(self, index):
+        """! Returns the detections of one frame
+        @param index    The index of the frame
+        @return tuple (frame_t, bees, groups)
+        """
+        bees = self._bees[self._beeOffsets[index]:self._beeOffsets[index + 1]]
+        groups = self._groups[self._groupOffsets[index]:self._groupOffsets[index + 1]]
+        return (float(self._frame_t[index]), self._ellipses(bees), self._ellipses(groups))
+
+    def hasMotion(self, index):
+        """! Returns whether the motion gate detected motion on a frame, True for older records
+        @param index    The index of the frame
+        """
+        return self._motion is None or bool(self._motion[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.getFrame(index)
+
+    def getDetectionCount(self):
+        """! Returns the amount of recorded bees and groups
+        @return tuple (bees, groups)
+        """
+        return (len(self._bees), len(self._groups))
+
+
+def replay_record(record, tracker):
+    """! Feeds all frames of a record to a 'BeeTracker', as fast as possible. Frames
+         without motion are skipped while no bee is tracked, like the 'ImageConsumer' does.
+    @param record   The 'DetectionRecord' to replay
+    @param tracker  The 'BeeTracker' to update
+    @return The amount of frames replayed
+    """
+    cnt = 0
+    for index, (frame_t, bees, groups) in enumerate(record):
+        if record.hasMotion(index) or len(tracker.tracks):
+            tracker.update(bees, groups, frame_t)
+        cnt += 1
+    return cnt
@@ -0,0 +1,94 @@
+##
+# @file FramePyramid.py
+#
+# @brief Builds the set of frames in the different resolutions of the frame config.
+
+import cv2
+import numpy as np
+
+
+class FramePyramid(object):
+    """! The 'FramePyramid' converts a captured frame into the frame set described by
+         the frame config, each level is resized from the previous (larger) level.
+
+         The resulting frames are written into preallocated buffers. The frame sets
+         are passed to a 'multiprocessing.Queue', which serializes them in a background
+         thread, so a frame set must not be overwritten before it was consumed.
+         Therefore a ring of buffer sets is used that is one larger than the queue.
+    """
+
+    def __init__(self, frame_config, buffer_count=1, interpolation="auto"):
+        """! Initializes the pyramid and allocates its buffers
+        @param frame_config     The frame config as returned by 'get_frame_config' (height, width, mode)
+        @param buffer_count     The amount of frame sets that may be in use at the same time
+        @param interpolation    "auto", "area" or "linear". "auto" uses area interpolation for
+                                exact 2x steps (same cost as linear) and linear otherwise.
+        """
+        super(FramePyramid, self).__init__()
+        self._config = frame_config
+        self._interpolation = interpolation
+        self._index = 0
+
+        # Allocate the buffers, one set per frame set that may be in use
+        self._buffers = []
+        for _ in range(max(1, buffer_count)):
+            levels = []
+            for item in frame_config:
+                color = np.empty((item[0], item[1], 3), dtype=np.uint8)
+                gray = None
+                if item[2] == cv2.IMREAD_GRAYSCALE:
+                    gray = np.empty((item[0], item[1]), dtype=np.uint8)
+                levels.append((color, gray))
+            self._buffers.append(levels)
+
+    def _getInterpolation(self, src_size, dst_size):
+        """! Returns the interpolation to use to resize between the given sizes (height, width)
+        """
+        if self._interpolation == "area":
+            return cv2.INTER_AREA
+        if self._interpolation == "linear":
+            return cv2.INTER_LINEAR
+        if src_size[0] == dst_size[0] * 2 and src_size[1] == dst_size[1] * 2:
+            return cv2.INTER_AREA
+        return cv2.INTER_LINEAR
+
+    def build(self, frame):
+        """! Converts the given frame into a frame set
+        @param frame    The captured BGR frame
+        @return tuple with one frame per item of the frame config
+        """
+        levels = self._buffers[self._index]
+        self._index = (self._index + 1) % len(self._buffers)
+
+        fs = tuple()
+        src = frame
+        for num, item in enumerate(self._config):
+            height, width = src.shape[0:2]
+            color, gray = levels[num]
+
+            # Resize if needed, frames that already have the right size are used as they are
+            if height != item[0] or width != item[1]:
+                cv2.resize(src, (item[1], item[0]), dst=color,
+                        interpolation=self._getInterpolation((height, width), item[0:2]))
+                src = color
+
+            if gray is not None:
+                cv2.cvtColor(src, cv2.COLOR_BGR2GRAY, dst=gray)
+                fs += (gray,)
+            else:
+                fs += (src,)
+
+        return fs
+
+    @staticmethod
+    def getReducedDecodeFlag(capture_size, frame_size):
+        """! Returns the flag to decode a JPEG frame directly at a reduced resolution
+        @param capture_size     The size (width, height) of the captured frames
+        @param frame_size       The size (width, height) of the largest frame needed
+        @return cv2.IMREAD_* flag for 'cv2.imdecode', the largest reduction that still covers the frame size
+        """
+        flags = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+        for factor, flag in flags:
+            if capture_size[0] // factor >= frame_size[0] and capture_size[1] // factor >= frame_size[1]:
+                return flag
+        return cv2.IMREAD_COLOR
@@ -0,0 +1,120 @@
+##
+# @file FrameScheduler.py
+#
+# @brief Deadline based pacing of the processed frames including a drop policy
+#        for frames that exceeded the latency budget.
+
+import time
+
+
+class FrameScheduler(object):
+    """! The 'FrameScheduler' paces the frame processing of the 'ImageConsumer'.
+         Each frame carries the timestamp of its capture, which allows to measure
+         the lag between capturing and processing a frame. Whenever the lag exceeds
+         the latency budget, the oldest frames are dropped (if enabled) to catch up
+         with the input again.
+
+         Frames are processed on a fixed deadline grid given by the FPS limit,
+         instead of sleeping a fixed time after each frame. If processing falls
+         behind, the grid is moved forward instead of processing a burst of frames.
+    """
+
+    def __init__(self, limit_fps, latency_budget, drop_frames=True):
+        """! Initializes the 'FrameScheduler'
+        @param limit_fps        The maximum amount of frames to process per second, None or 0 to disable
+        @param latency_budget   The maximum lag in seconds between capturing and processing a frame
+        @param drop_frames      Whether frames exceeding the latency budget may be dropped
+        """
+        super(FrameScheduler, self).__init__()
+        self._frameInterval = 1.0 / limit_fps if limit_fps else 0
+        self._latencyBudget = latency_budget
+        self._dropFrames = drop_frames
+        self._nextSlot = None
+
+        # Statistics of the current reporting interval
+        self._windowStart = time.time()
+        self._windowProcessed = 0
+        self._windowDropped = 0
+        self._windowLag = 0
+        self._windowMaxLag = 0
+
+        # Statistics of the last completed reporting interval
+        self._rate = 0
+        self._lag = 0
+        self._maxLag = 0
+        self._dropped = 0
+
+        # Overall amount of dropped frames
+        self._droppedOverall = 0
+
+    def isStale(self, capture_t):
+        """! Returns whether the frame captured at the given time should be dropped
+        @param capture_t    The time the frame was captured (time.time())
+        @return True if the frame exceeded the latency budget and may be dropped
+        """
+        return self._dropFrames and (time.time() - capture_t) > self._latencyBudget
+
+    def frameDropped(self):
+        """! Reports a dropped frame
+        """
+        self._windowDropped += 1
+        self._droppedOverall += 1
+
+    def frameProcessed(self, capture_t):
+        """! Reports a processed frame
+        @param capture_t    The time the frame was captured (time.time())
+        @return The lag in seconds between capturing and processing the frame
+        """
+        lag = time.time() - capture_t
+        self._windowProcessed += 1
+        self._windowLag += lag
+        self._windowMaxLag = max(self._windowMaxLag, lag)
+        return lag
+
+    def waitForNextSlot(self):
+        """! Blocks until the next frame may be processed according to the FPS limit
+        """
+        if not self._frameInterval:
+            return
+
+        now = time.time()
+        if self._nextSlot is None:
+            self._nextSlot = now
+        self._nextSlot += self._frameInterval
+
+        # Do not try to catch up if we fell behind, move the deadline grid instead
+        if self._nextSlot > now:
+            time.sleep(self._nextSlot - now)
+        else:
+            self._nextSlot = now
+
+    def report(self):
+        """! Completes the current reporting interval and returns its statistics
+        @return tuple (processing rate in FPS, mean lag in s, max lag in s, dropped frames)
+        """
+        now = time.time()
+        duration = now - self._windowStart
+        if duration > 0:
+            self._rate = self._windowProcessed / duration
+        self._lag = self._windowLag / self._windowProcessed if self._windowProcessed else 0
+        self._maxLag = self._windowMaxLag
+        self._dropped = self._windowDropped
+
+        self._windowStart = now
+        self._windowProcessed = 0
+        self._windowDropped = 0
+        self._windowLag = 0
+        self._windowMaxLag = 0
+
+        return (self._rate, self._lag, self._maxLag, self._dropped)
+
+    def getRate(self):
+        """! Returns the effective processing rate of the last reporting interval
+        @return The processing rate in frames per second
+        """
+        return self._rate
+
+    def getDroppedOverall(self):
+        """! Returns the amount of frames dropped since the scheduler was created
+        """
+        return self._droppedOverall
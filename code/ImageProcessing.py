@@ -16,9 +16,18 @@ import time
 import logging
 import queue
 import multiprocessing
+from collections import deque
 from Statistic import getStatistics
+from LoadGovernor import getLoadGovernor
 from BeeDetector import detect_bees
-from BeeTracking import BeeTracker, BeeTrack
+from BeeTracking import BeeTracker, BeeTrack, add_tag_listener
+from ClipRecorder import ClipRecorder
+from FrameScheduler import FrameScheduler
+from LatestFrameReader import LatestFrameReader
+from MotionGate import MotionGate
+from RegionOfInterest import RegionOfInterest
+from FramePyramid import FramePyramid
+from VideoDecoder import create_decoder
 from Utils import get_config, get_args
 from BeeDetector import BeeProcess
 if get_config("NN_ENABLE"):
@@ -33,158 +42,260 @@ class ImageConsumer(BeeProcess):
     by the 'ImageProvider'. It performs the bee detection, bee tracking and
     forwards findings to the 'ImageExtractor' to feed them to the neural network.
     """
+
+    INPUTS = {"frames": "i_q", "results": "c_q"}
+    OUTPUTS = {"positions": "e_q", "preview": "v_q"}
+
     def __init__(self):
         """! Intitilizes the 'ImageConsumer'
         """
         super().__init__()
-        self._extractQueue = Queue()
-        self._classifierResultQueue = None
-        self._imageQueue = None
-        self._visualQueue = None
-        self.set_process_param("e_q", self._extractQueue)
-        self.set_process_param("c_q", self._classifierResultQueue)
-        self.set_process_param("i_q", self._imageQueue)
-        self.set_process_param("v_q", self._visualQueue)
-
-    def getPositionQueue(self):
-        """! Returns the queue object where detected bee positions will be put
-        @return A queue object
+        self._liveSource = False
+        self._frameRequests = None
+        self._viewerActive = None
+        self.set_process_param("live", self._liveSource)
+        self.set_process_param("f_r", self._frameRequests)
+        self.set_process_param("viewer", self._viewerActive)
+
+    def connect(self, port, queue, peers=()):
+        """! Connects a port to a queue, the frames are taken from the 'ImageProvider' the way it captures
+             them and the preview is only sent while the 'Visual' has a viewer
         """
-        return self._extractQueue
-
-    def setImageQueue(self, queue):
-        """! Set the queue object where the image consumer can find new frames
-        @param queue    The queue object to read new frames from
+        super().connect(port, queue, peers)
+        if port == "frames" and len(peers):
+            self.setLiveSource(peers[0].isLiveSource())
+            self.setFrameRequests(peers[0].getFrameRequests())
+        elif port == "preview" and len(peers):
+            self.setViewerActive(peers[0].getViewerActive())
+
+    def setLiveSource(self, live):
+        """! Set whether the frames are captured from a live source, e.g. a camera
+        @param  live    True for live sources, False for video files
         """
-        self._imageQueue = queue
-        self.set_process_param("i_q", self._imageQueue)
-    
-    def setVisualQueue(self, queue):
-        """! Set the queue object where the image consumer can find new frames
-        @param queue    The queue object to read new frames from
+        self._liveSource = live
+        self.set_process_param("live", self._liveSource)
+
+    def setFrameRequests(self, requests):
+        """! Set the semaphore that is released each time a frame set was taken from the image queue
+        @param  requests    The semaphore returned by 'ImageProvider.getFrameRequests' (may be None)
         """
-        self._visualQueue = queue
-        self.set_process_param("v_q", self._visualQueue)
+        self._frameRequests = requests
+        self.set_process_param("f_r", self._frameRequests)
 
-    def setClassifierResultQueue(self, queue):
-        """! Set the queue obejct where the 'ImageConsumer' can read classification results
-        @param  queue   The queue that provides the classification results from the neural network
+    def setViewerActive(self, viewer):
+        """! Set the flag telling whether the preview is shown, recorded or streamed
+        @param  viewer  The value returned by 'Visual.getViewerActive' (may be None to always send the preview)
         """
-        self._classifierResultQueue = queue
-        self.set_process_param("c_q", self._classifierResultQueue)
+        self._viewerActive = viewer
+        self.set_process_param("viewer", self._viewerActive)
 
     @staticmethod
-    def run(c_q, i_q, e_q, v_q, parent, stopped, done):
+    def run(c_q, i_q, e_q, v_q, live, f_r, viewer, parent, stopped, done):
         """! The main thread that runs the 'ImageConsumer'
         """
         _process_time = time.time()
         _process_cnt = 0
         _lastProcessFPS = 0
         _start_t = time.time()
+        _extract_dropped = 0
+        _preview_skipped = 0
         writer = None
 
+        # Create the scheduler that paces the processing and drops stale frames
+        scheduler = FrameScheduler(get_config("LIMIT_FPS_TO"), get_config("FRAME_LATENCY_BUDGET"),
+                get_config("FRAME_DROP_CAMERA") if live else get_config("FRAME_DROP_VIDEO"))
+
+        # Restrict the detection to the region of interest. The frames are already
+        # cropped by the 'ImageProvider', pixels outside of the polygons are masked.
+        frame_config = get_frame_config()
+        roi = RegionOfInterest.fromConfig(frame_config)
+        mask = None
+        frame_size = (frame_config[-2][1], frame_config[-2][0])
+        if roi is not None:
+            mask = roi.getMask(len(frame_config) - 1)
+            frame_size = roi.getSize(frame_config[-2][0] / frame_config[-1][0])
+
         # Create a Bee Tracker
-        tracker = BeeTracker(50, 20)
+        tracker = BeeTracker(get_config("TRACK_DIST_THRESHOLD"), get_config("TRACK_MAX_FRAME_SKIPPED"), frame_size)
 
         # Create statistics object
         statistics = getStatistics()
 
+        # The governor lowers the effort under overload, the mask is scaled along with the detection
+        governor = getLoadGovernor()
+        scaled_mask = (None, mask)
+
+        # Create the motion gate that skips the detection on static frames
+        gate = None
+        if get_config("MOTION_GATE_ENABLED"):
+            gate = MotionGate(get_config("MOTION_GATE_SIZE"), get_config("MOTION_GATE_THRESHOLD"),
+                    get_config("MOTION_GATE_MIN_CHANGED"), get_config("MOTION_GATE_LEARNING_RATE"), mask)
+
         if type(i_q) == type(None):
             raise("No image queue provided!")
 
-        while stopped.value == 0:
+        # Maximum time to block on an empty queue before checking the stop flag again
+        _queue_timeout = get_config("QUEUE_READ_TIMEOUT")
 
-            _process_cnt += 1
+        # Record clips when bees with the configured tags are detected
+        clips = None
+        if get_config("CLIP_RECORDING_ENABLED"):
+            clips = ClipRecorder(get_config("CLIP_RECORDING_PATH"), get_config("CLIP_PRE_ROLL"),
+                    get_config("CLIP_POST_ROLL"), get_config("CLIP_MAX_LENGTH"), get_config("CLIP_JPEG_QUALITY"),
+                    get_config("CLIP_BUFFER_MAX_MB") * 1024 * 1024, get_config("SAVE_AS_VIDEO_CODEC"))
+            clip_tags = get_config("CLIP_RECORDING_TAGS")
+            add_tag_listener(lambda track, tag: clips.trigger("%s-%i" % (tag, track.trackId)) if tag in clip_tags else None)
+            clips.start()
+
+        while stopped.value == 0:
 
             # When the neural network is enabled, then read results from the classifcation queue
             # and forward them the the corresponding track and statistics
             if get_config("NN_ENABLE"):
 
                 # Populate classification results
-                while not c_q.empty():
+                while True:
+                    try:
+                        trackId, result = c_q.get_nowait()
+                    except queue.Empty:
+                        break
 
                     # Transfer results to the track
-                    trackId, result = c_q.get()
                     track = tracker.getTrackById(trackId)
                     if type(track) != type(None):
                         track.imageClassificationComplete(result)
                     else:
                         statistics.addClassificationResult(trackId, result)
 
-            # Process every incoming image
-            if not i_q.empty() and stopped.value == 0:
-
-                if _process_cnt % 100 == 0:
-                    logger.debug("Process time(get): %0.3fms" % ((time.time() - _start_t) * 1000.0))
-
-                # Get frame set
-                fs = i_q.get()
-                if get_config("NN_EXTRACT_RESOLUTION") == "EXT_RES_150x300":
-                    img_1080, img_540, img_180 = fs
-                elif get_config("NN_EXTRACT_RESOLUTION") == "EXT_RES_75x150":
-                    img_540, img_180 = fs
-                
-                if _process_cnt % 100 == 0:
-                    logger.debug("Process time(track): %0.3fms" % ((time.time() - _start_t) * 1000.0))
-
-                # Detect bees on smallest frame
-                detected_bees, detected_bee_groups = detect_bees(img_180, 3)
-                
+            # Wait for the next frame set, wake up regularly to check the stop flag
+            try:
+                capture_t, frame_t, fs = i_q.get(timeout=_queue_timeout)
+            except queue.Empty:
+                continue
+            if stopped.value != 0:
+                break
+
+            # Request the next frame set from the provider
+            if f_r is not None:
+                f_r.release()
+
+            # Drop the oldest frames while processing lags behind the latency budget
+            while scheduler.isStale(capture_t):
+                try:
+                    capture_t, frame_t, fs = i_q.get_nowait()
+                except queue.Empty:
+                    break
+                scheduler.frameDropped()
+                if f_r is not None:
+                    f_r.release()
+
+            _process_cnt += 1
+            if _process_cnt % 100 == 0:
+                logger.debug("Process time(get): %0.3fms" % ((time.time() - _start_t) * 1000.0))
+
+            # Get frame set
+            if get_config("NN_EXTRACT_RESOLUTION") == "EXT_RES_150x300":
+                img_1080, img_540, img_180 = fs
+            elif get_config("NN_EXTRACT_RESOLUTION") == "EXT_RES_75x150":
+                img_540, img_180 = fs
+
+            if _process_cnt % 100 == 0:
+                logger.debug("Process time(track): %0.3fms" % ((time.time() - _start_t) * 1000.0))
+
+            # Keep the recent frames for clips
+            if clips is not None:
+                clips.addFrame(img_540, frame_t)
+
+            # Skip the detection on static frames while no bee is tracked
+            if gate is None or gate.shouldProcess(img_180, len(tracker.tracks)):
+
+                # Detect bees on smallest frame, at a lower resolution under overload
+                detect_scale = governor.getDetectionScale()
+                if detect_scale != 1.0:
+                    img_detect = cv2.resize(img_180, None, fx=detect_scale, fy=detect_scale, interpolation=cv2.INTER_AREA)
+                    if mask is not None and scaled_mask[0] != detect_scale:
+                        scaled_mask = (detect_scale, cv2.resize(mask, (img_detect.shape[1], img_detect.shape[0]),
+                                interpolation=cv2.INTER_NEAREST))
+                    detected_bees, detected_bee_groups = detect_bees(img_detect, 3 / detect_scale,
+                            scaled_mask[1], detect_scale)
+                else:
+                    detected_bees, detected_bee_groups = detect_bees(img_180, 3, mask)
+
                 # Update tracker with detected bees
                 if get_config("ENABLE_TRACKING"):
-                    tracker.update(detected_bees, detected_bee_groups)
+                    tracker.update(detected_bees, detected_bee_groups, frame_t)
+            else:
+                detected_bees, detected_bee_groups = [], []
 
-                # Extract detected bee images from the video, to use it our neural network
-                # Scale is 2 because detection was made on img_540 but cutting is on img_1080
-                if get_config("ENABLE_IMAGE_EXTRACTION"):
-                    data = tracker.getLastBeePositions(get_config("EXTRACT_FAME_STEP"))
-                    if len(data) and type(e_q) != type(None):
+            # Extract detected bee images from the video, to use it our neural network
+            # Scale is 2 because detection was made on img_540 but cutting is on img_1080
+            if get_config("ENABLE_IMAGE_EXTRACTION"):
+                data = tracker.getLastBeePositions(governor.getExtractFrameStep())
+                if len(data) and type(e_q) != type(None):
+
+                    # Skip the extraction of this frame if the extractor lags behind
+                    try:
                         if get_config("NN_EXTRACT_RESOLUTION") == "EXT_RES_150x300":
-                            e_q.put((data, img_1080, 2, _process_cnt))
+                            e_q.put((data, img_1080, 2, _process_cnt), block=False)
                         elif get_config("NN_EXTRACT_RESOLUTION") == "EXT_RES_75x150":
-                            e_q.put((data, img_540, 1, _process_cnt))
+                            e_q.put((data, img_540, 1, _process_cnt), block=False)
                         else:
                             raise("Unknown setting for EXT_RES_75x150, expected EXT_RES_150x300 or EXT_RES_75x150")
-
-                # Draw the results if enabled
-                if get_config("VISUALIZATION_ENABLED"):
-                    if _process_cnt % get_config("VISUALIZATION_FRAME_SKIP") == 0:
-                        try:
-                            data = (img_540, detected_bees, detected_bee_groups, tracker, _lastProcessFPS) 
-                            v_q.put(data, block=False)
-                        except queue.Full:
-                            print("frame skip !!")
-                
-
-                # Print log entry about process time each 100 frames
-                if _process_cnt % 100 == 0:
-                    _pt = time.time() - _process_time
-                    _lastProcessFPS = 100 / _pt
-                    logger.debug("Process time all: %0.3fms" % (_pt * 10.0))
-                    _process_time = time.time()
-
-                # Update statistics
-                _dh = getStatistics()
-                _dh.frameProcessed()
-
-            else:
-                time.sleep(0.01)
-
-            # Limit FPS by delaying manually
-            _end_t = time.time() - _start_t
-            limit_time = 1 / get_config("LIMIT_FPS_TO")
-            if _end_t < limit_time:
-                time.sleep(limit_time - _end_t)
+                    except queue.Full:
+                        _extract_dropped += 1
+
+            # Draw the results if enabled, nothing is sent while nobody looks at the preview
+            if get_config("VISUALIZATION_ENABLED") and (viewer is None or viewer.value):
+                if _process_cnt % governor.getVisualizationFrameSkip() == 0:
+                    try:
+                        data = (img_540, detected_bees, detected_bee_groups, tracker, _lastProcessFPS)
+                        v_q.put(data, block=False)
+                    except queue.Full:
+                        _preview_skipped += 1
+                        governor.previewSkipped()
+
+
+            # Update statistics
+            _dh = getStatistics()
+            _dh.frameProcessed()
+            # Only the lag of live sources counts as overload, frames of video files
+            # wait in the read-ahead buffer of the provider
+            lag = scheduler.frameProcessed(capture_t)
+            if live:
+                governor.reportLag(lag)
+            BeeProcess.itemProcessed()
+
+            # Print log entry about process time, rate and lag each 100 frames
+            if _process_cnt % 100 == 0:
+                _pt = time.time() - _process_time
+                logger.debug("Process time all: %0.3fms" % (_pt * 10.0))
+                _process_time = time.time()
+                rate, lag, max_lag, dropped = scheduler.report()
+                _lastProcessFPS = rate
+                logger.info(("Processing rate: %.2f FPS, lag: %0.1fms (max %0.1fms), dropped: %i, extraction skipped: %i, " + \
+                        "preview skipped: %i") % (rate, lag * 1000.0, max_lag * 1000.0, dropped, _extract_dropped,
+                        _preview_skipped))
+                if gate is not None:
+                    logger.info("Motion gate skipped %0.1f%% of the frames" % (gate.report() * 100.0,))
+                if clips is not None:
+                    seconds, size, skipped, written = clips.report()
+                    logger.debug("Clip buffer: %0.1fs, %0.1fMB, skipped %i frames, %i clips written" % \
+                            (seconds, size / 1024.0 / 1024.0, skipped, written))
+
+            # Limit FPS by waiting for the next deadline
+            scheduler.waitForNextSlot()
             _start_t = time.time()
 
+        if clips is not None:
+            clips.stop()
         logger.info("Image Consumer stopped")
 
 
 class ImageExtractor(BeeProcess):
     """! The 'ImageExtractor' class provides a process that extracts
-          bee-images from a given video frame. It uses a queue for
-          incoming requests, see 'setInQueue' and a one
-          queue to provides results, see 'setResultQueue'.
+          bee-images from a given video frame. It reads the requests from
+          the "positions" port and puts the bee images to the "images" port.
+          Several extractors may share the work.
 
           To request can be inserted in the incoming queue, by providing
           a tuple with the following contents:
@@ -196,36 +307,19 @@ class ImageExtractor(BeeProcess):
           - 'scale' is used adapt to different frame sizes.
     """
 
-    def __init__(self):
-        """! Initializes the image extractor
-        """
-        super().__init__()
-        self._resultQueue = None
-        self._inQueue = None
+    INPUTS = {"positions": "in_q"}
+    OUTPUTS = {"images": "out_q"}
+    MAX_WORKERS = None
 
     def start(self):
         """! Starts the image extraction process
         """
-        if type(self._inQueue) == type(None):
-            raise ("Please provide a classifier queue!")
+        if self._process_params["in_q"] is None:
+            raise BaseException("Please connect the positions of the image extractor!")
 
         # Start the process
         super().start()
 
-    def setResultQueue(self, queue):
-        """! Sets the result queue of the image extractor
-        @param queue  Sets the queue, where the process pushes its result
-        """
-        self._resultQueue = queue
-        self.set_process_param("out_q", self._resultQueue)
-
-    def setInQueue(self, queue):
-        """! Sets the input queue of the image extractor
-        @param queue  Sets the queue, where the process reads its input
-        """
-        self._inQueue = queue
-        self.set_process_param("in_q", self._inQueue)
-
     @staticmethod
     def run(in_q, out_q, parent, stopped, done):
 
@@ -239,50 +333,71 @@ class ImageExtractor(BeeProcess):
         if get_config("SAVE_EXTRACTED_IMAGES") and not exists(e_path):
             makedirs(e_path)
 
-        while stopped.value == 0:
-            if not in_q.empty():
-
-                _start_t = time.time()
-                _process_cnt += 1
-
-                # Read one entry from the process queue
-                data, image, scale, frame_id = in_q.get()
-
-                # Extract the bees from the image
-                for item in data:
-                    trackId, lastPosition = item
+        # Maximum time to block on an empty queue before checking the stop flag again
+        _queue_timeout = get_config("QUEUE_READ_TIMEOUT")
 
-                    # Extract the bee image and sharpness value of the image
-                    img, sharpness = cutEllipseFromImage(lastPosition, image, 0, scale)
+        # Images that didn't fit into the queue of the classification, e.g. while it
+        # still loads. They are passed on in order once there is room again.
+        _backlog = deque(maxlen=get_config("EXTRACT_BACKLOG_LENGTH"))
+        _backlog_dropped = 0
 
-                    # Check result, in some cases the result may be None
-                    #  e.g. when the bee is close to the image border
-                    if type(img) != type(None):
-
-                        # Filter by minimum sharpness
-                        if sharpness > get_config("EXTRACT_MIN_SHARPNESS"):
+        while stopped.value == 0:
 
-                            # Forward the image to the classification process (if its running)
-                            if get_config("NN_ENABLE"):
-                                try:
-                                    out_q.put((trackId, img, frame_id), block=False)
-                                except queue.Full:
-                                    pass
+            # Pass the waiting images on
+            while len(_backlog):
+                try:
+                    out_q.put(_backlog[0], block=False)
+                except queue.Full:
+                    break
+                _backlog.popleft()
 
-                            # Save the image in case its requested
-                            if get_config("SAVE_EXTRACTED_IMAGES"):
-                                cv2.imwrite(e_path + "/%i-%s.jpeg" % (
-                                _process_cnt, datetime.datetime.now().strftime("%Y%m%d-%H%M%S")), img)
+            # Wait for the next request, wake up regularly to check the stop flag
+            try:
+                data, image, scale, frame_id = in_q.get(timeout=_queue_timeout)
+            except queue.Empty:
+                continue
 
-                _process_time += time.time() - _start_t
+            _start_t = time.time()
+            _process_cnt += 1
 
-                # Print log entry about process time each 100 frames
-                if _process_cnt % 100 == 0:
-                    logger.debug("Process time: %0.3fms" % (_process_time * 10.0))
-                    _process_time = 0
-
-            else:
-                time.sleep(0.01)
+            # Extract the bees from the image
+            for item in data:
+                trackId, lastPosition = item
+
+                # Extract the bee image and sharpness value of the image
+                img, sharpness = cutEllipseFromImage(lastPosition, image, 0, scale)
+
+                # Check result, in some cases the result may be None
+                #  e.g. when the bee is close to the image border
+                if type(img) != type(None):
+
+                    # Filter by minimum sharpness
+                    if sharpness > get_config("EXTRACT_MIN_SHARPNESS"):
+
+                        # Forward the image to the classification process (if its running)
+                        if get_config("NN_ENABLE") and out_q is not None:
+                            try:
+                                if len(_backlog):
+                                    raise queue.Full
+                                out_q.put((trackId, img, frame_id), block=False)
+                            except queue.Full:
+                                if len(_backlog) == _backlog.maxlen:
+                                    _backlog_dropped += 1
+                                _backlog.append((trackId, img, frame_id))
+
+                        # Save the image in case its requested
+                        if get_config("SAVE_EXTRACTED_IMAGES"):
+                            cv2.imwrite(e_path + "/%i-%s.jpeg" % (
+                            _process_cnt, datetime.datetime.now().strftime("%Y%m%d-%H%M%S")), img)
+
+            _process_time += time.time() - _start_t
+            BeeProcess.itemProcessed()
+
+            # Print log entry about process time each 100 frames
+            if _process_cnt % 100 == 0:
+                logger.debug("Process time: %0.3fms - Backlog: %i images, %i dropped" % \
+                        (_process_time * 10.0, len(_backlog), _backlog_dropped))
+                _process_time = 0
 
         # The process stopped
         logger.info("Image extractor stopped")
@@ -292,15 +407,24 @@ class ImageProvider(BeeProcess):
     """! The 'ImageProvider' class provides access to the camera or video
           input using a queue. It runs in a dedicated process and feeds
           the extracted images into a queue, that can then be used by other
-          tasks.
+          tasks. After a crash, it resumes video files after the last frame it delivered.
     """
-    def __init__(self, video_source=None, video_file=None):
+
+    ## The process is ready once the video input is opened
+    READY_ON_START = False
+    OUTPUTS = {"frames": "q_out"}
+
+    def __init__(self, video_source=None, video_file=None, loop=False):
         """! Initializes the image provider process and queue
+        @param video_source The id of the camera to capture from
+        @param video_file   The video file to read from instead of a camera
+        @param loop         Restart the video file when its end is reached, e.g. for soak tests
         """
         super().__init__()
 
         self.frame_config = None
         self._videoStream = None
+        self._liveSource = video_file is None
 
         # Validate the frame_config
         max_w = max_h = 0
@@ -326,43 +450,91 @@ class ImageProvider(BeeProcess):
         if video_source is None and video_file is None:
             raise BaseException("Either a video file or a video source id is required")
 
+        # Crop the frames to the region of interest right after capturing them
+        self._roi = RegionOfInterest.fromConfig(frame_config)
+        if self._roi is not None:
+            frame_config = self._roi.getFrameConfig()
+            logger.info("Processing region of interest %ix%i of %ix%i" % \
+                    (frame_config[0][1], frame_config[0][0], max_h, max_w))
+
         # Prepare for reading from video file
         self.frame_config = frame_config
         if video_file is not None:
-            self._queue = multiprocessing.Queue(maxsize=get_config("FRAME_SET_BUFFER_LENGTH_VIDEO"))
+            self._bufferLength = get_config("FRAME_SET_BUFFER_LENGTH_VIDEO")
             vFile = Path(video_file)
             if not vFile.is_file():
                 raise BaseException("The given file '%s' doesn't seem to be valid!" % (video_file,))
         else:
-            self._queue = multiprocessing.Queue(maxsize=get_config("FRAME_SET_BUFFER_LENGTH_CAMERA"))
+            self._bufferLength = get_config("FRAME_SET_BUFFER_LENGTH_CAMERA")
+
+        # In latest frame mode, frame sets are only prepared on request of the consumer.
+        # A single request keeps one frame set ready while the consumer processes the
+        # previous one, more would let the consumer get frames that are older.
+        self._frameRequests = None
+        if self._liveSource and get_config("CAMERA_LATEST_FRAME_ONLY"):
+            self._bufferLength = 1
+            self._frameRequests = multiprocessing.Semaphore(self._bufferLength)
 
         self.set_process_param("video_file", video_file)
         self.set_process_param("video_source", video_source)
         self.set_process_param("config", self.frame_config)
-        self.set_process_param("q_out", self._queue)
-        self.start()
+        self.set_process_param("roi", self._roi)
+        self.set_process_param("buffer_length", self._bufferLength)
+        self.set_process_param("requests", self._frameRequests)
+        self.set_process_param("loop", loop and video_file is not None)
+
+        # The index of the next frame of the video file and the time the current pass
+        # of the loop started at, a restarted provider resumes there
+        self._resume = multiprocessing.Array('d', 2)
+        self.set_process_param("resume", self._resume)
+
+    def restart(self):
+        """! Starts the provider again after it ended. In latest frame mode, the frame sets
+             missing in the queue are requested again, a request taken by the ended provider
+             or a frame set discarded with a replaced queue would never be answered otherwise.
+        """
+        if self._frameRequests is not None:
+            while self._frameRequests.acquire(False):
+                pass
+            for _ in range(max(self._bufferLength - self._process_params["q_out"].qsize(), 0)):
+                self._frameRequests.release()
+        super().restart()
+
+    def getDefaultQueueSize(self, port):
+        """! Returns the buffer length for the frame sets, depending on the input
+        """
+        return self._bufferLength
+
+    def isLiveSource(self):
+        """! Returns whether the frames are captured from a live source (camera)
+        @return True for camera inputs, False for video files
+        """
+        return self._liveSource
 
-    def getQueue(self):
-        """! Returns the queue-object where the extracted frames will be put.
-        @return Returns the queue object
+    def getFrameRequests(self):
+        """! Returns the semaphore the consumer has to release for each frame set it takes
+             from the queue, or None if frames are not captured on request.
+        @return A semaphore or None
         """
-        return self._queue
+        return self._frameRequests
 
     @staticmethod
-    def run(q_out, config, video_source, video_file, parent, stopped, done):
+    def run(q_out, buffer_length, requests, config, roi, video_source, video_file, loop, resume, parent, stopped, done):
 
-        # Open video stream
+        # Flag to decode raw JPEG frames with, None if the frames are decoded by the stream
+        _decodeFlag = None
+
+        # Open video stream, video files are read by the decoder selected in the config.
+        # The decoder already crops the frames to the region of interest.
+        # A restarted provider resumes after the last frame it delivered, so no frame is counted twice.
+        with resume.get_lock():
+            _frameIndex, _loop_t = int(resume[0]), resume[1]
         if video_source == None:
-            logger.info("Starting from video file input: %s" % (video_file,))
-            # use HW acceleration for video file
-            if get_config("USE_GSTREAM"):
-                _videoStream = cv2.VideoCapture('filesrc location={}\
-                                        ! queue ! h264parse ! omxh264dec ! nvvidconv \
-                                        ! video/x-raw,format=BGRx,width=960,height=540 ! queue ! videoconvert ! queue \
-                                        ! video/x-raw,format=BGR ! appsink'.format(video_file),
-                                        cv2.CAP_GSTREAMER)
-            else:
-                _videoStream = cv2.VideoCapture(video_file)
+            logger.info("Starting from video file input: %s (%s decoder)" % (video_file, get_config("VIDEO_DECODER")))
+            if _frameIndex:
+                logger.info("Resuming the video file at frame %i" % (_frameIndex,))
+            _videoStream = create_decoder(video_file, get_frame_config(), roi, buffer_length + 1, _frameIndex)
+            _fps = _videoStream.getFrameRate()
         else:
             logger.info("Starting from camera input")
             _videoStream = cv2.VideoCapture(video_source)
@@ -375,57 +547,143 @@ class ImageProvider(BeeProcess):
             if h != None:
                 _videoStream.set(cv2.CAP_PROP_FRAME_HEIGHT, int(h))
 
+            # Let the camera deliver the raw MJPG frames and decode them
+            # at the lowest resolution that still covers the largest frame
+            if f == "MJPG" and w != None and h != None and get_config("CAMERA_REDUCED_DECODE"):
+                full_h, full_w = get_frame_config()[0][0:2]
+                _decodeFlag = FramePyramid.getReducedDecodeFlag((int(w), int(h)), (full_w, full_h))
+                if _decodeFlag != cv2.IMREAD_COLOR:
+                    _videoStream.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            _fps = _videoStream.get(cv2.CAP_PROP_FPS)
+
+        # Drain live sources in a separate thread and keep the newest frame only
+        _reader = None
+        if requests is not None:
+            _videoStream.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            _reader = LatestFrameReader(_videoStream)
+            _reader.start()
+
+        # Maximum time to block on a full queue before checking the stop flag again
+        _queue_timeout = get_config("QUEUE_READ_TIMEOUT")
+
+        # Builds the frame sets, a frame set may be used as long as it is in the queue
+        _pyramid = FramePyramid(config, buffer_length + 1, get_config("FRAME_PYRAMID_INTERPOLATION"))
+
+        # Live sources drop the oldest queued frame when the queue is full,
+        # video files wait until the consumer catches up
+        _dropFrames = video_source is not None and get_config("FRAME_DROP_CAMERA")
+
+        # The frame timestamp is taken from the video for files and from the clock for live sources
+        _fps = _fps or get_config("TRACKING_FRAME_RATE")
+        _frame_t = 0
+
         _process_time = 0
         _process_cnt = 0
         _skipped_cnt = 0
-        while stopped.value == 0:
+        _dropped_cnt = 0
 
-            # Check if the queue is full
-            if q_out.full():
+        # The input is open, wait for the other processes
+        BeeProcess.processReady()
 
-                # If the queue is full, then report it
-                if _skipped_cnt % 100 == 0:
-                    logger.debug("Buffer reached %i" % (q_out.qsize(),))
-                time.sleep(get_config("FRAME_SET_FULL_PAUSE_TIME"))
-                _skipped_cnt += 1
-            else:
+        while stopped.value == 0:
 
-                # There is still space in the queue, get a frame and process it
+            # Get a frame and process it
+            if _reader is not None:
+
+                # Wait until the consumer requests a frame set, then take the newest frame
+                if not requests.acquire(timeout=_queue_timeout):
+                    continue
+                _ret, _frame = (True, None)
+                while _ret and _frame is None and stopped.value == 0:
+                    _ret, _frame, _capture_t = _reader.read(_queue_timeout)
+                if _frame is None and _ret:
+                    break
+                _start_t = time.time()
+            else:
                 _start_t = time.time()
                 (_ret, _frame) = _videoStream.read()
+                _capture_t = time.time()
+
+            # Restart the video file at its end, the timestamps continue from the last frame
+            if not _ret and loop:
+                logger.info("End of video file reached, restarting it")
+                _videoStream.release()
+                _videoStream = create_decoder(video_file, get_frame_config(), roi, buffer_length + 1)
+                _loop_t = _frame_t + 1.0 / _fps
+                _frameIndex = 0
+                (_ret, _frame) = _videoStream.read()
+                _capture_t = time.time()
+
+            if not _ret:
+                logger.error("No frame received!")
+                logger.error("> Try another VIDEO_DECODER in the config.yaml!")
+                stopped.value = 1
+                break
+            _frameIndex += 1
+
+            # Get the timestamp of the frame, fall back to the nominal frame rate if
+            # the video position is unknown or does not increase
+            if video_source is None:
+                _last_frame_t = _frame_t
+                _frame_t = _loop_t + _videoStream.getPosition()
+                if not _frame_t > _last_frame_t:
+                    _frame_t = _last_frame_t + 1.0 / _fps
+            else:
+                _frame_t = _capture_t
 
-                if _ret:
-
-                    # Get the original shape
-                    h, w, c = _frame.shape
-
-                    # Convert the frame according to the given configuration.
-                    # The image will be resized if necessary and converted into gray-scale
-                    #  if needed.
-                    fs = tuple()
-                    for item in config:
-                        width, height = _frame.shape[0:2]
-                        if width != item[0] or height != item[1]:
-                            _frame = cv2.resize(_frame, (item[1], item[0]))
-                        if item[2] == cv2.IMREAD_GRAYSCALE:
-                            tmp = cv2.cvtColor(_frame, cv2.COLOR_BGR2GRAY)
-                            fs += (tmp,)
-                        else:
-                            fs += (_frame,)
+            # Decode raw frames at reduced resolution (if delivered by the camera)
+            if _decodeFlag is not None and (_frame.ndim < 3 or _frame.shape[0] == 1):
+                _frame = cv2.imdecode(_frame, _decodeFlag)
 
-                    # put the result in the outgoing queue
-                    q_out.put(fs)
+            # Get the original shape
+            h, w, c = _frame.shape
 
-                    # Calculate the time needed to process the frame and print it
-                    _process_time += time.time() - _start_t
-                    _process_cnt += 1
-                    if _process_cnt % 100 == 0:
-                        logger.debug('FPS: %i (%i, %i)\t\t buffer size: %i' % (100/_process_time, w, h ,q_out.qsize()))
-                        _process_time = 0
-                else:
-                    logger.error("No frame received!")
-                    logger.error("> Try disabling USE_GSTREAM in the config.yaml!")
-                    stopped.value = 1
+            # Crop the camera frame to the region of interest
+            if roi is not None and video_source is not None:
+                _frame = roi.cropFrame(_frame)
+
+            # Convert the frame according to the given configuration.
+            # The image will be resized if necessary and converted into gray-scale
+            #  if needed.
+            fs = _pyramid.build(_frame)
+
+            # Calculate the time needed to process the frame
+            _process_time += time.time() - _start_t
+            _process_cnt += 1
+            BeeProcess.itemProcessed()
+
+            # Put the result together with its capture and frame time in the outgoing queue
+            while stopped.value == 0:
+                try:
+                    q_out.put((_capture_t, _frame_t, fs), block=not _dropFrames, timeout=_queue_timeout)
+                    with resume.get_lock():
+                        resume[0], resume[1] = _frameIndex, _loop_t
+                    break
+                except queue.Full:
+
+                    # If the queue is full, then report it
+                    if _skipped_cnt % 100 == 0:
+                        logger.debug("Buffer reached %i" % (q_out.qsize(),))
+                    _skipped_cnt += 1
+
+                    # Drop the oldest frame set to make room for the new one
+                    if _dropFrames:
+                        try:
+                            q_out.get_nowait()
+                            _dropped_cnt += 1
+                        except queue.Empty:
+                            pass
+
+            # Print the time needed to process the frames
+            if _process_cnt % 100 == 0:
+                if _reader is not None:
+                    _dropped_cnt = _reader.getOverwrittenCount()
+                logger.debug('FPS: %i (%i, %i)\t\t buffer size: %i, dropped: %i' % (100/_process_time, w, h ,q_out.qsize(), _dropped_cnt))
+                _process_time = 0
+
+        # A stream still blocked in the reader is released when the process ends
+        if _reader is None or _reader.stop():
+            _videoStream.release()
 
         # End of process reached
         logger.info("Image provider stopped")
@@ -0,0 +1,87 @@
+##
+# @file LatestFrameReader.py
+#
+# @brief Thread that continuously drains a live video source and keeps the newest frame only.
+
+from threading import Thread, Condition
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LatestFrameReader(Thread):
+    """! The 'LatestFrameReader' reads frames from a live source (e.g. a camera)
+         as fast as the device delivers them and keeps only the newest one.
+         This prevents that frames pile up in the driver buffer while the
+         processing is slower than the camera, which bounds the latency
+         between capturing and processing a frame.
+    """
+
+    def __init__(self, stream):
+        """! Initializes the reader thread
+        @param stream   An opened stream object that provides 'read()' like 'cv2.VideoCapture'
+        """
+        Thread.__init__(self, daemon=True)
+        self.stopped = False
+        self._stream = stream
+        self._condition = Condition()
+        self._frame = None
+        self._capture_t = 0
+        self._ret = True
+        self._seq = 0
+        self._readSeq = 0
+        self._overwritten = 0
+
+    def run(self):
+        """! Reads frames until the stream ends or the reader gets stopped
+        """
+        while not self.stopped:
+            (_ret, _frame) = self._stream.read()
+            _capture_t = time.time()
+
+            with self._condition:
+                if not _ret:
+                    self._ret = False
+                    self._condition.notify_all()
+                    break
+
+                # Count frames that were replaced before anyone read them
+                if self._seq != self._readSeq:
+                    self._overwritten += 1
+
+                self._frame = _frame
+                self._capture_t = _capture_t
+                self._seq += 1
+                self._condition.notify_all()
+
+        logger.debug("Latest frame reader stopped")
+
+    def read(self, timeout=None):
+        """! Returns the newest frame that was not returned before
+        @param timeout  The maximum time to wait for a new frame
+        @return tuple (ret, frame, capture_t), frame is None if no new frame arrived in time
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq != self._readSeq or not self._ret, timeout)
+            if self._seq == self._readSeq:
+                return (self._ret, None, None)
+            self._readSeq = self._seq
+            return (True, self._frame, self._capture_t)
+
+    def getOverwrittenCount(self):
+        """! Returns the amount of captured frames that were replaced by newer ones before being read
+        """
+        return self._overwritten
+
+    def stop(self, timeout=1.0):
+        """! Stops the reader thread and joins it
+        @param timeout  The maximum time in seconds to wait for a blocked 'read()' of the stream
+        @return True if the thread stopped, otherwise the stream is still in use
+        """
+        self.stopped = True
+        self.join(timeout)
+        if self.is_alive():
+            logger.warning("Latest frame reader blocked in reading the stream, not waiting for it")
+            return False
+        return True
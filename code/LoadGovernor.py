@@ -0,0 +1,192 @@
+##
+# @file LoadGovernor.py
+#
+# @brief Sheds load under overload by degrading the processing in a fixed order.
+
+import multiprocessing
+import time
+import logging
+from Utils import get_config
+
+logger = logging.getLogger(__name__)
+
+## The degradation levels, each level includes the ones before
+LEVEL_NORMAL, LEVEL_PREVIEW, LEVEL_EXTRACTION, LEVEL_DRAWING, LEVEL_DETECTION = range(5)
+
+## The names of the levels used in the log
+_LEVEL_NAMES = ("normal", "preview frame skip raised", "extraction step raised", "optional drawing disabled",
+        "detection resolution lowered")
+
+
+class LoadGovernor(object):
+    """! The 'LoadGovernor' watches the depth of the queues between the stages and
+         the lag of the 'ImageConsumer'. While the load stays high, it degrades the
+         processing one level at a time, in this order:
+
+         1. The preview skips more frames (GOVERNOR_VISUALIZATION_FRAME_SKIP)
+         2. Fewer bee images are extracted (GOVERNOR_EXTRACT_FAME_STEP)
+         3. The preview only shows the detected bees and the counts
+         4. The bees are detected at a lower resolution (GOVERNOR_DETECTION_SCALE)
+
+         Counting the bees takes priority: the detection is only degraded when the
+         consumer itself lags behind, full queues of the other stages never touch it.
+         The lag only counts for live sources, frames of video files wait in the
+         read-ahead buffer of the provider and are never late. Preview frames skipped
+         because the preview queue was full count as a full queue.
+         A level is left again once the load stayed low for a longer time.
+
+         The level is kept in shared memory. The processes forked after the governor
+         was created read it to adjust their settings, only the main process updates it.
+    """
+
+    def __init__(self):
+        """! Initializes the governor
+        """
+        super(LoadGovernor, self).__init__()
+        self._level = multiprocessing.Value('i', LEVEL_NORMAL)
+        self._lag = multiprocessing.Value('d', 0.0)
+        self._previewSkipped = multiprocessing.Value('L', 0)
+
+        # The state of the main process
+        self._queues = []
+        self._previewSkippedLast = 0
+        self._check_t = 0
+        self._high_t = None
+        self._low_t = None
+
+    def getLevel(self):
+        """! Returns the current degradation level
+        """
+        return self._level.value
+
+    def getVisualizationFrameSkip(self):
+        """! Returns the amount of frames to skip between two preview frames
+        """
+        if self._level.value >= LEVEL_PREVIEW:
+            return get_config("GOVERNOR_VISUALIZATION_FRAME_SKIP")
+        return get_config("VISUALIZATION_FRAME_SKIP")
+
+    def getExtractFrameStep(self):
+        """! Returns the amount of frames between two extractions of a tracked bee
+        """
+        if self._level.value >= LEVEL_EXTRACTION:
+            return get_config("GOVERNOR_EXTRACT_FAME_STEP")
+        return get_config("EXTRACT_FAME_STEP")
+
+    def isDrawingReduced(self):
+        """! Returns whether the optional drawing of the preview is disabled
+        """
+        return self._level.value >= LEVEL_DRAWING
+
+    def getDetectionScale(self):
+        """! Returns the scale of the frame the bees are detected on, relative to the smallest frame
+        """
+        if self._level.value >= LEVEL_DETECTION:
+            return get_config("GOVERNOR_DETECTION_SCALE")
+        return 1.0
+
+    def reportLag(self, lag):
+        """! Reports the lag of the last frame processed by the 'ImageConsumer'
+        @param lag  The time in seconds between capturing and processing the frame, only for live sources
+        """
+        self._lag.value = lag
+
+    def previewSkipped(self):
+        """! Reports a preview frame skipped by the 'ImageConsumer', because the preview queue was full
+        """
+        with self._previewSkipped.get_lock():
+            self._previewSkipped.value += 1
+
+    def addQueue(self, name, q, size, receiver=None):
+        """! Registers a queue to watch its depth
+        @param name     The name of the queue used in the log
+        @param q        The queue
+        @param size     The maximum size of the queue, unlimited queues (0) are ignored
+        @param receiver The 'BeeProcess' reading the queue, the queue is ignored until it is ready
+        """
+        if size:
+            self._queues.append((name, q, size, receiver))
+
+    def _readLoad(self):
+        """! Returns the load of the consumer (lag relative to the latency budget) and the
+             load of the queues (the highest fill level), 1.0 is fully loaded
+        @return tuple (consumer_load, queue_load, name of the fullest queue)
+        """
+        consumer_load = self._lag.value / get_config("FRAME_LATENCY_BUDGET")
+        queue_load = 0.0
+        fullest = None
+        for name, q, size, receiver in self._queues:
+
+            # Queues of stages that still load fill up as intended, e.g. for the neural network
+            if receiver is not None and not receiver.isReady():
+                continue
+            try:
+                fill = q.qsize() / float(size)
+            except NotImplementedError:
+                continue
+            if fill > queue_load:
+                queue_load = fill
+                fullest = name
+
+        # Skipped preview frames show a full preview queue between two checks
+        skipped = self._previewSkipped.value
+        if skipped != self._previewSkippedLast:
+            self._previewSkippedLast = skipped
+            queue_load = 1.0
+            fullest = "preview (frames skipped)"
+        return consumer_load, queue_load, fullest
+
+    def update(self):
+        """! Raises or lowers the degradation level depending on the load, call it regularly
+        """
+        now = time.time()
+        if now - self._check_t < get_config("GOVERNOR_CHECK_INTERVAL"):
+            return
+        self._check_t = now
+        consumer_load, queue_load, fullest = self._readLoad()
+        level = self._level.value
+
+        # The detection is only degraded for the lag of the consumer
+        degrade_load = consumer_load if level + 1 == LEVEL_DETECTION else max(consumer_load, queue_load)
+        recover_load = consumer_load if level == LEVEL_DETECTION else max(consumer_load, queue_load)
+
+        # Change the level once the load stayed high or low long enough
+        if level < get_config("GOVERNOR_MAX_LEVEL") and degrade_load >= get_config("GOVERNOR_LOAD_HIGH"):
+            self._low_t = None
+            if self._high_t is None:
+                self._high_t = now
+            elif now - self._high_t >= get_config("GOVERNOR_DEGRADE_AFTER"):
+                self._setLevel(level + 1, "consumer lag %0.0f%%, %s %0.0f%% full" % \
+                        (consumer_load * 100.0, fullest or "queues", queue_load * 100.0))
+        elif level > LEVEL_NORMAL and recover_load <= get_config("GOVERNOR_LOAD_LOW"):
+            self._high_t = None
+            if self._low_t is None:
+                self._low_t = now
+            elif now - self._low_t >= get_config("GOVERNOR_RECOVER_AFTER"):
+                self._setLevel(level - 1, "load %0.0f%%" % (recover_load * 100.0,))
+        else:
+            self._high_t = None
+            self._low_t = None
+
+    def _setLevel(self, level, reason):
+        """! Changes the degradation level
+        """
+        if level > self._level.value:
+            logger.warning("Overload (%s), degrading to level %i: %s" % (reason, level, _LEVEL_NAMES[level]))
+        else:
+            logger.info("Load dropped (%s), recovering to level %i: %s" % (reason, level, _LEVEL_NAMES[level]))
+        self._level.value = level
+        self._high_t = None
+        self._low_t = None
+
+
+__governor = None
+def getLoadGovernor():
+    """! Returns the load governor
+    @return The governor instance
+    """
+    global __governor
+    if __governor is None:
+        __governor = LoadGovernor()
+
+    return __governor
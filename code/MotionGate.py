@@ -0,0 +1,98 @@
+##
+# @file MotionGate.py
+#
+# @brief Cheap motion detection to skip the bee detection on static frames.
+
+import math
+import cv2
+import numpy as np
+
+
+class MotionGate(object):
+    """! The 'MotionGate' decides whether a frame has to be processed by the bee
+         detection. It compares a heavily downsampled gray-scale version of each
+         frame against a running background. Frames are skipped only if nothing
+         moves and no bee is currently tracked, as soon as motion appears the
+         next frame gets processed again. Motion outside of the region of interest
+         is ignored, like the bee detection ignores it.
+    """
+
+    def __init__(self, size, threshold, min_changed, learning_rate, mask=None):
+        """! Initializes the 'MotionGate'
+        @param size             The (width, height) of the downsampled frame used for the motion detection
+        @param threshold        The per pixel difference (0-255) to the background that counts as change
+        @param min_changed      The fraction of changed pixels that counts as motion
+        @param learning_rate    The rate the running background adapts to the current frame
+        @param mask             Optional mask of the frames, only motion where it is non-zero counts
+        """
+        super(MotionGate, self).__init__()
+        self._size = tuple(size)
+        self._threshold = threshold
+        # Pixels of the downsampled frame that cover the mask at least partly
+        self._mask = None
+        area = self._size[0] * self._size[1]
+        if mask is not None:
+            small_mask = cv2.resize(mask, self._size, interpolation=cv2.INTER_AREA)
+            self._mask = (small_mask > 0).astype(np.float32)
+            area = cv2.countNonZero(self._mask)
+        self._minChanged = int(max(1, min_changed * area))
+        self._learningRate = learning_rate
+        self._background = None
+
+        self._frames = 0
+        self._skipped = 0
+
+    def hasMotion(self, frame):
+        """! Returns whether the given frame differs from the running background
+        @param frame    The BGR frame to check
+        @return True if motion was detected
+        """
+        small = cv2.resize(frame, self._size, interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+        if self._background is None:
+            self._background = small
+            return True
+
+        diff = cv2.absdiff(small, self._background)
+        if self._mask is not None:
+            diff = cv2.multiply(diff, self._mask)
+        changed = cv2.countNonZero(cv2.threshold(diff, self._threshold, 255, cv2.THRESH_BINARY)[1])
+        cv2.accumulateWeighted(small, self._background, self._learningRate)
+
+        return changed >= self._minChanged
+
+    def getWarmupLength(self, precision=1e-6):
+        """! Returns the amount of frames after which the background no longer depends on the
+             frame it started with, e.g. to start the gate in the middle of a video
+        @param precision    The remaining weight of the first frame in the background
+        @return The amount of frames
+        """
+        if self._learningRate >= 1.0:
+            return 1
+        return int(math.ceil(math.log(precision) / math.log(1.0 - self._learningRate)))
+
+    def shouldProcess(self, frame, tracks_alive):
+        """! Returns whether the bee detection and tracking has to run on the given frame
+        @param frame            The BGR frame to check
+        @param tracks_alive     The amount of tracks that are currently alive
+        @return True if the frame has to be processed
+        """
+        self._frames += 1
+
+        # Keep the background up to date, even if tracks are alive
+        motion = self.hasMotion(frame)
+        if motion or tracks_alive:
+            return True
+
+        self._skipped += 1
+        return False
+
+    def report(self):
+        """! Returns the fraction of skipped frames since the last report and resets the counters
+        @return The fraction of skipped frames (0-1)
+        """
+        ratio = self._skipped / self._frames if self._frames else 0
+        self._frames = 0
+        self._skipped = 0
+        return ratio
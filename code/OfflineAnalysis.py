@@ -0,0 +1,261 @@
+##
+# @file OfflineAnalysis.py
+#
+# @brief Analyses recorded videos offline, split into segments that are processed in parallel.
+
+import os
+import csv
+import time
+import logging
+import multiprocessing
+import cv2
+from Utils import get_config, get_frame_config
+from Statistic import getStatistics
+from BeeDetector import detect_bees
+from BeeTracking import BeeTracker
+from FramePyramid import FramePyramid
+from MotionGate import MotionGate
+from RegionOfInterest import RegionOfInterest
+from VideoDecoder import create_decoder
+from DetectionRecord import DetectionRecorder
+
+logger = logging.getLogger(__name__)
+
+
+def find_videos(path):
+    """! Returns the video files to analyse
+    @param path     A video file or a folder containing video files
+    @return A sorted list of video file paths
+    """
+    if os.path.isfile(path):
+        return [path]
+    if not os.path.isdir(path):
+        raise BaseException("The given path '%s' is neither a file nor a folder!" % (path,))
+
+    extensions = tuple(e.lower() for e in get_config("OFFLINE_VIDEO_EXTENSIONS"))
+    return sorted(os.path.join(path, f) for f in os.listdir(path) \
+            if f.lower().endswith(extensions) and os.path.isfile(os.path.join(path, f)))
+
+
+def get_frame_rate(video_file):
+    """! Returns the nominal frame rate of a video file, 0 if unknown
+    """
+    probe = cv2.VideoCapture(video_file)
+    fps = probe.get(cv2.CAP_PROP_FPS)
+    probe.release()
+    return fps
+
+
+def plan_segments(video_file):
+    """! Splits a video into segments of OFFLINE_SEGMENT_LENGTH seconds
+    @param video_file   The path to the video file
+    @return A list of tuples (video_file, start_frame, frame_count), frame_count
+            is None for the last segment, which is read until the end of the video
+    """
+    probe = cv2.VideoCapture(video_file)
+    fps = probe.get(cv2.CAP_PROP_FPS)
+    frames = int(probe.get(cv2.CAP_PROP_FRAME_COUNT))
+    probe.release()
+
+    # Videos of unknown length are analysed in one piece
+    if fps <= 0 or frames <= 0:
+        logger.warning("Unknown length of '%s', it is analysed without splitting" % (video_file,))
+        return [(video_file, 0, None)]
+
+    length = max(1, int(round(get_config("OFFLINE_SEGMENT_LENGTH") * fps)))
+    segments = []
+    for start in range(0, frames, length):
+        segments.append((video_file, start, length if start + length < frames else None))
+    return segments
+
+
+def init_worker():
+    """! Initializes a worker process, OpenCV must not start its own threads in each worker
+    """
+    cv2.setNumThreads(1)
+
+
+def analyse_segment(segment):
+    """! Detects the bees in each frame of a segment, runs in a worker process.
+         The bees are detected on all frames, whether the motion gate skips a frame
+         depends on the tracks alive and is decided by the 'VideoAnalysis'.
+    @param segment  tuple (video_file, start_frame, frame_count) as returned by 'plan_segments'
+    @return tuple (segment, detections), detections is a list with one tuple
+            (position, bees, groups, motion) per frame, position is the time in seconds
+            and motion tells whether the motion gate detected motion
+    """
+    video_file, start_frame, frame_count = segment
+
+    # Prepare the frames like the 'ImageProvider' and the 'ImageConsumer' do
+    frame_config = get_frame_config()
+    roi = RegionOfInterest.fromConfig(frame_config)
+    mask = None
+    if roi is not None:
+        mask = roi.getMask(len(frame_config) - 1)
+        pyramid = FramePyramid(roi.getFrameConfig(), 2, get_config("FRAME_PYRAMID_INTERPOLATION"))
+    else:
+        pyramid = FramePyramid(frame_config, 2, get_config("FRAME_PYRAMID_INTERPOLATION"))
+
+    # The motion gate starts on the frames before the segment, so its background is
+    # the same as when the video is processed in one piece
+    gate = None
+    warmup = 0
+    if get_config("MOTION_GATE_ENABLED"):
+        gate = MotionGate(get_config("MOTION_GATE_SIZE"), get_config("MOTION_GATE_THRESHOLD"),
+                get_config("MOTION_GATE_MIN_CHANGED"), get_config("MOTION_GATE_LEARNING_RATE"), mask)
+        warmup = min(start_frame, gate.getWarmupLength())
+    decoder = create_decoder(video_file, frame_config, roi, 2, start_frame - warmup)
+    for _ in range(warmup):
+        ret, frame = decoder.read()
+        if not ret:
+            break
+        gate.hasMotion(pyramid.build(frame)[-1])
+
+    detections = []
+    while frame_count is None or len(detections) < frame_count:
+        ret, frame = decoder.read()
+        if not ret:
+            break
+        fs = pyramid.build(frame)
+        motion = gate is None or gate.hasMotion(fs[-1])
+        bees, groups = detect_bees(fs[-1], 3, mask)
+        detections.append((decoder.getPosition(), bees, groups, motion))
+    decoder.release()
+
+    if frame_count is not None and len(detections) < frame_count:
+        logger.warning("Segment at frame %i of '%s' ended after %i of %i frames" % \
+                (start_frame, video_file, len(detections), frame_count))
+    return (segment, detections)
+
+
+class VideoAnalysis(object):
+    """! Replays the detections of all segments of one video through a 'BeeTracker'.
+         The segments are fed in order, so tracks that cross the border between two
+         segments simply continue and the results are the same as for processing the
+         video in one piece.
+    """
+
+    def __init__(self, video_file):
+        """! Initializes the tracker for the given video
+        @param video_file   The path to the video file
+        """
+        super(VideoAnalysis, self).__init__()
+        self.video_file = video_file
+
+        frame_config = get_frame_config()
+        roi = RegionOfInterest.fromConfig(frame_config)
+        frame_size = (frame_config[-2][1], frame_config[-2][0])
+        if roi is not None:
+            frame_size = roi.getSize(frame_config[-2][0] / frame_config[-1][0])
+        self._tracker = BeeTracker(get_config("TRACK_DIST_THRESHOLD"), get_config("TRACK_MAX_FRAME_SKIPPED"), frame_size)
+
+        self._frame_t = 0
+        self._start = getStatistics().readOverallStatistics()
+
+        # Record the detections to replay them later, e.g. to tune the tracking
+        self._recorder = None
+        if get_config("OFFLINE_RECORD_FOLDER") is not None:
+            self._recorder = DetectionRecorder(os.path.join(get_config("OFFLINE_RECORD_FOLDER"),
+                    os.path.basename(video_file)),
+                    {"video": video_file, "frame_size": list(frame_size), "roi": roi is not None,
+                     "decoder": get_config("VIDEO_DECODER")})
+
+    def addSegment(self, detections, fps):
+        """! Feeds the detections of the next segment to the tracker
+        @param detections   The detections as returned by 'analyse_segment'
+        @param fps          The nominal frame rate of the video
+        """
+        _dh = getStatistics()
+        fps = fps or get_config("TRACKING_FRAME_RATE")
+        for position, bees, groups, motion in detections:
+
+            # Same timestamps as the 'ImageProvider', positions that do not increase
+            # are replaced by the nominal frame rate
+            _last_frame_t = self._frame_t
+            self._frame_t = position
+            if not self._frame_t > _last_frame_t:
+                self._frame_t = _last_frame_t + 1.0 / fps
+
+            # Skip static frames while no bee is tracked, like the 'ImageConsumer'
+            if get_config("ENABLE_TRACKING") and (motion or len(self._tracker.tracks)):
+                self._tracker.update(bees, groups, self._frame_t)
+            if self._recorder is not None:
+                self._recorder.add(self._frame_t, bees, groups, motion)
+            _dh.frameProcessed()
+
+    def close(self):
+        """! Finishes the analysis of the video and writes the detection record
+        """
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+    def getResult(self):
+        """! Returns the statistics of the video
+        @return dict with the amount of processed frames, tracks, bees in and bees out
+        """
+        _, bees_in, bees_out, frames = getStatistics().readOverallStatistics()
+        _, s_in, s_out, s_frames = self._start
+        return {"video": self.video_file,
+                "frames": frames - s_frames,
+                "duration": round(self._frame_t, 3),
+                "tracks": self._tracker.trackId,
+                "bees_in": bees_in - s_in,
+                "bees_out": bees_out - s_out}
+
+
+def run_offline_analysis(path):
+    """! Analyses the given video file or folder of videos as fast as possible.
+         The videos are split into segments, the bee detection runs for all
+         segments in parallel, the tracking is done in order in this process.
+    @param path     A video file or a folder containing video files
+    @return A list with the statistics of each video, see 'VideoAnalysis.getResult'
+    """
+    videos = find_videos(path)
+    if not len(videos):
+        raise BaseException("No video files found in '%s'" % (path,))
+
+    segments = []
+    fps = {}
+    for video_file in videos:
+        segments += plan_segments(video_file)
+        fps[video_file] = get_frame_rate(video_file)
+
+    workers = get_config("OFFLINE_WORKERS") or multiprocessing.cpu_count()
+    logger.info("Analysing %i video(s) in %i segment(s) using %i worker(s)" % \
+            (len(videos), len(segments), workers))
+
+    results = []
+    analysis = None
+    _start_t = time.time()
+    with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+
+        # The results are returned in order, while later segments are already processed
+        for segment, detections in pool.imap(analyse_segment, segments):
+            video_file = segment[0]
+            if analysis is None or analysis.video_file != video_file:
+                if analysis is not None:
+                    analysis.close()
+                    results.append(analysis.getResult())
+                    logger.info("Finished %s" % (results[-1],))
+                analysis = VideoAnalysis(video_file)
+
+            analysis.addSegment(detections, fps[video_file])
+            logger.debug("Segment at frame %i of '%s' done, %i frames" % (segment[1], video_file, len(detections)))
+
+    analysis.close()
+    results.append(analysis.getResult())
+    logger.info("Finished %s" % (results[-1],))
+
+    frames = sum(r["frames"] for r in results)
+    _process_t = time.time() - _start_t
+    logger.info("Analysed %i frames in %0.1fs (%0.1f FPS)" % (frames, _process_t, frames / _process_t))
+
+    # Write the statistics of all videos
+    with open(get_config("OFFLINE_RESULT_FILE"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["video", "frames", "duration", "tracks", "bees_in", "bees_out"])
+        writer.writeheader()
+        writer.writerows(results)
+    logger.info("Statistics written to '%s'" % (get_config("OFFLINE_RESULT_FILE"),))
+
+    return results
@@ -0,0 +1,203 @@
+##
+# @file Overlay.py
+#
+# @brief Draws the detection and tracking results onto the preview frames.
+
+from collections import OrderedDict
+import cv2
+import numpy as np
+from Utils import get_config
+from Statistic import getStatistics
+
+
+class TextSprite(object):
+    """! A pre-rendered text: a mask of the text pixels, placed relative to the text origin
+         like 'cv2.putText' does. Drawing the sprite copies a plane of the text color
+         through the mask, which is a lot cheaper than rendering the glyphs again.
+         Texts crossing the frame border are rendered with 'cv2.putText', which clips
+         the glyphs slightly differently than cropping the mask would.
+    """
+
+    def __init__(self, text, font, font_scale, thickness):
+        """! Renders the text once
+        """
+        super(TextSprite, self).__init__()
+        self._text = (text, font, font_scale, thickness)
+        (w, h), baseline = cv2.getTextSize(text, font, font_scale, thickness)
+        pad = thickness + 1
+        self._mask = np.zeros((h + baseline + 2 * pad, w + 2 * pad), dtype=np.uint8)
+        cv2.putText(self._mask, text, (pad, h + pad), font, font_scale, 255, thickness)
+        self._offset = (-pad, -h - pad)
+        self._planes = {}
+
+    def draw(self, frame, org, color):
+        """! Draws the text onto the frame
+        @param frame    The frame to draw on
+        @param org      The bottom-left corner of the text, like in 'cv2.putText'
+        @param color    The color of the text
+        """
+        x, y = org[0] + self._offset[0], org[1] + self._offset[1]
+        mh, mw = self._mask.shape
+
+        # Render texts crossing the frame borders directly
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + mw, frame.shape[1]), min(y + mh, frame.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return
+        if (x0, y0, x1, y1) != (x, y, x + mw, y + mh):
+            text, font, font_scale, thickness = self._text
+            cv2.putText(frame, text, org, font, font_scale, color, thickness)
+            return
+        plane = self._planes.get(color)
+        if plane is None:
+            plane = np.empty(self._mask.shape + (3,), dtype=np.uint8)
+            plane[:] = color
+            self._planes[color] = plane
+        cv2.copyTo(plane[y0 - y:y1 - y, x0 - x:x1 - x], self._mask[y0 - y:y1 - y, x0 - x:x1 - x], frame[y0:y1, x0:x1])
+
+
+class OverlayRenderer(object):
+    """! The 'OverlayRenderer' draws detections, tracks, labels and statistics onto the
+         preview frames. The DRAW_* settings are read once when it is created. Texts are
+         rendered once into sprites and reused as long as they don't change, e.g. the
+         id and name of each track or the statistics. The overlay can be drawn on a
+         downscaled frame, which makes both the drawing and all later steps cheaper.
+    """
+
+    ## Maximum amount of cached text sprites
+    MAX_SPRITES = 512
+
+    def __init__(self, roi=None, level=0, scale=1.0):
+        """! Initializes the renderer
+        @param roi      The 'RegionOfInterest' the frames are cropped to, or None
+        @param level    The index of the frame in the frame config the frames correspond to
+        @param scale    The scale the overlay is drawn at, e.g. 0.5 for a half sized preview
+        """
+        super(OverlayRenderer, self).__init__()
+        self._roi = roi
+        self._level = level
+        self._scale = scale
+        self._sprites = OrderedDict()
+
+        self._drawEllipses = get_config("DRAW_DETECTED_ELLIPSES")
+        self._drawGroups = get_config("DRAW_DETECTED_GROUPS")
+        self._drawTrackingResults = get_config("DRAW_TRACKING_RESULTS")
+        self._drawGroupMarker = get_config("DRAW_GROUP_MARKER")
+        self._drawRectangle = get_config("DRAW_RECTANGLE_OVER_LAST_POSTION")
+        self._drawTrace = get_config("DRAW_TRACK_TRACE")
+        self._drawPrediction = get_config("DRAW_TRACK_PREDICTION")
+        self._drawTrackId = get_config("DRAW_TRACK_ID")
+        self._drawStats = get_config("DRAW_IN_OUT_STATS")
+        self._drawDetails = get_config("SHOW_VISUALIZATION_DETAILS")
+
+    def _sprite(self, text, font, font_scale, thickness):
+        """! Returns the cached sprite of the text, it's rendered if needed
+        """
+        key = (text, font, font_scale, thickness)
+        sprite = self._sprites.get(key)
+        if sprite is None:
+            sprite = TextSprite(text, font, font_scale * self._scale, max(1, int(round(thickness * self._scale))))
+            self._sprites[key] = sprite
+            if len(self._sprites) > self.MAX_SPRITES:
+                self._sprites.popitem(last=False)
+        else:
+            self._sprites.move_to_end(key)
+        return sprite
+
+    def _ellipse(self, e):
+        """! Scales an ellipse in the format of OpenCV
+        """
+        s = self._scale
+        return ((e[0][0] * s, e[0][1] * s), (e[1][0] * s, e[1][1] * s), e[2])
+
+    def render(self, frame, detected_bees, detected_bee_groups, tracker, details=None, reduced=False):
+        """! Draws the overlay
+        @param frame                The frame to draw on, it's modified unless the overlay is scaled
+        @param detected_bees        The detected bees as returned by 'detect_bees'
+        @param detected_bee_groups  The detected groups of bees as returned by 'detect_bees'
+        @param tracker              The 'BeeTracker'
+        @param details              List of text lines shown in the top right corner, optional
+        @param reduced              Only draw the detected bees and the counts, e.g. under overload
+        @return The resulting frame
+        """
+        s = self._scale
+        if s != 1.0:
+            frame = cv2.resize(frame, None, fx=s, fy=s, interpolation=cv2.INTER_AREA)
+
+        if self._drawEllipses:
+            for item in detected_bees:
+                cv2.ellipse(frame, self._ellipse(item), (0, 0, 255), 2)
+        if self._drawGroups and not reduced:
+            for item in detected_bee_groups:
+                cv2.ellipse(frame, self._ellipse(item), (255, 0, 0), 2)
+        if self._drawTrackingResults:
+            if not reduced:
+                self.drawTracks(frame, tracker)
+
+            # Draw count of bees, as part of the tracking results
+            if self._drawStats:
+                bees_in, bees_out = getStatistics().getBeeCountOverall()
+                self._sprite("In: %i, Out: %i" % (bees_in, bees_out), cv2.FONT_HERSHEY_SIMPLEX, 2, 5) \
+                        .draw(frame, (int(50 * s), int(50 * s)), (0, 0, 0))
+
+        # Place the region of interest back into the full frame
+        if self._roi is not None:
+            frame = self._roi.toFrame(frame, self._level, s)
+
+        if self._drawDetails and details and not reduced:
+            for num, line in enumerate(details):
+                self._sprite(line, cv2.FONT_HERSHEY_PLAIN, 1, 1) \
+                        .draw(frame, (frame.shape[1] - int(200 * s), int(20 * (num + 1) * s)), (0, 0, 255))
+
+        return frame
+
+    def drawTracks(self, frame, tracker):
+        """! Draws the tracks of the tracker, depending on the configuration
+        @param frame    The frame to draw on
+        @param tracker  The 'BeeTracker'
+        """
+        s = self._scale
+        colors = tracker.track_colors
+        for track in tracker.tracks:
+
+            # Only Draw tracks that have more than 1 waypoints
+            if len(track.trace) < 2:
+                continue
+
+            # Select a track color
+            t_c = colors[track.trackId % len(colors)]
+            x = int(track.trace[-1][0] * s)
+            y = int(track.trace[-1][1] * s)
+
+            # Draw marker that shows tracks underneath groups
+            if self._drawGroupMarker and track.in_group:
+                d = int(30 * s)
+                cv2.rectangle(frame, (x-d, y-d), (x+d, y+d), (0, 0, 0), max(1, int(10 * s)))
+
+            # Draw rectangle over last position
+            if self._drawRectangle:
+                d = int(10 * s)
+                cv2.rectangle(frame, (x-d, y-d), (x+d, y+d), t_c, 1)
+
+            # Draw trace, each segment in the track color with a black center line
+            if self._drawTrace:
+                points = [(int(p[0] * s), int(p[1] * s)) for p in track.trace]
+                width = max(1, int(4 * s))
+                for k in range(1, len(points)):
+                    cv2.line(frame, points[k], points[k - 1], t_c, width)
+                    cv2.line(frame, points[k], points[k - 1], (0, 0, 0), 1)
+
+            # Draw prediction
+            if self._drawPrediction:
+                cv2.circle(frame, (int(track.last_predict[0] * s), int(track.last_predict[3] * s)),
+                        int(tracker.dist_threshold * s), (0, 0, 255), 1)
+
+            if "varroa" in track.tags:
+                c = (int(x - 10 * s), int(y - 50 * s))
+                cv2.circle(frame, c, max(1, int(9 * s)), (0, 0, 255), -1)
+                cv2.circle(frame, c, max(1, int(10 * s)), (0, 0, 0), 2)
+
+            # Add Track Id
+            if self._drawTrackId:
+                self._sprite(str(track.trackId) + " " + track._name, cv2.FONT_HERSHEY_DUPLEX, 1, 1) \
+                        .draw(frame, (x, int(y - 30 * s)), (255, 255, 255))
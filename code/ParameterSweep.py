@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+##
+# @file ParameterSweep.py
+#
+# @brief Searches the detection and tracking settings that count the bees of a labelled clip best.
+#
+#        Usage: python3 ParameterSweep.py sweep.yaml
+#
+#        The sweep file names the clip, its manually counted results and the
+#        settings to try, see 'sweep.yaml' for an example. The bee detection runs
+#        once per combination of detection settings, the results are cached as
+#        detection records (see 'DetectionRecord') in SWEEP_CACHE_FOLDER. Settings
+#        that only affect the tracking are evaluated by replaying these records.
+
+import os
+import sys
+import csv
+import json
+import random
+import hashlib
+import logging
+import itertools
+import multiprocessing
+import yaml
+from Utils import get_config, set_config
+from Statistic import Statistics
+from BeeTracking import BeeTracker
+from DetectionRecord import DetectionRecord, replay_record
+from OfflineAnalysis import VideoAnalysis, get_frame_rate, plan_segments, analyse_segment, init_worker
+
+logging.basicConfig(level=logging.INFO, format='%(process)d %(asctime)s - %(name)s - %(levelname)s - \t%(message)s')
+logger = logging.getLogger(__name__)
+
+# Settings that only affect the tracking, changing them doesn't require to detect the bees again
+TRACKING_PARAMETERS = ("TRACK_DIST_THRESHOLD", "TRACK_MAX_FRAME_SKIPPED", "TRACKING_FRAME_RATE",
+                       "MAX_BEE_TRACE_LENGTH")
+
+# Settings that change the detections, they are part of the key of the detection cache
+DETECTION_PARAMETERS = ("BINARY_THRESHOLD_VALUE", "BINARY_THRESHOLD_MAX",
+                        "DETECT_ELLIPSE_AREA_MIN_SIZE", "DETECT_ELLIPSE_AREA_MAX_SIZE",
+                        "DETECT_GROUP_AREA_MIN_SIZE", "DETECT_GROUP_AREA_MAX_SIZE",
+                        "NN_EXTRACT_RESOLUTION", "ROI_ENABLED", "ROI_POLYGONS",
+                        "VIDEO_DECODER", "FRAME_PYRAMID_INTERPOLATION", "MOTION_GATE_ENABLED",
+                        "MOTION_GATE_SIZE", "MOTION_GATE_THRESHOLD", "MOTION_GATE_MIN_CHANGED",
+                        "MOTION_GATE_LEARNING_RATE")
+
+
+def create_settings(spec):
+    """! Creates the settings to evaluate
+    @param spec     The sweep file content
+    @return A list of dicts, each maps setting names to values
+    """
+    parameters = spec["parameters"]
+    names = sorted(parameters.keys())
+
+    if spec.get("search", "grid") == "grid":
+        return [dict(zip(names, values)) for values in itertools.product(*[parameters[n] for n in names])]
+
+    # Random search, values are either a list to choose from or a range {min, max}
+    rng = random.Random(spec.get("seed", 0))
+    settings = []
+    for _ in range(spec.get("samples", 20)):
+        item = {}
+        for name in names:
+            value = parameters[name]
+            if isinstance(value, dict):
+                if isinstance(value["min"], int) and isinstance(value["max"], int):
+                    item[name] = rng.randint(value["min"], value["max"])
+                else:
+                    item[name] = rng.uniform(value["min"], value["max"])
+            else:
+                item[name] = rng.choice(value)
+        settings.append(item)
+    return settings
+
+
+def split_setting(setting):
+    """! Splits a setting into the part that affects the detection and the part that affects the tracking only
+    @return tuple (detection, tracking) of dicts
+    """
+    detection = {k: v for k, v in setting.items() if k not in TRACKING_PARAMETERS}
+    tracking = {k: v for k, v in setting.items() if k in TRACKING_PARAMETERS}
+    return (detection, tracking)
+
+
+def apply_setting(setting):
+    """! Overrides the configuration of the current process with the given setting
+    """
+    for name, value in setting.items():
+        set_config(name, value)
+
+
+def cache_key(video_file, detection):
+    """! Returns the key of the cached detections for a video and detection setting
+    """
+    apply_setting(detection)
+    stat = os.stat(video_file)
+    key = {"video": os.path.abspath(video_file), "size": stat.st_size, "mtime": stat.st_mtime}
+    for name in DETECTION_PARAMETERS:
+        key[name] = get_config(name)
+    for name, value in detection.items():
+        key[name] = value
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[0:16]
+
+
+def _detect_segment(task):
+    """! Worker: detects the bees of a segment with the given detection setting
+    """
+    detection, segment = task
+    apply_setting(detection)
+    return analyse_segment(segment)
+
+
+def _track_record(task):
+    """! Worker: replays a detection record with the given tracking setting
+    @return tuple (tracks, bees_in, bees_out)
+    """
+    folder, tracking = task
+    apply_setting(tracking)
+    record = DetectionRecord(folder)
+
+    # Count with statistics of its own, the shared ones are counted by all workers at once
+    _dh = Statistics()
+    tracker = BeeTracker(get_config("TRACK_DIST_THRESHOLD"), get_config("TRACK_MAX_FRAME_SKIPPED"),
+            tuple(record.meta["frame_size"]), _dh)
+    replay_record(record, tracker)
+    bees_in, bees_out = _dh.getBeeCountOverall()
+    return (tracker.trackId, bees_in, bees_out)
+
+
+def evaluate(result, labels):
+    """! Compares the result of a setting with the labels of the clip
+    @param result   tuple (tracks, bees_in, bees_out)
+    @param labels   dict with the counted bees_in, bees_out and optionally the amount of bees
+    @return dict with the count errors, count accuracy and track fragmentation
+    """
+    tracks, bees_in, bees_out = result
+    err_in = bees_in - labels["bees_in"]
+    err_out = bees_out - labels["bees_out"]
+    total = max(1, labels["bees_in"] + labels["bees_out"])
+
+    # Tracks per bee, 1.0 means each bee was followed by a single track
+    bees = labels.get("bees") or max(1, bees_in + bees_out)
+    return {"tracks": tracks, "bees_in": bees_in, "bees_out": bees_out,
+            "error_in": err_in, "error_out": err_out,
+            "accuracy": round(max(0.0, 1.0 - (abs(err_in) + abs(err_out)) / total), 4),
+            "fragmentation": round(tracks / bees, 3)}
+
+
+def run_sweep(spec):
+    """! Runs the sweep described by the given sweep file content
+    @return A list of dicts, one per setting, sorted by the count accuracy
+    """
+    video_file = spec["video"]
+    labels = spec["labels"]
+    settings = create_settings(spec)
+    workers = get_config("SWEEP_WORKERS") or multiprocessing.cpu_count()
+
+    # Find the detection settings that are not cached yet
+    defaults = {name: get_config(name) for name in spec["parameters"].keys()}
+    detections = {}
+    for setting in settings:
+        detection, _ = split_setting(setting)
+        key = cache_key(video_file, detection)
+        detections[key] = detection
+    apply_setting(defaults)
+
+    folders = {key: os.path.join(get_config("SWEEP_CACHE_FOLDER"), key) for key in detections.keys()}
+    missing = [key for key in detections.keys() \
+            if not os.path.isfile(os.path.join(folders[key], os.path.basename(video_file), "meta.json"))]
+    logger.info("Evaluating %i settings, %i detection settings (%i cached) using %i worker(s)" % \
+            (len(settings), len(detections), len(detections) - len(missing), workers))
+
+    with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+
+        # Detect the bees for each missing detection setting, all segments of all settings in parallel
+        segments = plan_segments(video_file)
+        fps = get_frame_rate(video_file)
+        record_folder = get_config("OFFLINE_RECORD_FOLDER")
+        tasks = [(detections[key], segment) for key in missing for segment in segments]
+        results = pool.imap(_detect_segment, tasks)
+        for key in missing:
+            apply_setting(detections[key])
+            set_config("OFFLINE_RECORD_FOLDER", folders[key])
+            analysis = VideoAnalysis(video_file)
+            for _ in segments:
+                _, frames = next(results)
+                analysis.addSegment(frames, fps)
+            analysis.close()
+            logger.info("Detections cached for %s" % (detections[key],))
+        apply_setting(defaults)
+        set_config("OFFLINE_RECORD_FOLDER", record_folder)
+
+        # Replay the cached detections with each tracking setting
+        tasks = []
+        for setting in settings:
+            detection, tracking = split_setting(setting)
+            key = cache_key(video_file, detection)
+            tasks.append((os.path.join(folders[key], os.path.basename(video_file)), tracking))
+        apply_setting(defaults)
+        results = pool.map(_track_record, tasks)
+
+    report = []
+    for setting, result in zip(settings, results):
+        item = dict(setting)
+        item.update(evaluate(result, labels))
+        report.append(item)
+    return sorted(report, key=lambda x: (-x["accuracy"], abs(x["fragmentation"] - 1.0)))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: %s <sweep file>" % (sys.argv[0],))
+        return
+    with open(sys.argv[1]) as f:
+        spec = yaml.load(f, Loader=yaml.FullLoader)
+
+    report = run_sweep(spec)
+
+    # Print the best settings and write all of them
+    names = sorted(spec["parameters"].keys())
+    print("\nLabels: %s" % (spec["labels"],))
+    print("Best settings:")
+    for item in report[0:spec.get("top", 10)]:
+        print("  accuracy %0.3f, fragmentation %0.2f, in %i (%+i), out %i (%+i), tracks %i: %s" % \
+                (item["accuracy"], item["fragmentation"], item["bees_in"], item["error_in"],
+                 item["bees_out"], item["error_out"], item["tracks"],
+                 ", ".join("%s=%s" % (n, item[n]) for n in names)))
+
+    output = spec.get("output", "sweep_results.csv")
+    with open(output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=names + ["accuracy", "fragmentation", "tracks",
+                "bees_in", "bees_out", "error_in", "error_out"])
+        writer.writeheader()
+        writer.writerows(report)
+    logger.info("Results of %i settings written to '%s'" % (len(report), output))
+
+
+if __name__ == '__main__':
+    main()
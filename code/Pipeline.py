@@ -0,0 +1,310 @@
+##
+# @file Pipeline.py
+#
+# @brief Builds the processes and queues of the pipeline from the stage graph in the config.
+
+import multiprocessing
+import multiprocessing.queues
+import queue
+import os
+import logging
+from Utils import get_config
+from BeeDetector import BeeClassification
+from ImageProcessing import ImageProvider, ImageConsumer, ImageExtractor
+from Visual import Visual
+
+logger = logging.getLogger(__name__)
+
+## The process types that can be used in the stages of the pipeline
+STAGE_TYPES = {
+    "ImageProvider": ImageProvider,
+    "ImageConsumer": ImageConsumer,
+    "ImageExtractor": ImageExtractor,
+    "BeeClassification": BeeClassification,
+    "Visual": Visual,
+}
+
+
+class OwnedLock(object):
+    """! A 'multiprocessing.Lock' that records the process holding it, so a lock left
+         held by a crashed process can be told apart from one a living process holds
+         for a longer time, e.g. while sending a large item.
+    """
+
+    def __init__(self, lock):
+        """! Initializes the lock
+        @param lock     The 'multiprocessing.Lock' to wrap
+        """
+        super(OwnedLock, self).__init__()
+        self._lock = lock
+        self._owner = multiprocessing.Value('i', 0, lock=False)
+
+    def acquire(self, block=True, timeout=None):
+        if not self._lock.acquire(block, timeout):
+            return False
+        self._owner.value = os.getpid()
+        return True
+
+    def release(self):
+        self._owner.value = 0
+        self._lock.release()
+
+    def getOwner(self):
+        """! Returns the id of the process holding the lock, 0 if it is free
+        """
+        return self._owner.value
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class StageQueue(multiprocessing.queues.Queue):
+    """! The queue between two stages, a 'multiprocessing.Queue' that knows which
+         process holds its locks.
+
+         A process killed while it received or sent an item keeps holding the lock
+         and may have left a partial item in the pipe. Releasing the lock would let
+         the other processes read the broken item, the queue gets replaced instead,
+         see 'Pipeline.repairQueues'.
+    """
+
+    def __init__(self, maxsize=0):
+        """! Creates the queue
+        @param maxsize  The maximum amount of queued items, 0 for no limit
+        """
+        super(StageQueue, self).__init__(maxsize, ctx=multiprocessing.get_context())
+        self._rlock = OwnedLock(self._rlock)
+        if self._wlock is not None:
+            self._wlock = OwnedLock(self._wlock)
+
+    def isHeldBy(self, pid):
+        """! Returns whether a process holds one of the locks of the queue
+        @param pid  The id of the process
+        """
+        return any(lock is not None and lock.getOwner() == pid for lock in (self._rlock, self._wlock))
+
+    def reset(self):
+        """! Replaces the pipe and the locks of the queue, the queued items are discarded.
+             Processes that are running keep using the old ones, only processes started
+             afterwards use the new ones. Call it in the main process only.
+        """
+        self._reader.close()
+        self._writer.close()
+        self.__init__(self._maxsize)
+
+
+class QueueGroup(object):
+    """! The 'QueueGroup' distributes the items put into it over the queues of the
+         workers of a stage. Each item goes to the next queue in turn that has room,
+         so busy workers get fewer items.
+    """
+
+    def __init__(self, queues):
+        """! Initializes the group
+        @param queues   The queues of the workers
+        """
+        super(QueueGroup, self).__init__()
+        self.queues = queues
+        self._next = 0
+
+    def put(self, item, block=True, timeout=None):
+        """! Puts the item into the next queue that has room, like 'Queue.put'
+        """
+        n = len(self.queues)
+        for i in range(n):
+            try:
+                self.queues[(self._next + i) % n].put(item, block=False)
+                self._next = (self._next + i + 1) % n
+                return
+            except queue.Full:
+                pass
+        if not block:
+            raise queue.Full
+
+        # All queues are full, wait for the next one in turn
+        q = self.queues[self._next]
+        self._next = (self._next + 1) % n
+        q.put(item, True, timeout)
+
+    def put_nowait(self, item):
+        self.put(item, False)
+
+    def get_nowait(self):
+        """! Takes an item from the fullest queue, e.g. to drop it
+        """
+        for q in sorted(self.queues, key=lambda q: -q.qsize()):
+            try:
+                return q.get_nowait()
+            except queue.Empty:
+                pass
+        raise queue.Empty
+
+    def qsize(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def empty(self):
+        return all(q.empty() for q in self.queues)
+
+    def cancel_join_thread(self):
+        for q in self.queues:
+            q.cancel_join_thread()
+
+
+class Pipeline(object):
+    """! The 'Pipeline' creates the processes of each stage and connects them by queues,
+         as described by a stage graph:
+
+         - Each stage gives the process type, the amount of workers, the CPUs
+           they may run on and the threads each library may use within a worker.
+         - Each queue connects an output port of one stage to an input port of
+           another one. Each worker of the receiving stage gets its own queue, the
+           workers of the sending stage distribute their items over them.
+    """
+
+    def __init__(self, stages, queues, args=None):
+        """! Creates the processes and queues
+        @param stages   dict of the stages by name, each a dict with the "type" of the
+                        process and optionally "workers", "cpus", "threads", "required",
+                        "background" and "when"
+        @param queues   list of the queues, each as [from "stage.port", to "stage.port", size]
+        @param args     dict of the arguments passed to the processes of a type, e.g.
+                        {"ImageProvider": {"video_file": "bees.mp4"}}
+        """
+        super(Pipeline, self).__init__()
+        args = args or {}
+        self._stages = {}
+        self._options = {}
+        self._queues = []
+        self._queueSizes = {}
+        self._queueProcesses = []
+
+        for name, stage in stages.items():
+
+            # Skip stages depending on a disabled setting, e.g. the neural network
+            if stage.get("when") is not None and not get_config(stage["when"]):
+                logger.info("Stage '%s' skipped, %s is disabled" % (name, stage["when"]))
+                continue
+
+            if stage.get("type") not in STAGE_TYPES:
+                raise BaseException("Stage '%s' has unknown type '%s', expected one of %s" % \
+                        (name, stage.get("type"), ", ".join(STAGE_TYPES)))
+            cls = STAGE_TYPES[stage["type"]]
+            workers = stage.get("workers", 1)
+            if workers < 1 or (cls.MAX_WORKERS is not None and workers > cls.MAX_WORKERS):
+                raise BaseException("Stage '%s' supports 1 to %s workers, %i given" % \
+                        (name, cls.MAX_WORKERS or "any", workers))
+
+            # Limit the threads to the amount of CPUs the stage runs on, if not given
+            cpus = stage.get("cpus")
+            threads = stage.get("threads")
+            if threads is None and cpus is not None:
+                threads = len(cpus)
+
+            processes = []
+            for _ in range(workers):
+                process = cls(**args.get(stage["type"], {}))
+                process.setCpus(cpus)
+                process.setThreads(threads)
+                processes.append(process)
+            self._stages[name] = processes
+            self._options[name] = (stage.get("required", False), stage.get("background", False))
+
+        for source, target, size in queues:
+            self._connect(source, target, size)
+
+    @staticmethod
+    def fromConfig(args=None):
+        """! Creates the pipeline given by PIPELINE_STAGES and PIPELINE_QUEUES
+        @param args     The arguments passed to the processes of a type, see '__init__'
+        @return The pipeline
+        """
+        return Pipeline(get_config("PIPELINE_STAGES"), get_config("PIPELINE_QUEUES"), args)
+
+    def _parsePort(self, port):
+        """! Splits "stage.port" into the name of the stage and the port
+        """
+        stage, _, name = port.partition(".")
+        if not len(name):
+            raise BaseException("Expected 'stage.port', got '%s'" % (port,))
+        return stage, name
+
+    def _connect(self, source, target, size):
+        """! Creates the queues from an output port to an input port, one for each receiving worker
+        """
+        source_stage, source_port = self._parsePort(source)
+        target_stage, target_port = self._parsePort(target)
+
+        # Queues of skipped stages are skipped as well
+        if source_stage not in self._stages or target_stage not in self._stages:
+            logger.debug("Queue %s -> %s skipped" % (source, target))
+            return
+        senders = self._stages[source_stage]
+        receivers = self._stages[target_stage]
+        if source_port not in senders[0].OUTPUTS:
+            raise BaseException("Stage '%s' has no output '%s'" % (source_stage, source_port))
+        if target_port not in receivers[0].INPUTS:
+            raise BaseException("Stage '%s' has no input '%s'" % (target_stage, target_port))
+
+        if size is None:
+            size = senders[0].getDefaultQueueSize(source_port)
+        queues = [StageQueue(size) for _ in receivers]
+        for receiver, q in zip(receivers, queues):
+            receiver.connect(target_port, q, senders)
+        for sender in senders:
+            sender.connect(source_port, queues[0] if len(queues) == 1 else QueueGroup(queues), receivers)
+
+        # Name the queues after the receiving workers
+        for name, receiver, q in zip(self._names(target_stage), receivers, queues):
+            self._queues.append(("%s.%s" % (name, target_port), q))
+            self._queueSizes["%s.%s" % (name, target_port)] = size
+            self._queueProcesses.append(("%s.%s" % (name, target_port), q, senders + [receiver]))
+
+    def _names(self, stage):
+        """! Returns the names of the workers of a stage, the stage name for a single worker
+        """
+        n = len(self._stages[stage])
+        return [stage] if n == 1 else ["%s-%i" % (stage, i + 1) for i in range(n)]
+
+    def getProcesses(self):
+        """! Returns the processes of all stages
+        @return list of tuples (name, process, required, background)
+        """
+        result = []
+        for stage, processes in self._stages.items():
+            required, background = self._options[stage]
+            for name, process in zip(self._names(stage), processes):
+                result.append((name, process, required, background))
+        return result
+
+    def getQueues(self):
+        """! Returns the queues between the stages, named after the receiving worker and port
+        @return list of tuples (name, queue)
+        """
+        return list(self._queues)
+
+    def repairQueues(self, process):
+        """! Replaces the queues a process that ended left broken, it was killed while
+             it received or sent an item. The other processes using a replaced queue
+             still use the old one and have to be restarted as well.
+        @param process  The 'BeeProcess' that ended, before it is restarted
+        @return list of the other processes using the replaced queues
+        """
+        pid = process.getPid()
+        peers = []
+        for name, q, processes in self._queueProcesses:
+            if process not in processes or not q.isHeldBy(pid):
+                continue
+            logger.warning("Queue '%s' was in use by the ended process, replacing it" % (name,))
+            q.reset()
+            peers += [peer for peer in processes if peer is not process and peer not in peers]
+        return peers
+
+    def getQueueSize(self, name):
+        """! Returns the maximum size of a queue
+        @param name     The name of the queue as returned by 'getQueues'
+        @return The size, 0 for unlimited queues
+        """
+        return self._queueSizes[name]
@@ -0,0 +1,170 @@
+##
+# @file PreviewServer.py
+#
+# @brief HTTP server that streams the preview as MJPEG, e.g. for headless hive devices.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Condition
+import time
+import logging
+import cv2
+
+logger = logging.getLogger(__name__)
+
+## The page shown at the root path of the server
+_PAGE = b"""<html><head><title>Bee preview</title></head>
+<body style="margin:0;background:#000"><img src="/stream.mjpg" style="max-width:100%"/></body></html>"""
+
+
+class PreviewServer(Thread):
+    """! The 'PreviewServer' streams the latest published frame to each connected
+         client as MJPEG (http://<address>:<port>/stream.mjpg, a page showing it
+         at the root path).
+
+         Frames are only encoded when a client requests them and each frame is
+         encoded once for all clients. Each client receives the newest frame as
+         soon as it finished receiving the previous one, so slow clients get a
+         lower frame rate instead of a growing delay. Check 'hasClients' before
+         rendering a frame, nothing needs to be published while nobody is connected.
+    """
+
+    def __init__(self, address, port, quality=70, max_fps=15):
+        """! Initializes the server thread
+        @param address  The address to listen on, e.g. "127.0.0.1" or "0.0.0.0" for all interfaces
+        @param port     The port to listen on
+        @param quality  The JPEG quality (0-100)
+        @param max_fps  The maximum frame rate sent to each client, None or 0 for no limit
+        """
+        Thread.__init__(self, daemon=True)
+        self._quality = quality
+        self._interval = 1.0 / max_fps if max_fps else 0
+        self._condition = Condition()
+        self._frame = None
+        self._seq = 0
+        self._jpeg = None
+        self._jpegSeq = 0
+        self._clients = 0
+        self.stopped = False
+
+        server = self
+        class Handler(PreviewRequestHandler):
+            preview = server
+        self._httpd = ThreadingHTTPServer((address, port), Handler)
+        self._httpd.daemon_threads = True
+
+    def run(self):
+        """! Serves the clients until the server gets stopped
+        """
+        logger.info("Preview available at http://%s:%i/" % self._httpd.server_address[0:2])
+        self._httpd.serve_forever(poll_interval=0.5)
+
+    def hasClients(self):
+        """! Returns whether a client is connected
+        """
+        return self._clients > 0
+
+    def publish(self, frame):
+        """! Publishes a new frame, it is encoded when the first client requests it
+        @param frame    The frame, it must not be modified afterwards
+        """
+        with self._condition:
+            self._frame = frame
+            self._seq += 1
+            self._condition.notify_all()
+
+    def getFrame(self, last_seq, timeout):
+        """! Waits for a frame newer than the given one and returns it JPEG encoded
+        @param last_seq The sequence number of the frame the client received last
+        @param timeout  The maximum time to wait
+        @return tuple (seq, jpeg), jpeg is None if no newer frame was published in time
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq != last_seq or self.stopped, timeout) or self.stopped:
+                return (last_seq, None)
+            if self._jpegSeq == self._seq:
+                return (self._jpegSeq, self._jpeg)
+            frame, seq = self._frame, self._seq
+
+        # Encode outside of the lock, so 'publish' never waits for it. Each frame is
+        # encoded once, unless clients request it at the same time.
+        ret, jpeg = cv2.imencode(".jpeg", frame, [cv2.IMWRITE_JPEG_QUALITY, self._quality])
+        jpeg = jpeg.tobytes() if ret else None
+        with self._condition:
+            if self._jpegSeq < seq:
+                self._jpeg = jpeg
+                self._jpegSeq = seq
+        return (seq, jpeg)
+
+    def clientConnected(self, connected):
+        """! Counts the connected clients, called by the request handler
+        """
+        with self._condition:
+            self._clients += 1 if connected else -1
+        logger.info("Preview client %s, %i connected" % ("connected" if connected else "disconnected", self._clients))
+
+    def getInterval(self):
+        """! Returns the minimum time between two frames sent to a client
+        """
+        return self._interval
+
+    def stop(self):
+        """! Stops the server and disconnects the clients
+        """
+        with self._condition:
+            self.stopped = True
+            self._condition.notify_all()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self.join()
+
+
+class PreviewRequestHandler(BaseHTTPRequestHandler):
+    """! Handles the requests of a single client of the 'PreviewServer'
+    """
+
+    ## The 'PreviewServer' the handler belongs to
+    preview = None
+
+    def do_GET(self):
+        if self.path == "/":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(_PAGE)))
+            self.end_headers()
+            self.wfile.write(_PAGE)
+        elif self.path == "/stream.mjpg":
+            self.send_response(200)
+            self.send_header("Cache-Control", "no-cache, private")
+            self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=FRAME")
+            self.end_headers()
+            self._stream()
+        else:
+            self.send_error(404)
+
+    def _stream(self):
+        """! Sends the newest frames until the client disconnects or the server stops
+        """
+        preview = self.preview
+        preview.clientConnected(True)
+        seq = 0
+        try:
+            while not preview.stopped:
+                start = time.time()
+                seq, jpeg = preview.getFrame(seq, 1.0)
+                if jpeg is None:
+                    continue
+                self.wfile.write(b"--FRAME\r\nContent-Type: image/jpeg\r\nContent-Length: %i\r\n\r\n" % (len(jpeg),))
+                self.wfile.write(jpeg)
+                self.wfile.write(b"\r\n")
+
+                # Limit the frame rate of the client
+                wait = preview.getInterval() - (time.time() - start)
+                if wait > 0:
+                    time.sleep(wait)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            preview.clientConnected(False)
+
+    def log_message(self, format, *args):
+        logger.debug("Preview request from %s: %s" % (self.address_string(), format % args))
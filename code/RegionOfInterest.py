@@ -0,0 +1,136 @@
+##
+# @file RegionOfInterest.py
+#
+# @brief Restricts the processing to a region of interest, e.g. the hive entrance.
+
+import cv2
+import numpy as np
+from Utils import get_config
+
+
+class RegionOfInterest(object):
+    """! The 'RegionOfInterest' describes the part of the frame that gets processed.
+         It is defined by one or more polygons given in coordinates relative to the
+         frame size (0-1). The frames are cropped to the bounding rectangle of all
+         polygons right after capturing them, so every later stage only works on the
+         cropped part. Pixels outside of the polygons are masked for the detection.
+
+         The bounding rectangle is aligned to the pixel grid of the smallest frame of
+         the frame config, so that all frames keep their integer scale factors.
+    """
+
+    def __init__(self, polygons, frame_config):
+        """! Initializes the region of interest
+        @param polygons         List of polygons, each a list of [x, y] points relative to the frame size
+        @param frame_config     The frame config as returned by 'get_frame_config'
+        """
+        super(RegionOfInterest, self).__init__()
+        if not len(polygons):
+            raise BaseException("At least one ROI polygon has to be provided!")
+
+        self._frameConfig = frame_config
+        self._polygons = [np.array(p, dtype=np.float64).reshape(-1, 2) for p in polygons]
+
+        # Bounding rectangle in pixels of the smallest frame
+        s_h, s_w = frame_config[-1][0:2]
+        points = np.concatenate(self._polygons)
+        self._x0 = int(np.clip(np.floor(points[:, 0].min() * s_w), 0, s_w - 1))
+        self._y0 = int(np.clip(np.floor(points[:, 1].min() * s_h), 0, s_h - 1))
+        self._x1 = int(np.clip(np.ceil(points[:, 0].max() * s_w), self._x0 + 1, s_w))
+        self._y1 = int(np.clip(np.ceil(points[:, 1].max() * s_h), self._y0 + 1, s_h))
+        self._smallSize = (s_w, s_h)
+
+        # Mask of the polygons for each frame of the frame config
+        self._masks = []
+        for item in frame_config:
+            scale = item[0] / s_h
+            w, h = self.getSize(scale)
+            mask = np.zeros((h, w), dtype=np.uint8)
+            for p in self._polygons:
+                pts = (p * (s_w * scale, s_h * scale) - self.getOffset(scale)).round().astype(np.int32)
+                cv2.fillPoly(mask, [pts], 255)
+
+            # Skip masking if the polygons cover the whole rectangle
+            self._masks.append(None if cv2.countNonZero(mask) == w * h else mask)
+
+    @staticmethod
+    def fromConfig(frame_config):
+        """! Creates the region of interest according to the configuration
+        @param frame_config     The frame config as returned by 'get_frame_config'
+        @return A 'RegionOfInterest' or None if disabled
+        """
+        if not get_config("ROI_ENABLED"):
+            return None
+        return RegionOfInterest(get_config("ROI_POLYGONS"), frame_config)
+
+    def getSize(self, scale=1):
+        """! Returns the size of the region for a frame with the given scale
+        @param scale    The scale relative to the smallest frame of the frame config
+        @return tuple (width, height)
+        """
+        return (int(round((self._x1 - self._x0) * scale)), int(round((self._y1 - self._y0) * scale)))
+
+    def getOffset(self, scale=1):
+        """! Returns the position of the region within a frame with the given scale
+        @param scale    The scale relative to the smallest frame of the frame config
+        @return tuple (x, y)
+        """
+        return (int(round(self._x0 * scale)), int(round(self._y0 * scale)))
+
+    def getFrameConfig(self):
+        """! Returns the frame config with all frame sizes reduced to the region
+        @return The frame config for the cropped frames
+        """
+        s_h = self._frameConfig[-1][0]
+        config = tuple()
+        for item in self._frameConfig:
+            w, h = self.getSize(item[0] / s_h)
+            config += ((h, w, item[2]),)
+        return config
+
+    def getMask(self, level):
+        """! Returns the polygon mask for the given frame of the frame config
+        @param level    The index of the frame in the frame config
+        @return The mask (255 inside of the polygons) or None if the whole region is used
+        """
+        return self._masks[level]
+
+    def getRect(self, width, height):
+        """! Returns the bounding rectangle of the region within a frame of any resolution
+        @param width    The width of the full frame
+        @param height   The height of the full frame
+        @return tuple (x0, y0, x1, y1)
+        """
+        s_w, s_h = self._smallSize
+        x0 = int(round(self._x0 * width / s_w))
+        x1 = int(round(self._x1 * width / s_w))
+        y0 = int(round(self._y0 * height / s_h))
+        y1 = int(round(self._y1 * height / s_h))
+        return (x0, y0, x1, y1)
+
+    def cropFrame(self, frame):
+        """! Crops a captured frame of any resolution to the region
+        @param frame    The full frame
+        @return The cropped frame (a view of the given frame)
+        """
+        h, w = frame.shape[0:2]
+        x0, y0, x1, y1 = self.getRect(w, h)
+        return frame[y0:y1, x0:x1]
+
+    def toFrame(self, image, level, scale=1):
+        """! Places an image of the region back into a frame of the full size
+        @param image    The cropped image, e.g. including the drawn results
+        @param level    The index of the frame in the frame config the image corresponds to
+        @param scale    Additional scale of the image relative to that frame, e.g. 0.5 for a half sized preview
+        @return The full sized frame including the outline of the polygons
+        """
+        h, w = self._frameConfig[level][0:2]
+        h, w = int(round(h * scale)), int(round(w * scale))
+        x, y = self.getOffset(h / self._frameConfig[-1][0])
+        frame = np.zeros((h, w) + image.shape[2:], dtype=image.dtype)
+        image = image[0:h-y, 0:w-x]
+        frame[y:y+image.shape[0], x:x+image.shape[1]] = image
+        for p in self._polygons:
+            pts = (p * (w, h)).round().astype(np.int32)
+            cv2.polylines(frame, [pts], True, (0, 255, 255), 1)
+        return frame
@@ -0,0 +1,228 @@
+##
+# @file ResourceMonitor.py
+#
+# @brief Samples the resource usage of the pipeline processes and reports drift,
+#        used by the soak test (main.py --soak).
+
+import os
+import csv
+import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def read_process_usage(pid):
+    """! Reads the resource usage of a process from /proc (Linux only)
+    @param pid  The id of the process
+    @return dict with the resident memory in MB, open file descriptors, threads and the
+            CPU time in seconds, or None if the process does not exist (anymore)
+    """
+    try:
+        usage = {"rss": 0.0, "threads": 0}
+        with open("/proc/%i/status" % (pid,)) as f:
+            for line in f:
+                if line.startswith("State:") and line.split()[1] in ("Z", "X"):
+                    return None
+                elif line.startswith("VmRSS:"):
+                    usage["rss"] = int(line.split()[1]) / 1024.0
+                elif line.startswith("Threads:"):
+                    usage["threads"] = int(line.split()[1])
+        usage["fds"] = len(os.listdir("/proc/%i/fd" % (pid,)))
+
+        # User and system time, the fields after the process name (which may contain spaces)
+        with open("/proc/%i/stat" % (pid,)) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        usage["cpu"] = (int(fields[11]) + int(fields[12])) / float(os.sysconf("SC_CLK_TCK"))
+        return usage
+    except (OSError, ValueError):
+        return None
+
+
+class ResourceMonitor(object):
+    """! The 'ResourceMonitor' samples the memory, open file descriptors and threads
+         of each registered process, the depth of each registered queue and the rate
+         items are processed with. The samples are written to a CSV file.
+
+         The mean of the first samples after the warm up is the baseline, the mean
+         of the latest samples is compared to it. Growing memory, file descriptors,
+         threads or queues and a dropping processing rate beyond the tolerances
+         are reported as drift.
+    """
+
+    def __init__(self, interval, warmup, window, tolerances, result_file=None):
+        """! Initializes the 'ResourceMonitor'
+        @param interval     The interval in seconds between two samples
+        @param warmup       Time in seconds after the start that is excluded from the baseline
+        @param window       Amount of samples averaged for the baseline and the current values
+        @param tolerances   dict with the tolerated drift of "rss" (MB), "fds", "threads", "queue" and "fps" (relative drop)
+        @param result_file  CSV file to write the samples to, optional
+        """
+        super(ResourceMonitor, self).__init__()
+        self._interval = interval
+        self._warmup = warmup
+        self._window = window
+        self._tolerances = tolerances
+        self._resultFile = result_file
+        self._processes = []
+        self._queues = []
+        self._start = None
+        self._nextSample = None
+        self._lastCounts = {}
+        self._lastCpu = {}
+        self._lastSample = None
+        self._columns = None
+        self._samples = []
+        self._reported = set()
+        self._stopped = set()
+
+    def addProcess(self, name, process=None):
+        """! Registers a process to monitor
+        @param name     The name of the process in the samples
+        @param process  The 'BeeProcess', None to monitor the calling process
+        """
+        self._processes.append((name, process))
+
+    def addQueue(self, name, q):
+        """! Registers a queue to monitor its depth
+        @param name     The name of the queue in the samples
+        @param q        The queue, None is ignored
+        """
+        if q is not None:
+            self._queues.append((name, q))
+
+    def update(self):
+        """! Takes a sample if the interval elapsed, call it regularly
+        @return True if a sample was taken
+        """
+        now = time.time()
+        if self._start is None:
+            self._start = now
+            self._nextSample = now
+            self._lastSample = now
+        if now < self._nextSample:
+            return False
+        self._nextSample += self._interval
+        self.sample()
+        return True
+
+    def sample(self):
+        """! Takes a sample of all processes and queues and checks it for drift
+        """
+        now = time.time()
+        elapsed = now - self._lastSample
+        self._lastSample = now
+
+        sample = {"time": round(now - self._start, 1)}
+        for name, process in self._processes:
+            pid = os.getpid() if process is None else process.getPid()
+            usage = read_process_usage(pid) if pid is not None else None
+            if usage is None:
+                if pid is not None:
+                    self._stopped.add(name)
+                continue
+            sample["%s_rss" % (name,)] = round(usage["rss"], 2)
+            sample["%s_fds" % (name,)] = usage["fds"]
+            sample["%s_threads" % (name,)] = usage["threads"]
+
+            # CPU usage since the last sample in percent of one core, restarts start over
+            last = self._lastCpu.get(name, usage["cpu"])
+            self._lastCpu[name] = usage["cpu"]
+            if elapsed > 0 and usage["cpu"] >= last:
+                sample["%s_cpu" % (name,)] = round((usage["cpu"] - last) / elapsed * 100.0, 1)
+
+            # Rate of the processed items since the last sample
+            if process is not None:
+                count = process.getProcessedCount()
+                last = self._lastCounts.get(name, count)
+                self._lastCounts[name] = count
+                sample["%s_fps" % (name,)] = round((count - last) / elapsed, 2) if elapsed > 0 else 0
+
+        for name, q in self._queues:
+            try:
+                sample["%s_queue" % (name,)] = q.qsize()
+            except NotImplementedError:
+                pass
+
+        self._samples.append(sample)
+        self._write(sample)
+
+        # Warn once for each value that drifted
+        for message in self.checkDrift():
+            key = message.split(":")[0]
+            if key not in self._reported:
+                self._reported.add(key)
+                logger.warning("Soak test drift, %s" % (message,))
+
+    def _write(self, sample):
+        """! Appends the sample to the result file, the columns are taken from the first sample
+        """
+        if self._resultFile is None:
+            return
+        if self._columns is None:
+            self._columns = list(sample.keys())
+            with open(self._resultFile, "w", newline="") as f:
+                csv.writer(f).writerow(self._columns)
+        with open(self._resultFile, "a", newline="") as f:
+            csv.writer(f).writerow([sample.get(c, "") for c in self._columns])
+
+    def getDrift(self):
+        """! Compares the current values to the baseline
+        @return dict mapping each value to a tuple (baseline, current),
+                empty as long as there are not enough samples after the warm up
+        """
+        samples = [s for s in self._samples if s["time"] >= self._warmup]
+        if len(samples) < 2 * self._window:
+            return {}
+
+        drift = {}
+        baseline = samples[0:self._window]
+        current = samples[-self._window:]
+        for key in samples[0].keys():
+            if key == "time":
+                continue
+            b = [s[key] for s in baseline if key in s]
+            c = [s[key] for s in current if key in s]
+            if len(b) and len(c):
+                drift[key] = (float(np.mean(b)), float(np.mean(c)))
+        return drift
+
+    def checkDrift(self):
+        """! Checks the current values against the tolerances
+        @return A list of messages, one for each value that drifted beyond its tolerance
+        """
+        messages = ["%s: process stopped" % (name,) for name in sorted(self._stopped)]
+        for key, (baseline, current) in self.getDrift().items():
+            kind = key.rsplit("_", 1)[1]
+            tolerance = self._tolerances.get(kind)
+            if tolerance is None:
+                continue
+            if kind == "fps":
+                if baseline > 0 and (baseline - current) / baseline > tolerance:
+                    messages.append("%s: %0.2f -> %0.2f FPS (-%0.1f%%)" % \
+                            (key, baseline, current, (baseline - current) / baseline * 100.0))
+            elif current - baseline > tolerance:
+                messages.append("%s: %0.2f -> %0.2f (+%0.2f)" % (key, baseline, current, current - baseline))
+        return messages
+
+    def report(self):
+        """! Logs the baseline and current values and the drift
+        @return A list of messages, one for each value that drifted beyond its tolerance
+        """
+        drift = self.getDrift()
+        if not len(drift):
+            logger.warning("Soak test too short to compare, %i samples taken (%i required after %is warm up)" % \
+                    (len(self._samples), 2 * self._window, self._warmup))
+            return []
+
+        logger.info("Soak test results after %0.1f hours (baseline -> current):" % (self._samples[-1]["time"] / 3600.0,))
+        for key, (baseline, current) in drift.items():
+            logger.info("  %-24s %10.2f -> %10.2f" % (key, baseline, current))
+
+        messages = self.checkDrift()
+        for message in messages:
+            logger.error("Drift beyond tolerance, %s" % (message,))
+        if not len(messages):
+            logger.info("No drift beyond the tolerances")
+        return messages
@@ -2,50 +2,61 @@
 #
 # @brief Keep track of detected bee characteristics from collections import deque
 
+import multiprocessing
+
+## Indices of the counters of the 'Statistics'
+_BEES_IN, _BEES_OUT, _BEES_IN_OVERALL, _BEES_OUT_OVERALL, _VARROA, _VARROA_OVERALL, _FRAMES, _FRAMES_OVERALL = range(8)
+
+
 class Statistics(object):
     """! The 'Statistics' class keeps track of all the monitoring results.
+         The counters are kept in shared memory, processes forked after the
+         statistics were created share them (e.g. after a restart of a process).
     """
 
     def __init__(self):
         """! Initializes the statistics object
         """
-        self._beesIn = 0
-        self._beesOut = 0
-        self._beesInOverall = 0
-        self._beesOutOverall = 0
-        self._varroaCount = 0
-        self._varroaCountOverall = 0
-        self._processedFames = 0
-        self._processedFamesOverlall = 0
+        self._values = multiprocessing.Array('L', 8)
+
+    def _add(self, *counters):
+        """! Increases the given counters by one
+        """
+        with self._values.get_lock():
+            for counter in counters:
+                self._values[counter] += 1
+
+    def _read(self, *counters):
+        """! Returns the values of the given counters as tuple
+        """
+        with self._values.get_lock():
+            return tuple(self._values[counter] for counter in counters)
 
     def frameProcessed(self):
         """! Increases the frame processed counter
         """
-        self._processedFames += 1
-        self._processedFamesOverlall += 1
+        self._add(_FRAMES, _FRAMES_OVERALL)
 
     def addBeeIn(self):
         """! Increases the bee-in counter
         """
-        self._beesIn += 1
-        self._beesInOverall += 1
+        self._add(_BEES_IN, _BEES_IN_OVERALL)
 
     def addBeeOut(self):
         """! Increases the bee-out counter
         """
-        self._beesOut +=1
-        self._beesOutOverall +=1
+        self._add(_BEES_OUT, _BEES_OUT_OVERALL)
 
     def getBeeCountOverall(self):
         """! Returns the overal counted bees (bees_in, bees_out)
         @return tuple (bees_in, bees_out)
         """
-        return (self._beesInOverall, self._beesOutOverall)
+        return self._read(_BEES_IN_OVERALL, _BEES_OUT_OVERALL)
 
     def getBeeCount(self):
         """! Returns the counted bees (bees_in, bees_out)
         """
-        return (self._beesIn, self._beesOut)
+        return self._read(_BEES_IN, _BEES_OUT)
 
     def addDetection(self, tag):
         """! Adds a detected bee characteristic by tag
@@ -53,8 +64,7 @@ class Statistics(object):
         """
 
         if "varroa" == tag:
-            self._varroaCount += 1
-            self._varroaCountOverall += 1
+            self._add(_VARROA, _VARROA_OVERALL)
 
     def addClassificationResult(self, trackId, result):
         """! Adds a detected bee by classification results
@@ -75,27 +85,31 @@ class Statistics(object):
         """! Return the current statistics for counted varroa, bees in, bees out and the amount of processed frames
              @return tuple
         """
-        return (self._varroaCount,
-                self._beesIn,
-                self._beesOut,
-                self._processedFames)
+        return self._read(_VARROA, _BEES_IN, _BEES_OUT, _FRAMES)
 
     def readOverallStatistics(self):
         """! Return the overall statistics for counted varroa, bees in, bees out and the amount of processed frames
              @return tuple
         """
-        return (self._varroaCountOverall,
-                self._beesInOverall,
-                self._beesOutOverall,
-                self._processedFamesOverall)
+        return self._read(_VARROA_OVERALL, _BEES_IN_OVERALL, _BEES_OUT_OVERALL, _FRAMES_OVERALL)
+
+    def takeStatistics(self):
+        """! Returns the current statistics like 'readStatistics' and resets them at once,
+             so no counts get lost in between
+             @return tuple
+        """
+        with self._values.get_lock():
+            result = tuple(self._values[counter] for counter in (_VARROA, _BEES_IN, _BEES_OUT, _FRAMES))
+            for counter in (_VARROA, _BEES_IN, _BEES_OUT, _FRAMES):
+                self._values[counter] = 0
+        return result
 
     def resetStatistics(self):
         """! Resets the current statistics
         """
-        self._varroaCount = 0
-        self._beesIn = 0
-        self._beesOut = 0
-        self._processedFames = 0
+        with self._values.get_lock():
+            for counter in (_VARROA, _BEES_IN, _BEES_OUT, _FRAMES):
+                self._values[counter] = 0
 
 
 __dh = None
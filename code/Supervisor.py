@@ -0,0 +1,274 @@
+##
+# @file Supervisor.py
+#
+# @brief Brings up the processes of the pipeline and restarts crashed ones.
+
+import multiprocessing
+import time
+import logging
+from ResourceMonitor import read_process_usage
+
+logger = logging.getLogger(__name__)
+
+
+class SupervisedProcess(object):
+    """! The state of a process watched by the 'Supervisor'
+    """
+
+    def __init__(self, name, process, required, restart, background):
+        """! Initializes the state
+        @param name         The name used in the log
+        @param process      The 'BeeProcess'
+        @param required     Whether the pipeline ends when the process finished
+        @param restart      Whether the process is restarted after a crash
+        @param background   Whether the pipeline starts without waiting for the process
+        """
+        super(SupervisedProcess, self).__init__()
+        self.name = name
+        self.process = process
+        self.required = required
+        self.restart = restart
+        self.background = background
+        self.ready = False
+        self.disabled = False
+        self.first_t = None
+        self.crashes = 0
+        self.restarts = 0
+        self.started_t = None
+        self.restart_t = None
+        self.cpu_t = 0
+
+
+class Supervisor(object):
+    """! The 'Supervisor' starts the 'BeeProcess'es of the pipeline and watches them.
+
+         All processes are started at once and initialize in parallel, e.g. the neural
+         network loads while the video input is opened. Each process reports when it is
+         ready and then waits until all processes are, so the pipeline starts working
+         as a whole. Background processes (e.g. the neural network) don't delay the
+         start, the others queue their work until they are ready. A background process
+         that ends or times out before it is ready is disabled, the others keep working.
+
+         A process that crashed (it ended without finishing its run, e.g. by an
+         exception or a signal) is restarted with the same queues and counters. The
+         delay before a restart doubles with each crash in a row and is reset once
+         the process ran for the maximum delay. Queues the process left broken are
+         replaced first, the other processes using them are restarted along with it.
+
+         The time until each process got ready and processed its first item (e.g. the
+         first frame or classification) is logged, as well as the CPU usage and the
+         threads of each process, e.g. to tune the CPUs and thread limits of the stages.
+    """
+
+    def __init__(self, delay_min=1.0, delay_max=60.0, max_restarts=0, report_interval=0, repair=None,
+            stop_timeout=1.0):
+        """! Initializes the supervisor
+        @param delay_min        The delay in seconds before restarting a process after its first crash
+        @param delay_max        The maximum delay in seconds before restarting a process
+        @param max_restarts     The maximum amount of restarts of a process (0 = unlimited)
+        @param report_interval  The interval in seconds the CPU usage is logged (0 = disabled)
+        @param repair           Called with a process that ended before it is restarted, returns the
+                                processes to restart along with it, see 'Pipeline.repairQueues'
+        @param stop_timeout     The maximum time in seconds to wait for a process to stop, when it is
+                                restarted along with a crashed one
+        """
+        super(Supervisor, self).__init__()
+        self._delayMin = delay_min
+        self._delayMax = delay_max
+        self._maxRestarts = max_restarts
+        self._reportInterval = report_interval
+        self._repair = repair
+        self._stopTimeout = stop_timeout
+        self._report_t = None
+        self._start_t = None
+        self._readyTimeout = None
+        self._processes = []
+        self._startEvent = multiprocessing.Event()
+
+    def add(self, name, process, required=False, restart=True, background=False):
+        """! Adds a process, it's started by 'start'
+        @param name         The name used in the log
+        @param process      The 'BeeProcess'
+        @param required     Whether the pipeline ends when the process finished, e.g. at the end of the video
+        @param restart      Whether the process is restarted after a crash, otherwise the pipeline ends
+        @param background   Whether the pipeline starts without waiting for the process to get ready
+        """
+        process.setStartEvent(self._startEvent)
+        self._processes.append(SupervisedProcess(name, process, required, restart, background))
+
+    def start(self, timeout):
+        """! Starts all processes and waits until they are ready, except for the background processes
+        @param timeout  The maximum time in seconds to wait for the processes
+        @return True if the processes are ready and started working
+        """
+        start_t = time.time()
+        self._start_t = start_t
+        self._readyTimeout = timeout
+        for item in self._processes:
+            item.process.start()
+            item.started_t = start_t
+
+        last_log_t = start_t
+        while True:
+            waiting = [item for item in self._processes if not item.background and not item.process.isReady()]
+            if not len(waiting):
+                break
+
+            # A process that ended before it got ready won't get ready anymore
+            for item in waiting:
+                if not item.process.isRunning():
+                    logger.error("Process '%s' ended before it was ready (exit code %s)" % \
+                            (item.name, item.process.getExitCode()))
+                    return False
+
+            now = time.time()
+            if now - start_t > timeout:
+                logger.error("Processes not ready after %is: %s" % (timeout, ", ".join(item.name for item in waiting)))
+                return False
+            if now - last_log_t > 10:
+                logger.info("Waiting for %s to get ready" % (", ".join(item.name for item in waiting),))
+                last_log_t = now
+            waiting[0].process.waitReady(0.1)
+
+        # Let all processes start working
+        self._report_t = time.time()
+        self._startEvent.set()
+        logger.info("Processes ready after %0.1fs" % (time.time() - start_t,))
+        return True
+
+    def _checkStartup(self, item, now):
+        """! Logs the startup milestones of a process and checks that it gets ready in time
+        @return False if the process didn't get ready, background processes get disabled instead
+        """
+        process = item.process
+        if not item.ready:
+            error = None
+            if process.isReady():
+                item.ready = True
+                if item.background:
+                    logger.info("Startup: '%s' ready after %0.1fs" % (item.name, now - self._start_t))
+            elif not process.isRunning() and not process.isCrashed():
+                error = "Process '%s' ended before it was ready" % (item.name,)
+            elif now - self._start_t > self._readyTimeout:
+                error = "Process '%s' not ready after %is" % (item.name, self._readyTimeout)
+
+            if error is not None and not item.background:
+                logger.error(error)
+                return False
+
+            # The pipeline keeps working without the background process, e.g. counting
+            # the bees without the neural network. Its queue stays full, the senders
+            # drop the items or keep them in a bounded backlog.
+            if error is not None:
+                logger.error("%s, continuing without it" % (error,))
+                item.disabled = True
+                process.stop(1.0)
+                return True
+
+        if item.first_t is None and process.getProcessedCount() > 0:
+            item.first_t = now
+            logger.info("Startup: '%s' processed its first item after %0.1fs" % (item.name, now - self._start_t))
+        return True
+
+    def check(self):
+        """! Checks the processes and restarts crashed ones once their delay passed, call it regularly
+        @return False if the pipeline has to end, because a required process finished
+                or a crashed process can't be restarted
+        """
+        now = time.time()
+        for item in self._processes:
+            process = item.process
+            if item.disabled:
+                continue
+            if not self._checkStartup(item, now):
+                return False
+            if item.disabled:
+                continue
+
+            # A process that runs long enough without crashing starts with the minimum delay again
+            if process.isRunning():
+                if item.crashes and now - item.started_t > self._delayMax:
+                    item.crashes = 0
+                continue
+
+            if not process.isCrashed():
+                if item.required:
+                    logger.info("Process '%s' finished" % (item.name,))
+                    return False
+                continue
+
+            # Schedule the restart of a crashed process
+            if item.restart_t is None:
+                item.crashes += 1
+                if not item.restart or (self._maxRestarts and item.restarts >= self._maxRestarts):
+                    logger.error("Process '%s' crashed (exit code %s) after %i restarts" % \
+                            (item.name, process.getExitCode(), item.restarts))
+                    return False
+                delay = min(self._delayMin * 2 ** (item.crashes - 1), self._delayMax)
+                item.restart_t = now + delay
+                logger.error("Process '%s' crashed (exit code %s), restarting it in %0.1fs" % \
+                        (item.name, process.getExitCode(), delay))
+
+            elif now >= item.restart_t:
+                self._restart(item, now)
+
+        if self._reportInterval and self._report_t is not None and now - self._report_t >= self._reportInterval:
+            self.report(now - self._report_t)
+            self._report_t = now
+        return True
+
+    def _restart(self, item, now):
+        """! Restarts a crashed process, after replacing the queues it left broken. The
+             other processes using them are stopped and restarted as well, which may
+             leave further queues broken.
+        """
+        pending = [item]
+        while len(pending):
+            current = pending.pop(0)
+            if current.process.isRunning():
+                current.process.stop(self._stopTimeout)
+            if self._repair is not None:
+                for peer in self._repair(current.process):
+                    for other in self._processes:
+                        if other.process is peer and not other.disabled and other not in pending:
+                            logger.warning("Restarting '%s' along with '%s'" % (other.name, current.name))
+                            pending.append(other)
+
+            current.restarts += 1
+            current.restart_t = None
+            current.started_t = now
+            current.process.restart()
+            current.cpu_t = 0
+            logger.info("Process '%s' restarted (%i restarts)" % (current.name, current.restarts))
+
+    def report(self, elapsed):
+        """! Logs the CPU usage since the last report, in percent of one core, and the threads of each process
+        @param elapsed  The time in seconds since the last report
+        """
+        entries = []
+        for item in self._processes:
+            pid = item.process.getPid()
+            usage = read_process_usage(pid) if pid is not None and item.process.isRunning() else None
+            if usage is None:
+                continue
+            if usage["cpu"] >= item.cpu_t:
+                entries.append("%s %0.1f%% (%i threads)" % (item.name, (usage["cpu"] - item.cpu_t) / elapsed * 100.0,
+                        usage["threads"]))
+            item.cpu_t = usage["cpu"]
+        if len(entries):
+            logger.info("CPU usage: %s" % (", ".join(entries),))
+
+    def getRestartCounts(self):
+        """! Returns the amount of restarts of each process
+        @return dict with the process names as keys
+        """
+        return dict((item.name, item.restarts) for item in self._processes)
+
+    def stop(self, timeout):
+        """! Stops all processes, processes that don't stop in time get terminated
+        @param timeout  The maximum time in seconds to wait for each process
+        """
+        for item in self._processes:
+            item.process.requestStop()
+        for item in self._processes:
+            item.process.stop(timeout)
@@ -15,104 +15,82 @@ from tensorflow.keras.layers import Input
 from tensorflow.keras.optimizers.legacy import Adam
 
 CHAN_DIM = -1
-def build_varroa_branch(input_shape):
-    """! Creates the branch that detects varroa mite infections
+
+## Convolution blocks of each branch as (filters, kernel size, batch normalization)
+VARROA_BLOCKS = ((64, 4, True), (32, 3, False), (16, 3, False))
+POLLEN_BLOCKS = ((32, 4, True), (16, 3, False))
+WASPS_BLOCKS = ((16, 4, True), (8, 3, False))
+COOLING_BLOCKS = ((64, 2, True), (32, 3, False), (16, 2, False))
+
+## Model variants as (width, depth), see 'get_bee_model'. The smaller variants trade
+#  accuracy for throughput, 'BenchVariants.py' measures both.
+VARIANTS = {
+    "full": (1.0, 1.0),
+    "w075": (0.75, 1.0),
+    "w050": (0.5, 1.0),
+    "w050_shallow": (0.5, 0.67),
+    "w025": (0.25, 1.0),
+    "w025_shallow": (0.25, 0.67),
+}
+
+def build_branch(input_shape, blocks, name, width=1.0, depth=1.0):
+    """! Creates a branch of convolution blocks with a single sigmoid output
+    @param input_shape  The input layer
+    @param blocks       The convolution blocks, see VARROA_BLOCKS
+    @param name         The name of the output layer
+    @param width        Factor applied to the amount of filters of each block
+    @param depth        Fraction of the blocks to use, at least one block is used
     """
+    count = max(1, int(round(len(blocks) * depth)))
     tmp_layer= layers.experimental.preprocessing.Rescaling(1./255)(input_shape)
-    tmp_layer= Conv2D(64, (4, 4), padding="valid")(tmp_layer)
-    tmp_layer= Activation("relu")(tmp_layer)
-    tmp_layer= BatchNormalization(axis=CHAN_DIM)(tmp_layer)
-    tmp_layer= MaxPooling2D(pool_size=(2, 2))(tmp_layer)
-
-    tmp_layer= Conv2D(32, (3, 3), padding="valid")(tmp_layer)
-    tmp_layer= Activation("relu")(tmp_layer)
-    tmp_layer= MaxPooling2D(pool_size=(2, 2))(tmp_layer)
-
-    tmp_layer= Conv2D(16, (3, 3), padding="valid")(tmp_layer)
-    tmp_layer= Activation("relu")(tmp_layer)
-    tmp_layer= MaxPooling2D(pool_size=(2, 2))(tmp_layer)
+    for filters, kernel, batch_norm in blocks[0:count]:
+        tmp_layer= Conv2D(max(4, int(round(filters * width))), (kernel, kernel), padding="valid")(tmp_layer)
+        tmp_layer= Activation("relu")(tmp_layer)
+        if batch_norm:
+            tmp_layer= BatchNormalization(axis=CHAN_DIM)(tmp_layer)
+        tmp_layer= MaxPooling2D(pool_size=(2, 2))(tmp_layer)
 
     tmp_layer= Flatten()(tmp_layer)
     tmp_layer= BatchNormalization(axis=CHAN_DIM)(tmp_layer)
     tmp_layer= Dense(1)(tmp_layer)
-    tmp_layer= Activation("sigmoid", name="varroa_output")(tmp_layer)
+    tmp_layer= Activation("sigmoid", name=name, dtype="float32")(tmp_layer)
 
     return tmp_layer
 
-def build_pollen_branch(input_shape):
-    """! Creates the branch that detects pollen packets
+def build_varroa_branch(input_shape, width=1.0, depth=1.0):
+    """! Creates the branch that detects varroa mite infections
     """
-    tmp_layer= layers.experimental.preprocessing.Rescaling(1./255)(input_shape)
-    tmp_layer= Conv2D(32, (4, 4), padding="valid")(tmp_layer)
-    tmp_layer= Activation("relu")(tmp_layer)
-    tmp_layer= BatchNormalization(axis=CHAN_DIM)(tmp_layer)
-    tmp_layer= MaxPooling2D(pool_size=(2, 2))(tmp_layer)
-
-    tmp_layer= Conv2D(16, (3, 3), padding="valid")(tmp_layer)
-    tmp_layer= Activation("relu")(tmp_layer)
-    tmp_layer= MaxPooling2D(pool_size=(2, 2))(tmp_layer)
+    return build_branch(input_shape, VARROA_BLOCKS, "varroa_output", width, depth)
 
-    tmp_layer= Flatten()(tmp_layer)
-    tmp_layer= BatchNormalization(axis=CHAN_DIM)(tmp_layer)
-    tmp_layer= Dense(1)(tmp_layer)
-    tmp_layer= Activation("sigmoid", name="pollen_output")(tmp_layer)
-
-    return tmp_layer
+def build_pollen_branch(input_shape, width=1.0, depth=1.0):
+    """! Creates the branch that detects pollen packets
+    """
+    return build_branch(input_shape, POLLEN_BLOCKS, "pollen_output", width, depth)
 
-def build_wasps_branch(input_shape):
+def build_wasps_branch(input_shape, width=1.0, depth=1.0):
     """! Creates the branch that detects wasps
     """
-    tmp_layer= layers.experimental.preprocessing.Rescaling(1./255)(input_shape)
-    tmp_layer= Conv2D(16, (4, 4), padding="valid")(tmp_layer)
-    tmp_layer= Activation("relu")(tmp_layer)
-    tmp_layer= BatchNormalization(axis=CHAN_DIM)(tmp_layer)
-    tmp_layer= MaxPooling2D(pool_size=(2, 2))(tmp_layer)
+    return build_branch(input_shape, WASPS_BLOCKS, "wasps_output", width, depth)
 
-    tmp_layer= Conv2D(8, (3, 3), padding="valid")(tmp_layer)
-    tmp_layer= Activation("relu")(tmp_layer)
-    tmp_layer= MaxPooling2D(pool_size=(2, 2))(tmp_layer)
-
-    tmp_layer= Flatten()(tmp_layer)
-    tmp_layer= BatchNormalization()(tmp_layer)
-    tmp_layer= Dense(1)(tmp_layer)
-    tmp_layer= Activation("sigmoid", name="wasps_output")(tmp_layer)
-
-    return tmp_layer
-
-def build_cooling_branch(input_shape):
+def build_cooling_branch(input_shape, width=1.0, depth=1.0):
     """! Created the branch that detects bees that are cooling the hive
     """
-    tmp_layer= layers.experimental.preprocessing.Rescaling(1./255)(input_shape)
-    tmp_layer= Conv2D(64, (2, 2), padding="valid")(tmp_layer)
-    tmp_layer= Activation("relu")(tmp_layer)
-    tmp_layer= BatchNormalization(axis=CHAN_DIM)(tmp_layer)
-    tmp_layer= MaxPooling2D(pool_size=(2, 2))(tmp_layer)
-
-    tmp_layer= Conv2D(32, (3, 3), padding="valid")(tmp_layer)
-    tmp_layer= Activation("relu")(tmp_layer)
-    tmp_layer= MaxPooling2D(pool_size=(2, 2))(tmp_layer)
+    return build_branch(input_shape, COOLING_BLOCKS, "cooling_output", width, depth)
 
-    tmp_layer= Conv2D(16, (2, 2), padding="valid")(tmp_layer)
-    tmp_layer= Activation("relu")(tmp_layer)
-    tmp_layer= MaxPooling2D(pool_size=(2, 2))(tmp_layer)
-
-    tmp_layer= Flatten()(tmp_layer)
-    tmp_layer= BatchNormalization(axis=CHAN_DIM)(tmp_layer)
-    tmp_layer= Dense(1)(tmp_layer)
-    tmp_layer= Activation("sigmoid", name="cooling_output")(tmp_layer)
-
-    return tmp_layer
-
-def get_bee_model(img_height, img_width):
+def get_bee_model(img_height, img_width, width=1.0, depth=1.0):
     """! Creates BeeModel and returns it
+    @param img_height   The height of the input images
+    @param img_width    The width of the input images
+    @param width        Factor applied to the amount of filters of all branches
+    @param depth        Fraction of the convolution blocks used by each branch
     """
     input_shape = (img_height, img_width, 3)
     inputs = Input(shape=input_shape, name="input")
 
-    pollen_m = build_pollen_branch(inputs)
-    varroa_m = build_varroa_branch(inputs)
-    wasps_m = build_wasps_branch(inputs)
-    cooling_m = build_cooling_branch(inputs)
+    pollen_m = build_pollen_branch(inputs, width, depth)
+    varroa_m = build_varroa_branch(inputs, width, depth)
+    wasps_m = build_wasps_branch(inputs, width, depth)
+    cooling_m = build_cooling_branch(inputs, width, depth)
 
     model = Model(
         inputs=inputs,
@@ -142,3 +120,11 @@ def get_bee_model(img_height, img_width):
          )
 
     return model
+
+def get_bee_model_variant(img_height, img_width, variant):
+    """! Creates the BeeModel of the given variant, see VARIANTS
+    """
+    if variant not in VARIANTS:
+        raise BaseException("Unknown model variant '%s', expected one of %s" % (variant, ", ".join(VARIANTS.keys())))
+    width, depth = VARIANTS[variant]
+    return get_bee_model(img_height, img_width, width, depth)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# @file BenchVariants.py
+#
+# @brief Measures the inference throughput, memory and validation accuracy of model variants
+#        to pick the most accurate one that meets a per-image latency budget.
+#
+#        Usage: python3 BenchVariants.py --models ../SavedModel SavedModel_w050 [--dataset <folder>] [--budget-ms 5]
+#
+#        Without trained models, '--variants' measures untrained variants (no accuracy).
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+import BeeModel
+
+IMG_HEIGHT = 150
+IMG_WIDTH = 75
+
+
+def get_args():
+    """! Prepares and parses the command arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="*", default=[], help="Folders of trained models")
+    parser.add_argument("--variants", nargs="*", default=[], help="Untrained variants, see 'BeeModel.VARIANTS'")
+    parser.add_argument("--dataset", help="Folder of labelled bee images to measure the accuracy, see 'LocalDataset'")
+    parser.add_argument("--cache", help="Folder of the cached images (default: <dataset>/.cache)")
+    parser.add_argument("--validation-split", type=float, default=0.2, help="Fraction of the images used for validation")
+    parser.add_argument("--batch-size", type=int, default=5, help="Images per batch, the classification process uses up to 5")
+    parser.add_argument("--repeat", type=int, default=50, help="Amount of measured batches")
+    parser.add_argument("--threads", type=int, help="Amount of threads used by TensorFlow, e.g. the cores of the edge box")
+    parser.add_argument("--budget-ms", type=float, help="Latency budget per image in ms")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    return parser.parse_args()
+
+
+def read_rss():
+    """! Returns the resident memory of the current process in MB
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def measure_speed(model, batch_size, repeat):
+    """! Measures the inference on random images
+    @return dict with images per second and the latency per batch and per image in ms
+    """
+    rng = np.random.default_rng(0)
+    batch = tf.convert_to_tensor(rng.uniform(0, 255, (batch_size, IMG_HEIGHT, IMG_WIDTH, 3)).astype(np.float32))
+    single = batch[0:1]
+
+    # The first calls build the graph and are not measured
+    model.predict_on_batch(batch)
+    model.predict_on_batch(single)
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict_on_batch(batch)
+        durations.append(time.perf_counter() - start)
+    singles = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict_on_batch(single)
+        singles.append(time.perf_counter() - start)
+
+    d = np.array(durations) * 1000.0
+    return {"images_per_second": round(batch_size * 1000.0 / d.mean(), 1),
+            "batch_ms_p50": round(float(np.percentile(d, 50)), 3),
+            "batch_ms_p95": round(float(np.percentile(d, 95)), 3),
+            "image_ms": round(float(d.mean()) / batch_size, 3),
+            "single_ms_p50": round(float(np.percentile(np.array(singles) * 1000.0, 50)), 3)}
+
+
+def measure_accuracy(model, dataset):
+    """! Measures the accuracy of each output on the validation images (threshold 0.5)
+    @return dict with the accuracy of each label and their mean
+    """
+    import LocalDataset
+    correct = np.zeros(len(LocalDataset.LABELS))
+    count = 0
+    for images, labels in dataset:
+        outputs = model.predict_on_batch(images)
+        for num, lbl in enumerate(LocalDataset.LABELS):
+            truth = labels["%s_output" % (lbl,)].numpy().reshape(-1) > 0.5
+            correct[num] += np.sum((np.array(outputs[num]).reshape(-1) > 0.5) == truth)
+        count += len(images)
+    result = {lbl: round(float(correct[num] / count), 4) for num, lbl in enumerate(LocalDataset.LABELS)} if count else {}
+    if count:
+        result["mean"] = round(float(np.mean(correct / count)), 4)
+    return result
+
+
+def main():
+    args = get_args()
+    if args.threads:
+        tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+        tf.config.threading.set_inter_op_parallelism_threads(args.threads)
+
+    validation = None
+    if args.dataset:
+        import LocalDataset
+        cache = args.cache or os.path.join(args.dataset, ".cache")
+        LocalDataset.build_cache(args.dataset, cache, IMG_HEIGHT, IMG_WIDTH)
+        _, validation = LocalDataset.load_dataset(cache, 64, args.validation_split)
+
+    candidates = [(m, lambda m=m: tf.keras.models.load_model(m)) for m in args.models]
+    candidates += [(v, lambda v=v: BeeModel.get_bee_model_variant(IMG_HEIGHT, IMG_WIDTH, v)) for v in args.variants]
+    if not len(candidates):
+        candidates = [(v, lambda v=v: BeeModel.get_bee_model_variant(IMG_HEIGHT, IMG_WIDTH, v)) for v in BeeModel.VARIANTS]
+
+    results = []
+    for name, create in candidates:
+        rss = read_rss()
+        model = create()
+        result = {"model": name,
+                  "parameters": int(model.count_params()),
+                  "weights_mb": round(sum(w.nbytes for w in model.get_weights()) / 1024.0 / 1024.0, 3)}
+        result.update(measure_speed(model, args.batch_size, args.repeat))
+        result["rss_mb"] = round(read_rss() - rss, 1)
+        if validation is not None and name in args.models:
+            result["accuracy"] = measure_accuracy(model, validation)
+        results.append(result)
+        print("%-24s %9i params, %7.1f img/s, %7.3f ms/img (single %7.3f ms), +%6.1f MB, accuracy %s" % \
+                (name, result["parameters"], result["images_per_second"], result["image_ms"],
+                 result["single_ms_p50"], result["rss_mb"], result.get("accuracy", {}).get("mean", "-")))
+        del model
+        tf.keras.backend.clear_session()
+
+    # Pick the most accurate model (or the largest, without accuracy) within the budget
+    if args.budget_ms:
+        within = [r for r in results if r["image_ms"] <= args.budget_ms]
+        if not len(within):
+            print("No model meets the budget of %0.3f ms per image" % (args.budget_ms,))
+        else:
+            best = max(within, key=lambda r: (r.get("accuracy", {}).get("mean", 0), r["parameters"]))
+            print("Best model within %0.3f ms per image: %s" % (args.budget_ms, best["model"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"batch_size": args.batch_size, "threads": args.threads, "results": results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# @file LocalDataset.py
+#
+# @brief Training input pipeline for local folders of labelled bee images, e.g. the images
+#        extracted with SAVE_EXTRACTED_IMAGES after sorting them into folders by hand.
+#
+#        The images are expected in one sub-folder per combination of labels, the name
+#        joins the labels by '+', e.g. 'varroa', 'pollen', 'varroa+pollen' or 'none'
+#        for healthy bees. The folders written by SAVE_DETECTION_IMAGES can be used as is.
+#
+#        The images are decoded once in parallel, resized to the input size of the
+#        network and cached as uncompressed shards that are memory mapped while
+#        training, so an epoch does not decode a single JPEG.
+
+import os
+import json
+import hashlib
+import multiprocessing
+import cv2
+import numpy as np
+import tensorflow as tf
+
+## The labels in the order of the model outputs, see 'BeeModel.get_bee_model'
+LABELS = ("varroa", "pollen", "wasps", "cooling")
+
+## Image file extensions read from the dataset folder
+IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png")
+
+
+def list_images(folder):
+    """! Lists the images of a dataset folder and their labels
+    @param folder   The dataset folder, containing one sub-folder per combination of labels
+    @return tuple (paths, labels), labels is an array with one row of 0/1 values per image
+    """
+    paths = []
+    labels = []
+    for name in sorted(os.listdir(folder)):
+        sub = os.path.join(folder, name)
+        if not os.path.isdir(sub):
+            continue
+        tags = set(name.split("+")) - set(["none"])
+        unknown = tags - set(LABELS)
+        if len(unknown):
+            raise BaseException("Unknown label(s) %s of folder '%s', expected %s or 'none'" % (sorted(unknown), sub, LABELS))
+        row = [1 if lbl in tags else 0 for lbl in LABELS]
+        for f in sorted(os.listdir(sub)):
+            if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(sub, f))
+                labels.append(row)
+    return paths, np.array(labels, dtype=np.uint8).reshape(-1, len(LABELS))
+
+
+def fingerprint(paths, img_height, img_width):
+    """! Returns a key that changes whenever images are added, removed or modified
+    """
+    h = hashlib.sha1(("%i %i" % (img_height, img_width)).encode())
+    for p in paths:
+        stat = os.stat(p)
+        h.update(("%s %i %i\n" % (p, stat.st_size, stat.st_mtime_ns)).encode())
+    return h.hexdigest()
+
+
+def _decode(task):
+    """! Worker: decodes an image and resizes it to the input size of the network
+    @return The RGB image as uint8 array or None if it can't be read
+    """
+    path, img_height, img_width = task
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    if img.shape[0:2] != (img_height, img_width):
+        img = cv2.resize(img, (img_width, img_height), interpolation=cv2.INTER_LINEAR)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def build_cache(folder, cache_folder, img_height, img_width, shard_size=10000, workers=None, seed=0):
+    """! Decodes the images of a dataset folder into cached shards, unless the cache is up to date
+    @param folder       The dataset folder, see 'list_images'
+    @param cache_folder The folder to write the shards to
+    @param img_height   The height of the network input
+    @param img_width    The width of the network input
+    @param shard_size   Amount of images per shard
+    @param workers      Amount of decoding processes, None for one per CPU
+    @param seed         Seed of the order the images are stored in
+    @return The content of the cache meta.json
+    """
+    paths, labels = list_images(folder)
+    if not len(paths):
+        raise BaseException("No images found in '%s'" % (folder,))
+    key = fingerprint(paths, img_height, img_width)
+
+    meta_file = os.path.join(cache_folder, "meta.json")
+    if os.path.isfile(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") == key:
+            return meta
+
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+
+    # Store the images in random order, so each shard is a sample of all labels
+    order = np.random.default_rng(seed).permutation(len(paths))
+    paths = [paths[i] for i in order]
+    labels = labels[order]
+
+    shards = []
+    tasks = ((p, img_height, img_width) for p in paths)
+    with multiprocessing.Pool(workers) as pool:
+        images = pool.imap(_decode, tasks, chunksize=64)
+        for start in range(0, len(paths), shard_size):
+            count = min(shard_size, len(paths) - start)
+            shard = np.lib.format.open_memmap(os.path.join(cache_folder, "images_%05i.npy" % (len(shards),)),
+                    mode="w+", dtype=np.uint8, shape=(count, img_height, img_width, 3))
+            valid = np.ones(count, dtype=bool)
+            for num in range(count):
+                img = next(images)
+                if img is None:
+                    valid[num] = False
+                else:
+                    shard[num] = img
+            shard.flush()
+            del shard
+            np.save(os.path.join(cache_folder, "labels_%05i.npy" % (len(shards),)), labels[start:start + count])
+            np.save(os.path.join(cache_folder, "valid_%05i.npy" % (len(shards),)), valid)
+            shards.append(count)
+
+    meta = {"fingerprint": key, "folder": os.path.abspath(folder), "count": len(paths),
+            "shards": shards, "img_height": img_height, "img_width": img_width, "labels": list(LABELS)}
+    with open(meta_file, "w") as f:
+        json.dump(meta, f, indent=4)
+    return meta
+
+
+class ShardedImages(object):
+    """! Read access to the shards written by 'build_cache'. The images are split
+         into a training and a validation part by a seeded random selection, which
+         is the same each time the cache is opened.
+    """
+
+    def __init__(self, cache_folder, validation_split=0.2, seed=0):
+        """! Opens the cache
+        @param cache_folder     The folder written by 'build_cache'
+        @param validation_split The fraction of the images used for validation
+        @param seed             Seed of the validation selection
+        """
+        super(ShardedImages, self).__init__()
+        with open(os.path.join(cache_folder, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        rng = np.random.default_rng(seed)
+        self._images = []
+        self._labels = []
+        self._indices = {"train": [], "validation": []}
+        for num, count in enumerate(self.meta["shards"]):
+            self._images.append(np.load(os.path.join(cache_folder, "images_%05i.npy" % (num,)), mmap_mode="r"))
+            self._labels.append(np.load(os.path.join(cache_folder, "labels_%05i.npy" % (num,))).astype(np.float32))
+            valid = np.load(os.path.join(cache_folder, "valid_%05i.npy" % (num,)))
+            is_val = rng.random(count) < validation_split
+            self._indices["train"].append(np.flatnonzero(valid & ~is_val))
+            self._indices["validation"].append(np.flatnonzero(valid & is_val))
+
+    def getCount(self, part):
+        """! Returns the amount of images of the 'train' or 'validation' part
+        """
+        return int(sum(len(i) for i in self._indices[part]))
+
+    def batches(self, part, batch_size, shuffle=False, seed=None):
+        """! Yields batches of images and labels
+        @param part         'train' or 'validation'
+        @param batch_size   Amount of images per batch
+        @param shuffle      Whether to shuffle the order of the shards and of the images within each shard
+        @param seed         Seed of the shuffling, None for a different order each time
+        @return Generator of tuples (images, labels), labels is a dict of the model outputs
+        """
+        rng = np.random.default_rng(seed)
+        shards = list(range(len(self._images)))
+        if shuffle:
+            rng.shuffle(shards)
+
+        # Batches may span two shards, the remainder of a shard is carried over
+        rest_images = rest_labels = None
+        for num in shards:
+            indices = self._indices[part][num]
+            if shuffle:
+                indices = rng.permutation(indices)
+            for start in range(0, len(indices), batch_size):
+
+                # Sorted indices read the memory mapped shard sequentially
+                selection = np.sort(indices[start:start + batch_size])
+                images = self._images[num][selection]
+                labels = self._labels[num][selection]
+                if rest_images is not None:
+                    images = np.concatenate([rest_images, images])
+                    labels = np.concatenate([rest_labels, labels])
+                    rest_images = rest_labels = None
+                if len(images) < batch_size:
+                    rest_images, rest_labels = images, labels
+                    continue
+                yield self._toOutputs(images[0:batch_size], labels[0:batch_size])
+                if len(images) > batch_size:
+                    rest_images, rest_labels = images[batch_size:], labels[batch_size:]
+
+        if rest_images is not None and len(rest_images):
+            yield self._toOutputs(rest_images, rest_labels)
+
+    @staticmethod
+    def _toOutputs(images, labels):
+        """! Maps the label columns to the named model outputs
+        """
+        return images, {"%s_output" % (lbl,): labels[:, num:num + 1] for num, lbl in enumerate(LABELS)}
+
+
+def load_dataset(cache_folder, batch_size=64, validation_split=0.2, seed=0):
+    """! Creates the training and validation datasets from the cached shards
+    @param cache_folder     The folder written by 'build_cache'
+    @param batch_size       Amount of images per batch
+    @param validation_split The fraction of the images used for validation
+    @param seed             Seed of the validation selection
+    @return tuple (train, validation) of tf.data.Dataset, the images are float32 (0-255)
+    """
+    data = ShardedImages(cache_folder, validation_split, seed)
+    h, w = data.meta["img_height"], data.meta["img_width"]
+    signature = (tf.TensorSpec(shape=(None, h, w, 3), dtype=tf.uint8),
+                 {"%s_output" % (lbl,): tf.TensorSpec(shape=(None, 1), dtype=tf.float32) for lbl in LABELS})
+
+    def create(part, shuffle):
+        dataset = tf.data.Dataset.from_generator(lambda: data.batches(part, batch_size, shuffle),
+                output_signature=signature)
+
+        # Keep the batches compact until they are used, then prepare the next ones in the background
+        dataset = dataset.map(lambda images, labels: (tf.cast(images, tf.float32), labels),
+                num_parallel_calls=tf.data.AUTOTUNE)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    return (create("train", True), create("validation", False))
@@ -2,27 +2,108 @@
 # @file TrainNetwork.py
 #
 # @brief This file is used to train the BeeModel which is used
+#
+#        Usage: python3 TrainNetwork.py [--dataset <folder>] [--variant w050] [--teacher ../SavedModel]
+#
+#        Without a dataset folder the 'bee_dataset' is downloaded through tensorflow_datasets,
+#        local folders are read with 'LocalDataset'. With a teacher model, the variant is
+#        trained as a distilled student of it, see 'distill'.
 
+import os
+import argparse
+import tensorflow as tf
 import BeeModel
 
 MODEL_SAVE_PATH = "SavedModel"
+IMG_HEIGHT = 150
+IMG_WIDTH = 75
+
+
+def get_args():
+    """! Prepares and parses the command arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", help="Folder of labelled bee images, see 'LocalDataset'")
+    parser.add_argument("--cache", help="Folder to cache the decoded images in (default: <dataset>/.cache)")
+    parser.add_argument("--batch-size", type=int, default=64, help="Amount of images per batch")
+    parser.add_argument("--epochs", type=int, default=20, help="Amount of epochs to train")
+    parser.add_argument("--validation-split", type=float, default=0.2, help="Fraction of the images used for validation")
+    parser.add_argument("--workers", type=int, help="Amount of processes decoding the images (default: one per CPU)")
+    parser.add_argument("--variant", default="full", choices=list(BeeModel.VARIANTS.keys()),
+            help="Width and depth of the model, see 'BeeModel.VARIANTS'")
+    parser.add_argument("--output", default=MODEL_SAVE_PATH, help="Folder to save the model to")
+    parser.add_argument("--teacher", help="Trained model the variant learns from (distillation)")
+    parser.add_argument("--alpha", type=float, default=0.5, help="Weight of the labels compared to the teacher outputs (distillation)")
+    parser.add_argument("--mixed-precision", choices=["mixed_float16", "mixed_bfloat16"],
+            help="Compute in 16 bit, mixed_float16 for GPUs, mixed_bfloat16 for CPUs supporting it")
+    return parser.parse_args()
+
+
+def distill(dataset, teacher, alpha):
+    """! Replaces the labels of the dataset by a blend of the labels and the outputs of the teacher.
+         The binary cross entropy is linear in its target, so training on the blended
+         target equals the weighted sum of the label loss and the teacher loss.
+    @param dataset  The dataset with batches (images, labels)
+    @param teacher  The trained model to learn from
+    @param alpha    The weight of the labels, 1.0 ignores the teacher
+    """
+    names = ["varroa_output", "pollen_output", "wasps_output", "cooling_output"]
+
+    def blend(images, labels):
+        outputs = teacher(tf.cast(images, tf.float32), training=False)
+        return images, {n: alpha * tf.reshape(tf.cast(labels[n], tf.float32), tf.shape(o)) + (1.0 - alpha) * tf.cast(o, tf.float32) \
+                for n, o in zip(names, outputs)}
+
+    return dataset.map(blend).prefetch(tf.data.AUTOTUNE)
+
+
+def main():
+    args = get_args()
+
+    # Must be set before the model is created
+    if args.mixed_precision:
+        tf.keras.mixed_precision.set_global_policy(args.mixed_precision)
+
+    if args.dataset:
+        import LocalDataset
+        cache = args.cache or os.path.join(args.dataset, ".cache")
+        meta = LocalDataset.build_cache(args.dataset, cache, IMG_HEIGHT, IMG_WIDTH, workers=args.workers)
+        print("Dataset of %i images cached in '%s'" % (meta["count"], cache))
+        train, val = LocalDataset.load_dataset(cache, args.batch_size, args.validation_split)
+    else:
+        import tensorflow_datasets as tfds
+        train, val = tfds.load('bee_dataset/bee_dataset_150',
+            batch_size=11,
+            as_supervised=True,
+            split=["train[0%:50%]", "train[50%:100%]"])
+        train = train.prefetch(tf.data.AUTOTUNE)
+        val = val.prefetch(tf.data.AUTOTUNE)
+
+    if args.teacher:
+        teacher = tf.keras.models.load_model(args.teacher)
+        train = distill(train, teacher, args.alpha)
+
+    model = BeeModel.get_bee_model_variant(IMG_HEIGHT, IMG_WIDTH, args.variant)
+    model.fit(
+            train,
+            validation_data=val,
+            epochs=args.epochs,
+            verbose=1,
+            callbacks=[]
+        )
+
+    # The weights are kept in float32 while training with mixed precision,
+    # store them in a float32 model for the inference on the edge boxes
+    if args.mixed_precision:
+        tf.keras.mixed_precision.set_global_policy("float32")
+        trained = model
+        model = BeeModel.get_bee_model_variant(IMG_HEIGHT, IMG_WIDTH, args.variant)
+        model.set_weights(trained.get_weights())
+
+    # Save the model and show the summary
+    model.save(args.output)
+    model.summary()
+
 
-import tensorflow_datasets as tfds
-train, val = tfds.load('bee_dataset/bee_dataset_150',
-    batch_size=11,
-    as_supervised=True,
-    split=["train[0%:50%]", "train[50%:100%]"])
-
-
-model = BeeModel.get_bee_model(150, 75)
-model.fit(
-        train,
-        validation_data=val,
-        epochs=20,
-        verbose=1,
-        callbacks=[]
-    )
-
-# Save the model and show the summary
-model.save(MODEL_SAVE_PATH)
-model.summary()
+if __name__ == '__main__':
+    main()
@@ -27,12 +27,24 @@ def get_config(attribute):
     return None
 
 
+def set_config(attribute, value):
+    global __cfg
+    """! Overrides a configuration value within the current process, e.g. for parameter sweeps
+    @param attribute    The name of the configuration value
+    @param value        The value to use instead of the one from the config.yaml
+    """
+    get_config(attribute)
+    __cfg[attribute] = value
+
+
 def get_args():
     """! Prepares and parses the command arguments
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("--noPreview", help="Run without producing any visual output", action="store_true")
     parser.add_argument("--video", help="Do not run on camera, use provided video file instead")
+    parser.add_argument("--batch", help="Analyse the provided video file or folder of videos offline, as fast as possible")
+    parser.add_argument("--soak", type=float, help="Loop the provided video file for the given hours and report resource drift")
     return parser.parse_args()
 
 def loadNames():
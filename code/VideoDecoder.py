@@ -0,0 +1,247 @@
+##
+# @file VideoDecoder.py
+#
+# @brief Decoder backends to read the frames of video files.
+
+import subprocess
+import logging
+import cv2
+import numpy as np
+from Utils import get_config
+
+logger = logging.getLogger(__name__)
+
+
+class VideoDecoder(object):
+    """! Base class of the video decoders. A decoder returns the frames of a video
+         file cropped to the region of interest, like 'cv2.VideoCapture' it provides
+         'read()' which returns a tuple (ret, frame).
+
+         Decoders may already scale the frames to the size of the largest frame of
+         the frame config, frames that already have the right size are not resized
+         again by the 'FramePyramid'.
+    """
+
+    def __init__(self, video_file, roi=None):
+        """! Initializes the decoder
+        @param video_file   The path to the video file
+        @param roi          The 'RegionOfInterest' to crop the frames to or None
+        """
+        super(VideoDecoder, self).__init__()
+        self._videoFile = video_file
+        self._roi = roi
+        self._fps = 0
+        self._size = (0, 0)
+        self._frameCount = 0
+
+        # Read the frame rate, size and length from the video header
+        probe = cv2.VideoCapture(video_file)
+        if probe.isOpened():
+            self._fps = probe.get(cv2.CAP_PROP_FPS)
+            self._size = (int(probe.get(cv2.CAP_PROP_FRAME_WIDTH)), int(probe.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            self._frameCount = max(0, int(probe.get(cv2.CAP_PROP_FRAME_COUNT)))
+        probe.release()
+
+    def getFrameRate(self):
+        """! Returns the nominal frame rate of the video, 0 if unknown
+        """
+        return self._fps
+
+    def getSourceSize(self):
+        """! Returns the size (width, height) of the frames stored in the video file
+        """
+        return self._size
+
+    def getFrameCount(self):
+        """! Returns the amount of frames stored in the video file, 0 if unknown
+        """
+        return self._frameCount
+
+    def getPosition(self):
+        """! Returns the position of the last frame read in seconds
+        """
+        raise NotImplementedError()
+
+    def read(self):
+        """! Reads the next frame
+        @return tuple (ret, frame), ret is False at the end of the video
+        """
+        raise NotImplementedError()
+
+    def release(self):
+        """! Closes the video file
+        """
+        pass
+
+
+class OpenCVDecoder(VideoDecoder):
+    """! Reads the frames using 'cv2.VideoCapture', the frames are cropped after decoding.
+    """
+
+    def __init__(self, video_file, roi=None, pipeline=None, start_frame=0):
+        """! Opens the video file
+        @param video_file   The path to the video file
+        @param roi          The 'RegionOfInterest' to crop the frames to or None
+        @param pipeline     A GStreamer pipeline to use instead of the default backend of OpenCV
+        @param start_frame  The index of the first frame to read
+        """
+        super(OpenCVDecoder, self).__init__(video_file, roi)
+        if pipeline is None:
+            self._stream = cv2.VideoCapture(video_file)
+        else:
+            self._stream = cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
+        if not self._stream.isOpened():
+            raise BaseException("Failed to open the video file '%s'" % (video_file,))
+        if start_frame:
+            self._stream.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    def getPosition(self):
+        """! Returns the position of the last frame read in seconds
+        """
+        return self._stream.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+    def read(self):
+        """! Reads the next frame
+        @return tuple (ret, frame), ret is False at the end of the video
+        """
+        (ret, frame) = self._stream.read()
+        if ret and self._roi is not None:
+            frame = self._roi.cropFrame(frame)
+        return (ret, frame)
+
+    def release(self):
+        """! Closes the video file
+        """
+        self._stream.release()
+
+
+class GStreamerDecoder(OpenCVDecoder):
+    """! Decodes the frames with the hardware decoder of the Jetson Nano (NVDEC)
+         and scales them using 'nvvidconv', the frames are cropped after decoding.
+    """
+
+    def __init__(self, video_file, frame_size, roi=None, start_frame=0):
+        """! Opens the video file
+        @param video_file   The path to the video file
+        @param frame_size   The size (width, height) of the frames to output
+        @param roi          The 'RegionOfInterest' to crop the frames to or None
+        @param start_frame  The index of the first frame to read
+        """
+        pipeline = 'filesrc location={} \
+                    ! queue ! h264parse ! omxh264dec ! nvvidconv \
+                    ! video/x-raw,format=BGRx,width={},height={} ! queue ! videoconvert ! queue \
+                    ! video/x-raw,format=BGR ! appsink'.format(video_file, frame_size[0], frame_size[1])
+        super(GStreamerDecoder, self).__init__(video_file, roi, pipeline, start_frame)
+
+
+class FFmpegDecoder(VideoDecoder):
+    """! Decodes the frames in an 'ffmpeg' subprocess. The frames are cropped to
+         the region of interest and scaled to the output size by 'ffmpeg', which uses
+         multiple threads for decoding. The raw BGR frames are read from a pipe into
+         preallocated buffers, so full sized frames never have to be handled in Python.
+
+         The returned frames are views of the buffers. They are passed to a
+         'multiprocessing.Queue' which serializes them in a background thread, so a ring
+         of buffers is used and a frame is overwritten after 'buffer_count' reads only.
+    """
+
+    def __init__(self, video_file, frame_size, roi=None, buffer_count=1, binary=None, threads=None, start_frame=0):
+        """! Starts 'ffmpeg' for the video file
+        @param video_file   The path to the video file
+        @param frame_size   The size (width, height) of the frames to output (after cropping)
+        @param roi          The 'RegionOfInterest' to crop the frames to or None
+        @param buffer_count The amount of frames that may be in use at the same time
+        @param binary       The ffmpeg executable, FFMPEG_BINARY of the config if None
+        @param threads      The amount of decoding threads, FFMPEG_THREADS of the config if None
+        @param start_frame  The index of the first frame to read
+        """
+        super(FFmpegDecoder, self).__init__(video_file, roi)
+        self._frameSize = tuple(frame_size)
+        self._frameCnt = start_frame
+        if start_frame and not self._fps:
+            raise BaseException("Failed to read the frame rate of '%s', required to seek in the video" % (video_file,))
+
+        # Allocate the frame buffers
+        self._index = 0
+        self._buffers = [np.empty((frame_size[1], frame_size[0], 3), dtype=np.uint8) \
+                for _ in range(max(1, buffer_count))]
+
+        # Crop and scale inside of ffmpeg
+        filters = []
+        if roi is not None:
+            if not self._size[0] or not self._size[1]:
+                raise BaseException("Failed to read the frame size of '%s', required to crop the video" % (video_file,))
+            x0, y0, x1, y1 = roi.getRect(*self._size)
+            filters.append("crop=%i:%i:%i:%i" % (x1 - x0, y1 - y0, x0, y0))
+        filters.append("scale=%i:%i:flags=bilinear" % self._frameSize)
+
+        binary = get_config("FFMPEG_BINARY") if binary is None else binary
+        threads = get_config("FFMPEG_THREADS") if threads is None else threads
+        cmd = [binary, "-nostdin", "-loglevel", "error", "-threads", str(threads)]
+        if get_config("FFMPEG_HWACCEL") is not None:
+            cmd += ["-hwaccel", get_config("FFMPEG_HWACCEL")]
+        if start_frame:
+            cmd += ["-ss", "%.6f" % (start_frame / self._fps,)]
+        cmd += ["-i", video_file, "-an", "-vf", ",".join(filters),
+                "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"]
+        logger.debug("Starting decoder: %s" % (" ".join(cmd),))
+
+        try:
+            self._process = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=0)
+        except OSError as e:
+            raise BaseException("Failed to start ffmpeg, check FFMPEG_BINARY in the config.yaml: %s" % (e,))
+
+    def getPosition(self):
+        """! Returns the position of the last frame read in seconds, based on the nominal frame rate
+        """
+        if not self._fps:
+            return 0
+        return (self._frameCnt - 1) / self._fps
+
+    def read(self):
+        """! Reads the next frame from the pipe
+        @return tuple (ret, frame), ret is False at the end of the video
+        """
+        frame = self._buffers[self._index]
+        view = memoryview(frame).cast("B")
+        pos = 0
+        while pos < len(view):
+            n = self._process.stdout.readinto(view[pos:])
+            if not n:
+                return (False, None)
+            pos += n
+
+        self._index = (self._index + 1) % len(self._buffers)
+        self._frameCnt += 1
+        return (True, frame)
+
+    def release(self):
+        """! Stops 'ffmpeg', the remaining frames are discarded
+        """
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.stdout.close()
+        self._process.wait()
+
+
+def create_decoder(video_file, frame_config, roi=None, buffer_count=1, start_frame=0):
+    """! Creates the decoder selected by VIDEO_DECODER in the config.yaml
+    @param video_file   The path to the video file
+    @param frame_config The frame config as returned by 'get_frame_config' (not reduced to the region)
+    @param roi          The 'RegionOfInterest' to crop the frames to or None
+    @param buffer_count The amount of frames that may be in use at the same time
+    @param start_frame  The index of the first frame to read
+    @return A 'VideoDecoder'
+    """
+    decoder = get_config("VIDEO_DECODER")
+    if decoder == "opencv":
+        return OpenCVDecoder(video_file, roi, start_frame=start_frame)
+    elif decoder == "gstreamer":
+        # The full frame is scaled, the region of interest is cropped afterwards
+        return GStreamerDecoder(video_file, (frame_config[0][1], frame_config[0][0]), roi, start_frame)
+    elif decoder == "ffmpeg":
+        if roi is not None:
+            frame_config = roi.getFrameConfig()
+        return FFmpegDecoder(video_file, (frame_config[0][1], frame_config[0][0]), roi, buffer_count,
+                start_frame=start_frame)
+    raise BaseException("Unknown setting for VIDEO_DECODER, expected opencv, gstreamer or ffmpeg")
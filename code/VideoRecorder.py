@@ -0,0 +1,117 @@
+##
+# @file VideoRecorder.py
+#
+# @brief Thread that encodes frames to a video file in the background.
+
+from threading import Thread, Condition
+from collections import deque
+import time
+import logging
+import cv2
+
+logger = logging.getLogger(__name__)
+
+
+class VideoRecorder(Thread):
+    """! The 'VideoRecorder' writes frames to a video file in a separate thread, so
+         encoding never blocks the caller. Frames are buffered in a bounded queue,
+         when the encoder can't keep up either the newest frame is dropped or the
+         oldest buffered one is replaced, depending on the drop policy.
+
+         The frames are passed by reference, they must not be modified afterwards.
+    """
+
+    def __init__(self, path, fps, codec="MJPG", size=None, queue_length=30, drop_oldest=False):
+        """! Initializes the recorder thread
+        @param path         The video file to write
+        @param fps          The frame rate stored in the video file
+        @param codec        The fourcc code of the codec, e.g. "MJPG", "XVID" or "mp4v"
+        @param size         The output size (width, height), None to keep the size of the frames
+        @param queue_length The maximum amount of frames waiting to be encoded
+        @param drop_oldest  Whether to drop the oldest waiting frame instead of the new one if the queue is full
+        """
+        Thread.__init__(self, daemon=True)
+        self.stopped = False
+        self._path = path
+        self._fps = fps
+        self._codec = codec
+        self._size = tuple(size) if size else None
+        self._queueLength = queue_length
+        self._dropOldest = drop_oldest
+        self._frames = deque()
+        self._condition = Condition()
+        self._writer = None
+
+        # Statistics of the current reporting interval
+        self._windowStart = time.time()
+        self._windowEncoded = 0
+        self._encoded = 0
+        self._dropped = 0
+
+    def write(self, frame):
+        """! Queues a frame for encoding, never blocks
+        @param frame    The frame to write
+        @return False if a frame was dropped
+        """
+        with self._condition:
+            dropped = len(self._frames) >= self._queueLength
+            if dropped:
+                self._dropped += 1
+                if not self._dropOldest:
+                    return False
+                self._frames.popleft()
+            self._frames.append(frame)
+            self._condition.notify()
+        return not dropped
+
+    def run(self):
+        """! Encodes the queued frames until the recorder gets stopped, then writes the remaining ones
+        """
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._frames) or self.stopped)
+                if not len(self._frames):
+                    break
+                frame = self._frames.popleft()
+
+            # Open the file with the size of the first frame
+            if self._writer is None:
+                if self._size is None:
+                    self._size = (frame.shape[1], frame.shape[0])
+                self._writer = cv2.VideoWriter(self._path, cv2.VideoWriter_fourcc(*self._codec), self._fps, self._size)
+                if not self._writer.isOpened():
+                    logger.error("Can't write video file '%s' with codec '%s'" % (self._path, self._codec))
+                    self.stopped = True
+                    break
+                logger.info("Recording to '%s' (%s, %ix%i, %0.1f FPS)" % (self._path, self._codec,
+                        self._size[0], self._size[1], self._fps))
+
+            if (frame.shape[1], frame.shape[0]) != self._size:
+                frame = cv2.resize(frame, self._size, interpolation=cv2.INTER_AREA)
+            self._writer.write(frame)
+            with self._condition:
+                self._encoded += 1
+                self._windowEncoded += 1
+
+        if self._writer is not None:
+            self._writer.release()
+        logger.debug("Video recorder stopped")
+
+    def report(self):
+        """! Returns the encode rate since the last report and the overall statistics
+        @return tuple (rate, encoded, dropped, queued)
+        """
+        with self._condition:
+            now = time.time()
+            rate = self._windowEncoded / (now - self._windowStart) if now > self._windowStart else 0
+            self._windowStart = now
+            self._windowEncoded = 0
+            return (rate, self._encoded, self._dropped, len(self._frames))
+
+    def stop(self):
+        """! Stops the recorder after encoding the queued frames and joins it
+        """
+        with self._condition:
+            self.stopped = True
+            self._condition.notify()
+        self.join()
@@ -8,32 +8,41 @@ import cv2
 import multiprocessing
 import datetime
 import queue
-from Utils import get_config, get_args
+from Utils import get_config, get_args, get_frame_config
 from BeeTracking import BeeTracker, BeeTrack
 from multiprocessing import Queue
 from BeeDetector import BeeProcess
+from RegionOfInterest import RegionOfInterest
+from VideoRecorder import VideoRecorder
+from PreviewServer import PreviewServer
+from Overlay import OverlayRenderer
+from LoadGovernor import getLoadGovernor
 
 logger = logging.getLogger(__name__)
 
 class Visual(BeeProcess):
     """! Separate process to visualize the programs results.
-         It uses in-queue to receive the current image and the tracking results
+         It reads the current image and the tracking results from the "preview" port
     """
 
+    INPUTS = {"preview": "in_q"}
+
     def __init__(self):
-        """! Initializes the visualiser
+        """! Initializes the process
         """
         super().__init__()
-        self._inQueue = multiprocessing.Queue(maxsize=20)
-        self.set_process_param("in_q", self._inQueue)
+        self._viewerActive = multiprocessing.Value('i', 0, lock=False)
+        self.set_process_param("viewer", self._viewerActive)
 
-    def getInQueue(self):
-        """! Sets the input queue to receive the current image and the tracking results
+    def getViewerActive(self):
+        """! Returns the flag telling whether the preview is shown, recorded or streamed to a client.
+             The process sending the preview skips it while the flag is 0.
+        @return A shared 'multiprocessing.Value'
         """
-        return self._inQueue 
+        return self._viewerActive
 
     @staticmethod
-    def run(in_q, parent, stopped, done):
+    def run(in_q, viewer, parent, stopped, done):
         """! Static method, starts the process of the image extractor
         """
 
@@ -43,71 +52,101 @@ class Visual(BeeProcess):
         _process_time_n100 = time.time()
         _lastFPS = 0
 
+        # The region of interest, the received frames are cropped to it
+        frame_config = get_frame_config()
+        roi = RegionOfInterest.fromConfig(frame_config)
+
+        # Draws the results, the settings are read once
+        renderer = OverlayRenderer(roi, len(frame_config) - 2, get_config("OVERLAY_SCALE"))
+        governor = getLoadGovernor()
+
+        # Maximum time to block on an empty queue before checking the stop flag again
+        _queue_timeout = get_config("QUEUE_READ_TIMEOUT")
+
+        # Encode the preview in the background, so recording never delays the visualization
+        recorder = None
+        if get_config("SAVE_AS_VIDEO"):
+            recorder = VideoRecorder(get_config("SAVE_AS_VIDEO_PATH"), get_config("SAVE_AS_VIDEO_FPS"),
+                    get_config("SAVE_AS_VIDEO_CODEC"), get_config("SAVE_AS_VIDEO_RESOLUTION"),
+                    get_config("SAVE_AS_VIDEO_QUEUE_LENGTH"), get_config("SAVE_AS_VIDEO_DROP") == "oldest")
+            recorder.start()
+
+        # Stream the preview to remote clients
+        server = None
+        if get_config("PREVIEW_SERVER_ENABLED"):
+            server = PreviewServer(get_config("PREVIEW_SERVER_ADDRESS"), get_config("PREVIEW_SERVER_PORT"),
+                    get_config("PREVIEW_SERVER_JPEG_QUALITY"), get_config("PREVIEW_SERVER_MAX_FPS"))
+            server.start()
+        show = not get_args().noPreview
+
         while stopped.value == 0:
-            if not in_q.empty():
-
-                _start_t = time.time()
-               
-                # Log FPS
-                if _process_cnt != 0 and _process_cnt % 100 == 0:
-                    fps = (100/ (time.time() - _process_time_n100))
-                    _lastFPS = fps
-                    _process_time_n100 = time.time()
-                    logger.info(f"FPS visual: {fps:.2f} FPS")
-
-                _process_cnt += 1
-
-                # Read one entry from the process queue
-                img_540, detected_bees, detected_bee_groups, tracker, processFPS = in_q.get()
-
-                if get_config("SHOW_VISUALIZATION_DETAILS"):
-                    cv2.putText(img_540,"Process FPS: %.2f" % (processFPS,), 
-                        (img_540.shape[1]-200,20),
-                        cv2.FONT_HERSHEY_PLAIN, 1, (0,0,255), 1)
-                    cv2.putText(img_540,"Visual FPS: %.2f" % (_lastFPS), 
-                        (img_540.shape[1]-200,40),
-                        cv2.FONT_HERSHEY_PLAIN, 1, (0,0,255), 1)
-                    cv2.putText(img_540,"Frame Skip: %i" % (get_config("VISUALIZATION_FRAME_SKIP"),), 
-                        (img_540.shape[1]-200,60),
-                        cv2.FONT_HERSHEY_PLAIN, 1, (0,0,255), 1)
-
-                if get_config("DRAW_DETECTED_ELLIPSES"):
-                    for item in detected_bees:
-                        cv2.ellipse(img_540, item, (0, 0, 255), 2)
-                if get_config("DRAW_DETECTED_GROUPS"):
-                    for item in detected_bee_groups:
-                        cv2.ellipse(img_540, item, (255, 0, 0), 2)
-
-                if get_config("DRAW_TRACKING_RESULTS"):
-                    tracker.drawTracks(img_540)
-
-                # Draw preview if wanted
-                if not get_args().noPreview:
-
-                    skipKey = 1 if get_config("FRAME_AUTO_PROCESS") else 0
-
-                    cv2.imshow("frame", img_540)
-                    if cv2.waitKey(skipKey) & 0xFF == ord('q'):
-                        break
-
-                # Save as Video
-                if get_config("SAVE_AS_VIDEO"):
-                    if type(writer) == type(None):
-                        h, w, c = img_540.shape
-                        writer = cv2.VideoWriter(get_config("SAVE_AS_VIDEO_PATH"), \
-                                cv2.VideoWriter_fourcc(*'MJPG'), 18, (w, h))
-                    writer.write(img_540)
-                
-
-                _process_time += time.time() - _start_t
-
-                # Print log entry about process time each 100 frames
-                if _process_cnt % 100 == 0:
-                    logger.debug("Process time: %0.3fms" % (_process_time * 10.0))
-                    _process_time = 0
-
-            else:
-                time.sleep(0.01)
+
+            # Tell the sender whether anybody looks at the result, before waiting for a frame
+            active = show or recorder is not None or (server is not None and server.hasClients())
+            viewer.value = 1 if active else 0
+
+            # Wait for the next frame, wake up regularly to check the stop flag
+            try:
+                img_540, detected_bees, detected_bee_groups, tracker, processFPS = in_q.get(timeout=_queue_timeout)
+            except queue.Empty:
+                continue
+
+            _start_t = time.time()
+           
+            # Log FPS
+            if _process_cnt != 0 and _process_cnt % 100 == 0:
+                fps = (100/ (time.time() - _process_time_n100))
+                _lastFPS = fps
+                _process_time_n100 = time.time()
+                logger.info(f"FPS visual: {fps:.2f} FPS")
+
+            _process_cnt += 1
+
+            # Skip drawing while nobody looks at the result
+            if not (show or recorder is not None or (server is not None and server.hasClients())):
+                BeeProcess.itemProcessed()
+                continue
+
+            details = ["Process FPS: %.2f" % (processFPS,),
+                       "Visual FPS: %.2f" % (_lastFPS,),
+                       "Frame Skip: %i" % (governor.getVisualizationFrameSkip(),),
+                       "Load level: %i" % (governor.getLevel(),)]
+            img_540 = renderer.render(img_540, detected_bees, detected_bee_groups, tracker, details,
+                    governor.isDrawingReduced())
+
+            # Draw preview if wanted
+            if show:
+
+                skipKey = 1 if get_config("FRAME_AUTO_PROCESS") else 0
+
+                cv2.imshow("frame", img_540)
+                if cv2.waitKey(skipKey) & 0xFF == ord('q'):
+                    break
+
+            # Save as Video
+            if recorder is not None:
+                recorder.write(img_540)
+
+            # Stream to the connected clients
+            if server is not None and server.hasClients():
+                server.publish(img_540)
+
+            _process_time += time.time() - _start_t
+            BeeProcess.itemProcessed()
+
+            # Print log entry about process time each 100 frames
+            if _process_cnt % 100 == 0:
+                logger.debug("Process time: %0.3fms" % (_process_time * 10.0))
+                _process_time = 0
+                if recorder is not None:
+                    rate, encoded, dropped, queued = recorder.report()
+                    logger.info("Video recording: %0.2f FPS encoded, %i frames written, %i dropped, %i queued" % \
+                            (rate, encoded, dropped, queued))
+
+        if recorder is not None:
+            recorder.stop()
+        if server is not None:
+            server.stop()
 
         # The process stopped
         logger.info("Image extractor stopped")
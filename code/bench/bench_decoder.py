@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+##
+# @file bench_decoder.py
+#
+# @brief Compares the decode throughput of the video decoder backends.
+#
+#        Run from the 'code' folder: python3 bench/bench_decoder.py <video file> [frames] [ffmpeg binary]
+
+import os
+import sys
+import time
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Utils import get_frame_config
+from FramePyramid import FramePyramid
+from RegionOfInterest import RegionOfInterest
+from VideoDecoder import OpenCVDecoder, GStreamerDecoder, FFmpegDecoder
+
+
+def measure(decoder, pyramid, frames):
+    """! Reads the given amount of frames and builds the frame sets
+    @return tuple (frames read, frames per second of the decoding, frames per second including the frame sets)
+    """
+    decode_t = 0
+    build_t = 0
+    cnt = 0
+    while cnt < frames:
+        start = time.perf_counter()
+        ret, frame = decoder.read()
+        decode_t += time.perf_counter() - start
+        if not ret:
+            break
+        start = time.perf_counter()
+        pyramid.build(frame)
+        build_t += time.perf_counter() - start
+        cnt += 1
+    decoder.release()
+    if not cnt:
+        return (0, 0, 0)
+    return (cnt, cnt / decode_t, cnt / (decode_t + build_t))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: %s <video file> [frames] [ffmpeg binary]" % (sys.argv[0],))
+        return
+    video_file = sys.argv[1]
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    binary = sys.argv[3] if len(sys.argv) > 3 else None
+
+    frame_config = get_frame_config()
+    frame_size = (frame_config[0][1], frame_config[0][0])
+    roi = RegionOfInterest.fromConfig(frame_config)
+    out_config = roi.getFrameConfig() if roi is not None else frame_config
+    out_size = (out_config[0][1], out_config[0][0])
+
+    backends = [
+        ("opencv", lambda: OpenCVDecoder(video_file, roi)),
+        ("ffmpeg", lambda: FFmpegDecoder(video_file, out_size, roi, 2, binary)),
+        ("ffmpeg (1 thread)", lambda: FFmpegDecoder(video_file, out_size, roi, 2, binary, 1)),
+    ]
+    if "GStreamer:                   YES" in cv2.getBuildInformation():
+        backends.append(("gstreamer", lambda: GStreamerDecoder(video_file, frame_size, roi)))
+
+    print("Decoding %s, %i frames, output %ix%i" % (video_file, frames, out_size[0], out_size[1]))
+    print("  %-20s %10s %14s" % ("backend", "decode", "+ frame set"))
+    for name, create in backends:
+        try:
+            decoder = create()
+        except BaseException as e:
+            print("  %-20s not available: %s" % (name, e))
+            continue
+        cnt, decode_fps, total_fps = measure(decoder, FramePyramid(out_config, 2, "linear"), frames)
+        print("  %-20s %6.1f FPS %10.1f FPS  (%i frames)" % (name, decode_fps, total_fps, cnt))
+
+
+if __name__ == '__main__':
+    main()
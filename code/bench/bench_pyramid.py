@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+##
+# @file bench_pyramid.py
+#
+# @brief Compares the frame set construction of the 'FramePyramid' with the
+#        previous resize loop of the 'ImageProvider' at 1080p input.
+#
+#        Run from the 'code' folder: python3 bench/bench_pyramid.py
+
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from FramePyramid import FramePyramid
+
+
+FRAME_CONFIGS = {
+    "EXT_RES_75x150": (
+        (540, 960, cv2.IMREAD_UNCHANGED),
+        (180, 320, cv2.IMREAD_UNCHANGED)
+    ),
+    "EXT_RES_150x300": (
+        (1080, 1920, cv2.IMREAD_UNCHANGED),
+        (540, 960, cv2.IMREAD_UNCHANGED),
+        (180, 320, cv2.IMREAD_UNCHANGED)
+    ),
+}
+
+
+def legacy_pyramid(frame, config):
+    """! The frame set construction as it was done by the 'ImageProvider' before
+    """
+    fs = tuple()
+    for item in config:
+        width, height = frame.shape[0:2]
+        if width != item[0] or height != item[1]:
+            frame = cv2.resize(frame, (item[1], item[0]))
+        if item[2] == cv2.IMREAD_GRAYSCALE:
+            fs += (cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY),)
+        else:
+            fs += (frame,)
+    return fs
+
+
+def make_frame(width=1920, height=1080):
+    """! Creates a textured 1080p test frame
+    """
+    rng = np.random.default_rng(0)
+    frame = np.full((height, width, 3), (200, 220, 210), dtype=np.uint8)
+    noise = rng.integers(-20, 20, frame.shape)
+    return np.clip(frame + noise, 0, 255).astype(np.uint8)
+
+
+def measure(fn, repeat):
+    """! Returns the mean time in ms of the given function
+    """
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000.0
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    frame = make_frame()
+
+    print("Frame set construction, 1920x1080 input, %i runs" % (repeat,))
+    for name, config in FRAME_CONFIGS.items():
+        print("\n%s" % (name,))
+        print("  %-26s %8.3f ms" % ("legacy", measure(lambda: legacy_pyramid(frame, config), repeat)))
+        for interpolation in ("auto", "area", "linear"):
+            pyramid = FramePyramid(config, 6, interpolation)
+            print("  %-26s %8.3f ms" % ("FramePyramid (%s)" % (interpolation,),
+                measure(lambda: pyramid.build(frame), repeat)))
+
+    # Decoding MJPG frames at reduced resolution compared to decoding and resizing them
+    _, jpeg = cv2.imencode(".jpeg", frame)
+    flag = FramePyramid.getReducedDecodeFlag((1920, 1080), (960, 540))
+    print("\nMJPG decode, 960x540 output")
+    print("  %-26s %8.3f ms" % ("decode + resize", measure(lambda: cv2.resize(
+        cv2.imdecode(jpeg, cv2.IMREAD_COLOR), (960, 540), interpolation=cv2.INTER_AREA), repeat)))
+    print("  %-26s %8.3f ms" % ("reduced decode", measure(lambda: cv2.imdecode(jpeg, flag), repeat)))
+
+
+if __name__ == '__main__':
+    main()
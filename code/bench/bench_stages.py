@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+##
+# @file bench_stages.py
+#
+# @brief Measures throughput and latency of each pipeline stage on synthetic frames.
+#
+#        Run from the 'code' folder:
+#           python3 bench/bench_stages.py [--frames N] [--output results.json] [--compare baseline.json]
+#
+#        The results are written as JSON, compare the files of two commits
+#        with '--compare' to find regressions.
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import contextlib
+import subprocess
+from datetime import datetime
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Utils import get_config, get_frame_config, cutEllipseFromImage
+from FramePyramid import FramePyramid
+from BeeDetector import detect_bees
+from BeeTracking import BeeTracker
+from synthetic import SyntheticHive, DENSITIES
+
+
+def summarize(durations, items=None):
+    """! Summarizes the measured durations of a stage
+    @param durations    List of durations in seconds, one per call
+    @param items        Amount of items (e.g. bees) processed by all calls, optional
+    @return dict with calls per second, latency statistics in ms and items per second
+    """
+    d = np.array(durations) * 1000.0
+    result = {"calls": len(d),
+              "per_second": round(1000.0 / d.mean(), 2) if d.mean() > 0 else 0,
+              "mean_ms": round(float(d.mean()), 4),
+              "p50_ms": round(float(np.percentile(d, 50)), 4),
+              "p95_ms": round(float(np.percentile(d, 95)), 4),
+              "max_ms": round(float(d.max()), 4)}
+    if items is not None:
+        result["items_per_second"] = round(items / (d.sum() / 1000.0), 2)
+    return result
+
+
+def timed(fn, *args):
+    """! Calls the function and returns its result and duration
+    """
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def recall(detected, known, scale, max_dist=20):
+    """! Returns the fraction of known bees (fully on the frame) that were detected
+    """
+    h, w = get_frame_config()[-2][0:2]
+    found = total = 0
+    for e in known:
+        x, y = e[0][0] * scale, e[0][1] * scale
+        if y < 0 or y > h:
+            continue
+        total += 1
+        if any(abs(d[0][0] - x) < max_dist and abs(d[0][1] - y) < max_dist for d in detected):
+            found += 1
+    return found / total if total else 1.0
+
+
+def bench_density(bees, frames):
+    """! Runs the stages for one density
+    @return dict with the results of each stage
+    """
+    frame_config = get_frame_config()
+    pyramid = FramePyramid(frame_config, 2, get_config("FRAME_PYRAMID_INTERPOLATION"))
+    hive = SyntheticHive(bees, (1920, 1080))
+    scale = frame_config[-2][0] / 1080.0
+
+    # Frame sets, the 'ImageProvider' builds them from the captured 1080p frames
+    t_pyramid = []
+    t_detect = []
+    t_track = []
+    t_cut = []
+    cuts = 0
+    crops = []
+    recalls = []
+    tracker = BeeTracker(get_config("TRACK_DIST_THRESHOLD"), get_config("TRACK_MAX_FRAME_SKIPPED"),
+            (frame_config[-2][1], frame_config[-2][0]))
+    ext_scale = 2 if get_config("NN_EXTRACT_RESOLUTION") == "EXT_RES_150x300" else 1
+
+    for num in range(frames):
+        frame, known = hive.next()
+        fs, d = timed(pyramid.build, frame)
+        t_pyramid.append(d)
+
+        # Bee detection on the smallest frame
+        (detected, groups), d = timed(detect_bees, fs[-1], 3)
+        t_detect.append(d)
+        recalls.append(recall(detected, known, scale))
+
+        # Tracking, the tracker prints matching conflicts which are not part of the measurement
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, d = timed(tracker.update, detected, groups, num / 30.0)
+        t_track.append(d)
+
+        # Image extraction of all tracked bees
+        ext_frame = fs[0] if ext_scale == 2 else fs[-2]
+        for _, position in tracker.getLastBeePositions(1):
+            (img, _), d = timed(cutEllipseFromImage, position, ext_frame, 0, ext_scale)
+            t_cut.append(d)
+            cuts += 1
+            if img is not None and len(crops) < 64:
+                crops.append(img)
+
+    result = {"bees": bees,
+              "pyramid": summarize(t_pyramid),
+              "detect_bees": summarize(t_detect),
+              "detection_recall": round(float(np.mean(recalls)), 3),
+              "tracker_update": summarize(t_track),
+              "cut_ellipse": summarize(t_cut, cuts) if len(t_cut) else None}
+    return result, crops
+
+
+def bench_classification(crops, batch_size=5, repeat=20):
+    """! Measures the inference of the neural network on extracted bee images
+    @return dict with the results or the reason why the stage was skipped
+    """
+    if not len(crops):
+        return {"skipped": "no bee images extracted"}
+    try:
+        import tensorflow as tf
+        model = tf.keras.models.load_model(get_config("NN_MODEL_FOLDER"))
+    except Exception as e:
+        return {"skipped": "%s: %s" % (type(e).__name__, e)}
+
+    img_height, img_width = (150, 75) if get_config("NN_CLASSIFY_RESOLUTION") == "EXT_RES_75x150" else (300, 150)
+    images = [tf.image.resize(cv2.cvtColor(c, cv2.COLOR_BGR2RGB), [img_height, img_width]) for c in crops]
+    batch = tf.convert_to_tensor((images * batch_size)[0:batch_size])
+
+    # The first call builds the graph and is not measured
+    model.predict_on_batch(batch)
+    durations = []
+    for _ in range(repeat):
+        _, d = timed(model.predict_on_batch, batch)
+        durations.append(d)
+    result = summarize(durations, batch_size * repeat)
+    result["batch_size"] = batch_size
+    return result
+
+
+def git_commit():
+    """! Returns the current commit of the repository or None
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(baseline, current, tolerance=0.1):
+    """! Prints the change of the mean latency of each stage compared to a baseline
+    """
+    print("\nCompared to %s (%s):" % (baseline.get("commit"), baseline.get("date")))
+    for density, stages in current["results"].items():
+        for stage, result in stages.items():
+            if not isinstance(result, dict) or "mean_ms" not in result:
+                continue
+            old = baseline["results"].get(density, {}).get(stage)
+            if not isinstance(old, dict) or "mean_ms" not in old or not old["mean_ms"]:
+                continue
+            ratio = result["mean_ms"] / old["mean_ms"]
+            flag = "  SLOWER" if ratio > 1 + tolerance else ("  faster" if ratio < 1 - tolerance else "")
+            print("  %-10s %-16s %8.3f ms -> %8.3f ms (%+5.1f%%)%s" % \
+                    (density, stage, old["mean_ms"], result["mean_ms"], (ratio - 1) * 100.0, flag))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=100, help="Frames per density")
+    parser.add_argument("--densities", default=",".join(DENSITIES.keys()), help="Comma separated densities")
+    parser.add_argument("--output", default="bench_results.json", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    args = parser.parse_args()
+
+    # Single threaded, like the stages in the pipeline processes
+    cv2.setNumThreads(1)
+
+    report = {"commit": git_commit(),
+              "date": datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(),
+              "opencv": cv2.__version__,
+              "numpy": np.__version__,
+              "machine": platform.machine(),
+              "cpu_count": os.cpu_count(),
+              "frames": args.frames,
+              "frame_config": [list(item[0:2]) for item in get_frame_config()],
+              "results": {}}
+
+    # Warm up, the first calls load lazy imports and caches
+    bench_density(DENSITIES["sparse"], 3)
+
+    crops = []
+    for density in args.densities.split(","):
+        result, c = bench_density(DENSITIES[density], args.frames)
+        report["results"][density] = result
+        crops += c
+        print("%-10s %3i bees: pyramid %6.2f ms, detect %6.2f ms (recall %0.2f), track %6.2f ms, cut %s" % \
+                (density, result["bees"], result["pyramid"]["mean_ms"], result["detect_bees"]["mean_ms"],
+                 result["detection_recall"], result["tracker_update"]["mean_ms"],
+                 "%0.2f ms" % result["cut_ellipse"]["mean_ms"] if result["cut_ellipse"] else "-"))
+
+    report["results"]["classification"] = {"inference": bench_classification(crops)}
+    print("classification: %s" % (report["results"]["classification"]["inference"],))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print("Results written to '%s'" % (args.output,))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+##
+# @file bench_tracker.py
+#
+# @brief Replays detection records through the 'BeeTracker' as fast as possible.
+#        The records are written by the offline analysis, see OFFLINE_RECORD_FOLDER.
+#
+#        Run from the 'code' folder: python3 bench/bench_tracker.py <record folder> [repeat]
+#        The kalman filter matrices are checked first, also without a record.
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Utils import get_config
+from Statistic import getStatistics
+from BeeTracking import BeeTracker, kinematic_transition, kinematic_process_noise
+from DetectionRecord import DetectionRecord, replay_record
+
+
+def check_kinematics():
+    """! Checks the kalman filter matrices for a nominal and a skipped frame: two steps of 1
+         equal one step of 2 and the process noise is symmetric and positive semi-definite
+    @return True if all checks passed
+    """
+    ok = True
+    F1, F2 = kinematic_transition(1), kinematic_transition(2)
+    if not np.allclose(np.matmul(F1, F1), F2):
+        print("  F(1) * F(1) != F(2)")
+        ok = False
+    for dt in (1, 2):
+        Q = kinematic_process_noise(dt)
+        if not np.allclose(Q, Q.T):
+            print("  Q(%i) is not symmetric" % (dt,))
+            ok = False
+        if np.linalg.eigvalsh(Q).min() < -1e-9:
+            print("  Q(%i) is not positive semi-definite" % (dt,))
+            ok = False
+    print("Kalman filter matrices: %s" % ("ok" if ok else "FAILED",))
+    return ok
+
+
+def main():
+    if not check_kinematics():
+        sys.exit(1)
+    if len(sys.argv) < 2:
+        print("Usage: %s <record folder> [repeat]" % (sys.argv[0],))
+        return
+    record = DetectionRecord(sys.argv[1])
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    bees, groups = record.getDetectionCount()
+    print("Record of '%s': %i frames, %i bees, %i groups" % (record.meta.get("video"), len(record), bees, groups))
+
+    best = None
+    for _ in range(repeat):
+        _dh = getStatistics()
+        _, s_in, s_out, _ = _dh.readOverallStatistics()
+        tracker = BeeTracker(get_config("TRACK_DIST_THRESHOLD"), get_config("TRACK_MAX_FRAME_SKIPPED"),
+                tuple(record.meta["frame_size"]))
+
+        start = time.perf_counter()
+        frames = replay_record(record, tracker)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+
+        _, bees_in, bees_out, _ = _dh.readOverallStatistics()
+        result = (tracker.trackId, bees_in - s_in, bees_out - s_out)
+
+    print("  tracks: %i, bees in: %i, bees out: %i" % result)
+    print("  %0.1f FPS, %0.3f ms per frame (best of %i)" % (frames / best, best / frames * 1000.0, repeat))
+
+
+if __name__ == '__main__':
+    main()
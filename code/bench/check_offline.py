@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+##
+# @file check_offline.py
+#
+# @brief Checks that the offline analysis (--batch) counts the same bees as processing
+#        the video in one piece, like the 'ImageConsumer' does with --video.
+#
+#        Run from the 'code' folder: python3 bench/check_offline.py [video file]
+#        Without a video file, a synthetic clip is rendered, see 'render_clip'. The
+#        video is split into short segments, so the segments start with a seek and
+#        the motion gate starts in the middle of the video. The frames read after a
+#        seek and the replay of the detection record are checked as well.
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import logging
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Utils import get_config, set_config, get_frame_config
+from Statistic import getStatistics
+from BeeDetector import detect_bees
+from BeeTracking import BeeTracker
+from FramePyramid import FramePyramid
+from MotionGate import MotionGate
+from RegionOfInterest import RegionOfInterest
+from VideoDecoder import create_decoder
+from DetectionRecord import DetectionRecord, replay_record
+from OfflineAnalysis import run_offline_analysis, get_frame_rate
+from synthetic import SyntheticHive
+
+
+def render_clip(path, fps=30):
+    """! Renders a synthetic clip: bees walking, an empty entrance and a bee that fades in
+         too slowly for the motion gate and walks away, so the gate changes the counts
+    """
+    hive = SyntheticHive(10, seed=1)
+    board, _ = SyntheticHive(0, seed=1).next()
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (1920, 1080))
+    for _ in range(120):
+        writer.write(hive.next()[0])
+    for _ in range(60):
+        writer.write(board)
+    for i in range(300):
+        a = min(1.0, i / 200.0)
+        color = tuple(b * (1 - a) + f * a for b, f in zip((200, 220, 210), (20, 40, 60)))
+        y = 540.0 + 10 * max(0, i - 240)
+        frame = board.copy()
+        cv2.ellipse(frame, ((960.0, y), (70.0, 130.0), 0.0), color, -1)
+        writer.write(frame)
+    writer.release()
+
+
+def run_sequential(video_file):
+    """! Processes the video in one piece, like the 'ImageProvider' and the 'ImageConsumer'
+    @return tuple (result, frame hashes), the result with the counts of 'VideoAnalysis.getResult'
+    """
+    frame_config = get_frame_config()
+    roi = RegionOfInterest.fromConfig(frame_config)
+    mask = None
+    frame_size = (frame_config[-2][1], frame_config[-2][0])
+    if roi is not None:
+        mask = roi.getMask(len(frame_config) - 1)
+        frame_size = roi.getSize(frame_config[-2][0] / frame_config[-1][0])
+        pyramid = FramePyramid(roi.getFrameConfig(), 2, get_config("FRAME_PYRAMID_INTERPOLATION"))
+    else:
+        pyramid = FramePyramid(frame_config, 2, get_config("FRAME_PYRAMID_INTERPOLATION"))
+    tracker = BeeTracker(get_config("TRACK_DIST_THRESHOLD"), get_config("TRACK_MAX_FRAME_SKIPPED"), frame_size)
+    gate = None
+    if get_config("MOTION_GATE_ENABLED"):
+        gate = MotionGate(get_config("MOTION_GATE_SIZE"), get_config("MOTION_GATE_THRESHOLD"),
+                get_config("MOTION_GATE_MIN_CHANGED"), get_config("MOTION_GATE_LEARNING_RATE"), mask)
+
+    _dh = getStatistics()
+    _, s_in, s_out, _ = _dh.readOverallStatistics()
+    fps = get_frame_rate(video_file) or get_config("TRACKING_FRAME_RATE")
+    decoder = create_decoder(video_file, frame_config, roi, 2)
+    hashes = []
+    frame_t = 0
+    while True:
+        ret, frame = decoder.read()
+        if not ret:
+            break
+        hashes.append((hashlib.md5(frame.tobytes()).hexdigest(), decoder.getPosition()))
+        last_frame_t = frame_t
+        frame_t = decoder.getPosition()
+        if not frame_t > last_frame_t:
+            frame_t = last_frame_t + 1.0 / fps
+
+        fs = pyramid.build(frame)
+        if gate is None or gate.shouldProcess(fs[-1], len(tracker.tracks)):
+            bees, groups = detect_bees(fs[-1], 3, mask)
+            if get_config("ENABLE_TRACKING"):
+                tracker.update(bees, groups, frame_t)
+    decoder.release()
+
+    _, bees_in, bees_out, _ = _dh.readOverallStatistics()
+    return ({"frames": len(hashes), "tracks": tracker.trackId, "bees_in": bees_in - s_in,
+             "bees_out": bees_out - s_out}, hashes)
+
+
+def check_seek(video_file, starts, hashes):
+    """! Checks that the decoder returns the same frame after seeking to a frame as when reading up to it
+    @return True if all checks passed
+    """
+    frame_config = get_frame_config()
+    roi = RegionOfInterest.fromConfig(frame_config)
+    ok = True
+    for start in starts:
+        decoder = create_decoder(video_file, frame_config, roi, 2, start)
+        ret, frame = decoder.read()
+        found = (hashlib.md5(frame.tobytes()).hexdigest(), decoder.getPosition()) if ret else None
+        decoder.release()
+        if found != hashes[start]:
+            print("  seek to frame %i: got %s, expected %s" % (start, found, hashes[start]))
+            ok = False
+    return ok
+
+
+def check_decoder(video_file, folder):
+    """! Compares the offline analysis with the sequential processing using the decoder of the config
+    @return True if all checks passed
+    """
+    expected, hashes = run_sequential(video_file)
+    print("Decoder '%s', sequential: %s" % (get_config("VIDEO_DECODER"), expected))
+
+    # Short segments, the motion gate of the later ones starts after the warm-up
+    fps = get_frame_rate(video_file) or get_config("TRACKING_FRAME_RATE")
+    length = max(1, len(hashes) // 4)
+    set_config("OFFLINE_SEGMENT_LENGTH", length / fps)
+    set_config("OFFLINE_RESULT_FILE", os.path.join(folder, "offline_statistics.csv"))
+    set_config("OFFLINE_RECORD_FOLDER", os.path.join(folder, "records"))
+    ok = check_seek(video_file, range(length, len(hashes), length), hashes)
+
+    result = run_offline_analysis(video_file)[0]
+    found = dict((k, result[k]) for k in expected.keys())
+    print("  offline: %s" % (found,))
+    ok &= found == expected
+
+    # The record replays the same tracks
+    record = DetectionRecord(os.path.join(folder, "records", os.path.basename(video_file)))
+    _dh = getStatistics()
+    _, s_in, s_out, _ = _dh.readOverallStatistics()
+    tracker = BeeTracker(get_config("TRACK_DIST_THRESHOLD"), get_config("TRACK_MAX_FRAME_SKIPPED"),
+            tuple(record.meta["frame_size"]))
+    frames = replay_record(record, tracker)
+    _, bees_in, bees_out, _ = _dh.readOverallStatistics()
+    replayed = {"frames": frames, "tracks": tracker.trackId, "bees_in": bees_in - s_in, "bees_out": bees_out - s_out}
+    print("  replayed record: %s" % (replayed,))
+    ok &= replayed == expected
+    return ok
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    folder = tempfile.mkdtemp(prefix="check_offline_")
+    try:
+        if len(sys.argv) > 1:
+            video_file = sys.argv[1]
+        else:
+            video_file = os.path.join(folder, "synthetic.avi")
+            render_clip(video_file)
+
+        decoders = ["opencv"]
+        if shutil.which(get_config("FFMPEG_BINARY")):
+            decoders.append("ffmpeg")
+        ok = True
+        for decoder in decoders:
+            set_config("VIDEO_DECODER", decoder)
+            ok &= check_decoder(video_file, folder)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print("Offline analysis: %s" % ("ok" if ok else "FAILED",))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+##
+# @file soak.py
+#
+# @brief Runs the full pipeline of 'main.py' headless on a looped video for hours
+#        and reports the resource drift of each process, see the SOAK_* settings.
+#
+#        Run from the 'code' folder:
+#           python3 bench/soak.py --hours 8 [--video recording.avi] [--bees 10]
+#
+#        Without a video a synthetic clip is rendered first. The samples are
+#        written to SOAK_RESULT_FILE, the exit code is 1 if anything drifted
+#        beyond its tolerance.
+
+import os
+import sys
+import argparse
+import subprocess
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from synthetic import SyntheticHive
+
+
+def render_clip(video_file, bees, seconds, fps=30):
+    """! Renders a synthetic clip of a hive entrance to a video file
+    @param video_file   The file to write
+    @param bees         The amount of bees on the frame
+    @param seconds      The length of the clip
+    @param fps          The frame rate of the clip
+    """
+    hive = SyntheticHive(bees, (1920, 1080))
+    writer = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*"MJPG"), fps, (1920, 1080))
+    for _ in range(int(seconds * fps)):
+        frame, _ = hive.next()
+        writer.write(frame)
+    writer.release()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=8, help="Duration of the soak test")
+    parser.add_argument("--video", help="Recorded video to loop, a synthetic clip is used if not given")
+    parser.add_argument("--bees", type=int, default=10, help="Amount of bees on the synthetic clip")
+    parser.add_argument("--seconds", type=int, default=60, help="Length of the synthetic clip")
+    args = parser.parse_args()
+
+    video_file = args.video
+    if video_file is None:
+        video_file = "soak_%i_bees.avi" % (args.bees,)
+        if not os.path.isfile(video_file):
+            print("Rendering synthetic clip '%s'" % (video_file,))
+            render_clip(video_file, args.bees, args.seconds)
+
+    main_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main.py")
+    return subprocess.call([sys.executable, main_file, "--noPreview", "--video", video_file, "--soak", str(args.hours)])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
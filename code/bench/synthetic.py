@@ -0,0 +1,79 @@
+##
+# @file synthetic.py
+#
+# @brief Generates synthetic frames of a hive entrance with bees at known positions.
+
+import cv2
+import numpy as np
+
+
+## Amount of bees on the frame for each density
+DENSITIES = {
+    "sparse": 2,
+    "normal": 10,
+    "busy": 30,
+    "swarming": 80,
+}
+
+
+class SyntheticHive(object):
+    """! Renders frames of a hive entrance board with bees walking in and out.
+         The bees are dark ellipses with a few stripes on a textured background,
+         they move mostly vertically and re-enter the frame on the other side.
+         The ellipses of all bees are returned with each frame as ground truth.
+    """
+
+    def __init__(self, bees, size=(1920, 1080), seed=0):
+        """! Initializes the hive
+        @param bees     The amount of bees on the frame
+        @param size     The frame size (width, height)
+        @param seed     Seed of the random generator, the same seed renders the same frames
+        """
+        super(SyntheticHive, self).__init__()
+        self._size = size
+        self._rng = np.random.default_rng(seed)
+        w, h = size
+        s = h / 1080.0
+
+        # Textured entrance board with a brightness gradient
+        gradient = np.linspace(0.9, 1.05, h).reshape(-1, 1, 1)
+        board = np.full((h, w, 3), (200, 220, 210), dtype=np.float32) * gradient
+        board += self._rng.normal(0, 6, (h, w, 3))
+        self._background = np.clip(board, 0, 255).astype(np.uint8)
+
+        # Position (x, y), velocity (vx, vy), axes and angle of each bee
+        self._bees = []
+        for _ in range(bees):
+            self._bees.append([
+                self._rng.uniform(0.05, 0.95) * w, self._rng.uniform(0, h),
+                self._rng.uniform(-2, 2) * s, self._rng.choice([-1, 1]) * self._rng.uniform(4, 10) * s,
+                self._rng.uniform(60, 75) * s, self._rng.uniform(120, 140) * s,
+                self._rng.uniform(-30, 30)])
+
+    def next(self):
+        """! Moves the bees and renders the next frame
+        @return tuple (frame, ellipses), the ellipses in the format of OpenCV ((x, y), (w, h), angle)
+        """
+        w, h = self._size
+        frame = self._background.copy()
+        ellipses = []
+        for b in self._bees:
+            b[0] = min(max(b[0] + b[2], 0), w)
+            b[1] += b[3]
+            if b[1] < -b[5]:
+                b[1] = h + b[5]
+            elif b[1] > h + b[5]:
+                b[1] = -b[5]
+
+            e = ((float(b[0]), float(b[1])), (float(b[4]), float(b[5])), float(b[6]))
+            cv2.ellipse(frame, e, (20, 40, 60), -1)
+
+            # Stripes on the abdomen
+            for k in (0.15, 0.3):
+                dx = -np.sin(np.radians(b[6])) * b[5] * k
+                dy = np.cos(np.radians(b[6])) * b[5] * k
+                stripe = ((float(b[0] + dx), float(b[1] + dy)), (float(b[4] * 0.8), float(b[5] * 0.06)), float(b[6]))
+                cv2.ellipse(frame, stripe, (40, 70, 90), -1)
+            ellipses.append(e)
+
+        return (frame, ellipses)
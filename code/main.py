@@ -1,86 +1,132 @@
 #!/usr/bin/env python3
-from ImageProcessing import ImageConsumer, ImageExtractor, ImageProvider
 from DetectThread import DetectThread
-from Visual import Visual
+from OfflineAnalysis import run_offline_analysis
+from ResourceMonitor import ResourceMonitor
+from Statistic import getStatistics
+from LoadGovernor import getLoadGovernor
+from Supervisor import Supervisor
+from Pipeline import Pipeline
 from Utils import get_args, get_config
 import logging
 import time
-
-# Only load neural network if needed.
-if get_config("NN_ENABLE"):
-    from BeeDetector import BeeClassification
+import sys
 
 logging.basicConfig(level=logging.DEBUG, format='%(process)d %(asctime)s - %(name)s - %(levelname)s - \t%(message)s')
 logger = logging.getLogger(__name__)
 
 def main():
 
-    # Check input format: camera or video file
+    # Analyse recorded videos offline, without visualization and FPS limit
     args = get_args()
+    if args.batch:
+        logger.info("Starting offline analysis of '%s'" % (args.batch,))
+        run_offline_analysis(args.batch)
+        return
+
+    # The soak test loops the video file for hours
+    if args.soak is not None and not args.video:
+        logger.error("The soak test requires a video file, see --video")
+        return
+
+    # Create the statistics and the governor before the processes, so all of them share them
+    getStatistics()
+    governor = getLoadGovernor()
+
+    # Check input format: camera or video file
     if args.video:
         logger.info("Starting on video file '%s'" % (args.video))
-        imgProvider = ImageProvider(video_file=args.video)
+        provider_args = {"video_file": args.video, "loop": args.soak is not None}
     else:
         logger.info("Starting on camera input")
-        imgProvider = ImageProvider(video_source=0)
+        provider_args = {"video_source": 0}
 
-    while(not (imgProvider.isStarted() or imgProvider.isDone())):
-        time.sleep(1)
+    # Create the processes and the queues between them, as given by the config
+    pipeline = Pipeline.fromConfig({"ImageProvider": provider_args})
+    wifi = None
 
-    if imgProvider.isDone():
-        logger.error("Aborted, ImageProvider did not start. Please see log for errors!")
-        return
+    # The supervisor starts the processes in parallel and restarts crashed ones.
+    # The program ends when a required stage finished, e.g. at the end of the video.
+    supervisor = Supervisor(get_config("PROCESS_RESTART_DELAY_MIN"), get_config("PROCESS_RESTART_DELAY_MAX"),
+            get_config("PROCESS_MAX_RESTARTS"), get_config("PROCESS_REPORT_INTERVAL"), pipeline.repairQueues,
+            get_config("PROCESS_STOP_TIMEOUT"))
+    for name, process, required, background in pipeline.getProcesses():
+        supervisor.add(name, process, required, get_config("PROCESS_RESTART_ENABLED"), background)
 
-    # Enable bee classification process only when its enabled
-    imgClassifier = None
-    if get_config("NN_ENABLE"):
-        imgClassifier = BeeClassification()
+    # The governor watches the queues, named after the receiving worker. The frames are
+    # covered by the lag of the consumer, the provider reads ahead from video files.
+    workers = dict((name, process) for name, process, _, _ in pipeline.getProcesses())
+    for name, q in pipeline.getQueues():
+        if name.endswith(".frames"):
+            continue
+        governor.addQueue(name, q, pipeline.getQueueSize(name), workers[name.rpartition(".")[0]])
 
-    # Create processes and connect message queues between them
-    wifi = None
-    if get_config("WIFI_ENABLE"):
-        wifi = DetectThread()
-    imgExtractor = ImageExtractor()
-    imgConsumer = ImageConsumer()
-    visualiser = Visual()
-    imgConsumer.setImageQueue(imgProvider.getQueue())
-    imgConsumer.setVisualQueue(visualiser.getInQueue())
-    if get_config("NN_ENABLE"):
-        imgExtractor.setResultQueue(imgClassifier.getQueue())
-        imgConsumer.setClassifierResultQueue(imgClassifier.getResultQueue())
-    imgExtractor.setInQueue(imgConsumer.getPositionQueue())
+    # Sample the resources of all processes during the soak test
+    monitor = None
+    drift = []
+    if args.soak is not None:
+        logger.info("Starting soak test for %0.2f hours" % (args.soak,))
+        monitor = ResourceMonitor(get_config("SOAK_SAMPLE_INTERVAL"), get_config("SOAK_WARMUP"),
+                get_config("SOAK_WINDOW"),
+                {"rss": get_config("SOAK_TOLERANCE_RSS"), "fds": get_config("SOAK_TOLERANCE_FDS"),
+                 "threads": get_config("SOAK_TOLERANCE_THREADS"), "queue": get_config("SOAK_TOLERANCE_QUEUE"),
+                 "fps": get_config("SOAK_TOLERANCE_FPS")},
+                get_config("SOAK_RESULT_FILE"))
+        monitor.addProcess("main")
+        for name, process, _, _ in pipeline.getProcesses():
+            monitor.addProcess(name, process)
+        for name, q in pipeline.getQueues():
+            monitor.addQueue(name, q)
+        soak_start = time.time()
+        soak_end = soak_start + args.soak * 3600.0
 
     try:
 
-        # Start the processes
-        imgConsumer.start()
-        imgExtractor.start()
-        visualiser.start()
-        if wifi is not None:
+        # Start the processes and wait until they are ready
+        if not supervisor.start(get_config("PROCESS_READY_TIMEOUT")):
+            logger.error("Aborted, not all processes started. Please see log for errors!")
+            raise SystemExit(0)
+
+        # Create the WiFi thread after the processes were forked, so they don't inherit its spool
+        if get_config("WIFI_ENABLE"):
+            wifi = DetectThread()
             wifi.start()
 
-        # Quit program if end of video-file is reached or the camera got disconnected
-        #imgConsumer.join()
-        while True:
+        # Watch the processes until the pipeline ends
+        while supervisor.check():
             time.sleep(0.01)
-            if imgConsumer.isDone() or imgProvider.isDone():
-                raise SystemExit(0)
+
+            # Shed load under overload, counting the bees takes priority
+            if get_config("GOVERNOR_ENABLED"):
+                governor.update()
+
+            # End the soak test after the given time
+            if monitor is not None:
+                monitor.update()
+                if time.time() > soak_end:
+                    break
 
     except (KeyboardInterrupt, SystemExit):
+        pass
+
+    # The soak test fails if the pipeline ended early, a process restarted or a value drifted
+    if monitor is not None:
+        drift = monitor.report()
+        if time.time() <= soak_end:
+            drift.append("pipeline ended after %0.2f of %0.2f hours" % ((time.time() - soak_start) / 3600.0, args.soak))
+            logger.error("Soak test failed, %s" % (drift[-1],))
+        for name, restarts in supervisor.getRestartCounts().items():
+            if restarts:
+                drift.append("%s: restarted %i times" % (name, restarts))
+                logger.error("Soak test failed, %s" % (drift[-1],))
+
+    # Tear down all running process to ensure that we don't get any zombies
+    if wifi is not None and wifi.is_alive():
+        wifi.stop()
+    supervisor.stop(get_config("PROCESS_STOP_TIMEOUT"))
 
-        # Tear down all running process to ensure that we don't get any zombies
-        if wifi is not None:
-            wifi.stop()
-        imgProvider.stop()
-        imgExtractor.stop()
-        visualiser.stop()
-        imgConsumer.stop()
-        if imgClassifier:
-            imgClassifier.stop()
-            imgClassifier.join()
-        imgExtractor.join()
-        imgProvider.join()
-        visualiser.join()
+    # Report the drift of the soak test by the exit code
+    if len(drift):
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()